@@ -0,0 +1,78 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from chat.router import ToolCallScanner, extract_tool_calls
+
+
+def legacy_maybe_parse_tool_call(text):
+    """The brace-counting parser chat.router used before ToolCallScanner (minus its print)."""
+    s = text.strip()
+
+    if "{\"tool\":" not in s:
+        return None
+    try:
+        start_index = s.find("{\"tool\":")
+        count = 0
+        for i in range(start_index, len(s)):
+            if s[i] == "{":
+                count += 1
+            elif s[i] == "}":
+                count -= 1
+            if count == 0:
+                break
+            end_index = i + 1
+        s = s[start_index:end_index+1]
+        obj = json.loads(s)
+        if isinstance(obj, dict) and "tool" in obj and "parameters" in obj:
+            return obj
+    except Exception:
+        pass
+    return None
+
+
+SLOTS = [
+    {"id": i, "start": f"2025-10-{20 + i // 20:02d}T{9 + (i % 20) // 2:02d}:{30 * (i % 2):02d}:00+00:00"}
+    for i in range(40)
+]
+
+CASES = {
+    "single_call": '{"tool":"verify_patient","parameters":{"name":"Alice Kim","phone":"6045550101"}}',
+    "prose_only": "I found several cleaning slots next week: Tuesday at 9 AM, Wednesday at 11 AM "
+                  "and Friday at 2 PM. Which one would you like to book? " * 3,
+    "brace_in_string": '{"tool":"book_appointment","parameters":{"patient_info":{"name":"Alice Kim",'
+                       '"phone":"604"},"type":"cleaning","start":"2025-10-24T11:00:00",'
+                       '"notes":"prefers {left} side }"}}',
+    "two_calls": '{"tool":"verify_patient","parameters":{"name":"Alice Kim","phone":"604"}}\n'
+                 '{"tool":"list_appointments","parameters":{"patient_id":1,"date_range":"next 60 days"}}',
+    "large_params": json.dumps({"tool": "book_appointment", "parameters": {"notes": "x", "slots": SLOTS}}),
+}
+
+
+def _scan_streamed(text, chunk_size=16):
+    scanner = ToolCallScanner()
+    for i in range(0, len(text), chunk_size):
+        scanner.feed(text[i:i + chunk_size])
+    scanner.finish()
+    return scanner.calls
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark chat.router's tool-call extraction against the previous brace-counting parser."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=20000, help="Calls per case.")
+
+    def handle(self, *args, **opts):
+        number = opts["number"]
+        self.stdout.write(f"{'case':<16} {'legacy us':>10} {'scanner us':>11} {'streamed us':>12}  calls legacy/scanner")
+        for name, text in CASES.items():
+            legacy = timeit.timeit(lambda: legacy_maybe_parse_tool_call(text), number=number) / number * 1e6
+            scanner = timeit.timeit(lambda: extract_tool_calls(text), number=number) / number * 1e6
+            streamed = timeit.timeit(lambda: _scan_streamed(text), number=number) / number * 1e6
+            found_legacy = 1 if legacy_maybe_parse_tool_call(text) else 0
+            found_scanner = len(extract_tool_calls(text))
+            self.stdout.write(
+                f"{name:<16} {legacy:>10.2f} {scanner:>11.2f} {streamed:>12.2f}  {found_legacy}/{found_scanner}"
+            )
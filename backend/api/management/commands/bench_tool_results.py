@@ -0,0 +1,83 @@
+import datetime
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+
+from chat.compaction import CHARS_PER_TOKEN
+from chat.serializer import encode_tool_result, orjson
+
+
+def legacy_encode(payload):
+    """The json.dumps call ChatbotView used before chat.serializer, on the old ISO-string payloads."""
+    return json.dumps(
+        payload,
+        default=lambda o: o.isoformat() if isinstance(o, (datetime.date, datetime.datetime)) else str(o),
+    )
+
+
+def _iso(value):
+    if isinstance(value, dict):
+        return {k: _iso(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_iso(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _payloads():
+    base = timezone.make_aware(datetime.datetime(2025, 10, 20, 9, 0))
+    slot = datetime.timedelta(minutes=30)
+    window = {"start": base, "end": base + datetime.timedelta(days=7)}
+    slots = [
+        {"id": 1000 + i, "start": base + i * slot, "end": base + (i + 1) * slot}
+        for i in range(50)
+    ]
+    appointments = [
+        {"appointment_id": 500 + i, "type": "cleaning", "start": base + i * 3 * slot,
+         "end": base + (i * 3 + 1) * slot, "notes": ""}
+        for i in range(10)
+    ]
+    return {
+        "verify_patient": {"ok": True, "patient_id": 11, "name": "Alice Kim", "phone": "6045550101"},
+        "find_slots_10": {"ok": True, "type": "cleaning", "range": window, "slots": slots[:10],
+                          "has_more": True, "next_cursor": "after:2025-10-20T13:30:00+00:00"},
+        "find_slots_50": {"ok": True, "type": "cleaning", "range": window, "slots": slots,
+                          "has_more": False, "next_cursor": None},
+        "list_appts_10": {"ok": True, "patient": {"user_id": 11, "name": "Alice Kim", "phone": "6045550101"},
+                          "range": window, "appointments": appointments},
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare TOOL_RESULT encodings (bytes, estimated tokens, encode time) against the previous json.dumps path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=5000, help="Encodes per case.")
+
+    def handle(self, *args, **opts):
+        number = opts["number"]
+        variants = [
+            ("legacy", lambda p: legacy_encode(_iso(p)), {}),
+            ("compact/json", encode_tool_result, {"JSON_BACKEND": "json"}),
+        ]
+        if orjson is not None:
+            variants.append(("compact/orjson", encode_tool_result, {"JSON_BACKEND": "orjson"}))
+        else:
+            self.stdout.write("orjson not installed; skipping that backend")
+
+        self.stdout.write(f"{'case':<16} {'variant':<16} {'bytes':>7} {'tokens':>7} {'encode us':>10}")
+        for name, payload in _payloads().items():
+            for label, encode, conf in variants:
+                with override_settings(CHAT_TOOL_RESULT_FORMAT=conf):
+                    # legacy includes the isoformat() calls the tools used to make
+                    text = encode(payload)
+                    seconds = timeit.timeit(lambda: encode(payload), number=number)
+                size = len(text.encode())
+                self.stdout.write(
+                    f"{name:<16} {label:<16} {size:>7} {len(text) // CHARS_PER_TOKEN:>7} "
+                    f"{seconds / number * 1e6:>10.1f}"
+                )
@@ -0,0 +1,237 @@
+import contextlib
+import io
+import json
+import platform
+import statistics
+import time as clock
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from appointments.management.commands.create_timeslots import (
+    bulk_generate_availability_window, generate_availability_window,
+)
+from appointments.management.commands.seed_bench_data import PHONE_PREFIX, TYPES
+from appointments.models import Appointment, Availability, Patient
+from chat import tools
+from scheduling import engine
+
+BASELINE_DIR = Path(settings.BASE_DIR) / "benchmarks" / "baselines"
+OPS = (
+    "verify_patient", "list_appointments", "find_slots", "find_slots_summary",
+    "book_appointment", "reschedule_appointment", "generate_availability_window",
+    "bulk_generate_availability_window",
+)
+WRITE_OPS = {"book_appointment", "reschedule_appointment",
+             "generate_availability_window", "bulk_generate_availability_window"}
+# compared against a baseline; max_ms is too noisy to gate on
+GATED = ("p50_ms", "p95_ms", "queries")
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _stub_window(days_ahead: int, length: int):
+    """Stands in for parse_fuzzy_date_range: a fixed window, no Gemini call."""
+    first = timezone.localdate() + timedelta(days=days_ahead)
+    start = timezone.make_aware(datetime.combine(first, time.min))
+
+    def parse(phrase, *args, **kwargs):
+        return start, start + timedelta(days=length)
+
+    return parse
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the chat tools against the current database (seed it with seed_bench_data): "
+        "latency percentiles and queries per call. The fuzzy date parser is stubbed and "
+        "writes are rolled back. Baselines can be saved and compared."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50, help="Timed calls per operation.")
+        parser.add_argument("--warmup", type=int, default=3, help="Untimed calls per operation first.")
+        parser.add_argument("--ops", nargs="+", choices=OPS, default=list(OPS))
+        parser.add_argument("--days-ahead", type=int, default=7, help="Where the stubbed date window starts.")
+        parser.add_argument("--window-days", type=int, default=7, help="Length of the stubbed date window.")
+        parser.add_argument("--generate-days", type=int, default=7, help="Days per generate_availability_window call.")
+        parser.add_argument("--save-baseline", metavar="NAME", help=f"Write results to {BASELINE_DIR}/NAME.json.")
+        parser.add_argument("--compare", metavar="NAME", help="Compare with a saved baseline.")
+        parser.add_argument("--threshold", type=float, default=20.0,
+                            help="Percent slowdown (or extra queries) that counts as a regression.")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+
+    def handle(self, *args, **opts):
+        patients = list(
+            Patient.objects.filter(phone__startswith=PHONE_PREFIX, appointments__isnull=False)
+            .distinct().order_by("id").values("id", "full_name", "phone")[:max(opts["iterations"], 1)]
+        ) or list(Patient.objects.order_by("id").values("id", "full_name", "phone")[:max(opts["iterations"], 1)])
+        if not patients:
+            raise CommandError("No patients; run seed_bench_data first.")
+        self.patients = patients
+        self.opts = opts
+
+        parse = _stub_window(opts["days_ahead"], opts["window_days"])
+        results = {}
+        with mock.patch.object(tools, "parse_fuzzy_date_range", parse):
+            for op in opts["ops"]:
+                results[op] = self._measure(op)
+
+        report = {
+            "engine": "computed" if engine.is_enabled() else "materialized",
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "iterations": opts["iterations"],
+            "dataset": {
+                "patients": Patient.objects.count(),
+                "availability": Availability.objects.count(),
+                "appointments": Appointment.objects.count(),
+            },
+            "results": results,
+        }
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self._print(report)
+
+        if opts["save_baseline"]:
+            BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+            path = BASELINE_DIR / f"{opts['save_baseline']}.json"
+            path.write_text(json.dumps(report, indent=2) + "\n")
+            self.stdout.write(f"baseline written to {path}")
+        if opts["compare"]:
+            self._compare(report, opts["compare"], opts["threshold"])
+
+    # -- operations: _prepare returns the call to time for iteration i; setup work runs untimed
+
+    def _patient(self, i):
+        return self.patients[i % len(self.patients)]
+
+    def _free_start(self, appt_type: str, i: int):
+        """A bookable start for appt_type, varying with i; None if the window is full."""
+        found = tools.find_slots({"type": appt_type, "count": 50})
+        slots = found.get("slots") or []
+        if not slots:
+            return None
+        start = slots[i % len(slots)]["start"]
+        return timezone.localtime(start).replace(tzinfo=None).isoformat()
+
+    def _prepare(self, op: str, i: int):
+        p = self._patient(i)
+        appt_type = TYPES[i % len(TYPES)]
+        if op == "verify_patient":
+            params = {"name": p["full_name"], "phone": p["phone"]}
+            return lambda: tools.verify_patient(params)
+        if op == "list_appointments":
+            params = {"name": p["full_name"], "phone": p["phone"], "include_past": True}
+            return lambda: tools.list_appointments(params)
+        if op == "find_slots":
+            params = {"type": appt_type, "date_range": "next week", "count": 10}
+            return lambda: tools.find_slots(params)
+        if op == "find_slots_summary":
+            params = {"type": appt_type, "date_range": "next week", "mode": "summary"}
+            return lambda: tools.find_slots(params)
+        if op == "book_appointment":
+            params = {
+                "patient_info": {"name": p["full_name"], "phone": p["phone"]},
+                "type": appt_type, "start": self._free_start(appt_type, i),
+            }
+            return lambda: tools.book_appointment(params)
+        if op == "reschedule_appointment":
+            booked = tools.book_appointment({
+                "patient_info": {"name": p["full_name"], "phone": p["phone"]},
+                "type": appt_type, "start": self._free_start(appt_type, i),
+            })
+            if not booked.get("ok"):
+                raise CommandError(f"could not book an appointment to reschedule: {booked}")
+            params = {"appointment_id": booked["appointment_id"], "new_start": self._free_start(appt_type, i + 1)}
+            return lambda: tools.reschedule_appointment(params)
+        first = timezone.now() + timedelta(days=self.opts["days_ahead"] + i % 30)
+        days = self.opts["generate_days"]
+        if op == "generate_availability_window":
+            return lambda: generate_availability_window(start_dt=first, days=days)
+        return lambda: bulk_generate_availability_window(start_dt=first, days=days)
+
+    def _measure(self, op: str) -> dict:
+        timings, queries, failures = [], [], 0
+        warmup, iterations = self.opts["warmup"], self.opts["iterations"]
+        for i in range(warmup + iterations):
+            with contextlib.ExitStack() as stack:
+                if op in WRITE_OPS:
+                    stack.enter_context(transaction.atomic())
+                # generate_availability_window prints per day
+                stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+                call = self._prepare(op, i)
+                with CaptureQueriesContext(connection) as captured:
+                    t0 = clock.perf_counter()
+                    try:
+                        result = call()
+                    except Exception:
+                        result = None
+                    elapsed = clock.perf_counter() - t0
+                if op in WRITE_OPS:
+                    transaction.set_rollback(True)
+            if i < warmup:
+                continue
+            if result is None or (isinstance(result, dict) and not result.get("ok")):
+                failures += 1
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+        return {
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p95_ms": round(percentile(timings, 95), 3),
+            "p99_ms": round(percentile(timings, 99), 3),
+            "max_ms": round(max(timings), 3),
+            "queries": round(statistics.mean(queries), 2),
+            "failures": failures,
+        }
+
+    def _print(self, report):
+        d = report["dataset"]
+        self.stdout.write(
+            f"engine={report['engine']} db={report['database']} patients={d['patients']} "
+            f"availability={d['availability']} appointments={d['appointments']} n={report['iterations']}"
+        )
+        self.stdout.write(f"{'operation':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+                          f"{'queries':>8} {'fail':>5}")
+        for op, r in report["results"].items():
+            self.stdout.write(
+                f"{op:<34} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['max_ms']:>9.2f} "
+                f"{r['queries']:>8.1f} {r['failures']:>5}"
+            )
+
+    def _compare(self, report, name: str, threshold: float):
+        path = BASELINE_DIR / f"{name}.json"
+        if not path.exists():
+            raise CommandError(f"No baseline {path}")
+        baseline = json.loads(path.read_text())
+        regressions = []
+        self.stdout.write(f"compared with {name} (threshold {threshold:g}%):")
+        for op, r in report["results"].items():
+            before = baseline["results"].get(op)
+            if not before:
+                continue
+            cells = []
+            for metric in GATED:
+                old, new = before[metric], r[metric]
+                change = (new - old) / old * 100 if old else 0.0
+                cells.append(f"{metric} {old:g}->{new:g} ({change:+.0f}%)")
+                if change > threshold:
+                    regressions.append(f"{op} {metric}")
+            self.stdout.write(f"  {op:<34} " + "  ".join(cells))
+        if regressions:
+            raise CommandError("Regressed: " + ", ".join(regressions))
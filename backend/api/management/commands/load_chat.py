@@ -0,0 +1,329 @@
+import json
+import random
+import re
+import statistics
+import threading
+import time as clock
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.utils import timezone
+
+from api.management.commands.bench_tools import percentile
+from appointments.management.commands.seed_bench_data import CLOSE_HOUR, OPEN_HOUR, PHONE_PREFIX, SLOT_MINUTES
+from appointments.models import Appointment, Patient
+
+SCRIPT = Path(settings.BASE_DIR) / "benchmarks" / "chat_load_script.json"
+
+# Each scenario is the user's turns after the opening menu; placeholders are
+# filled per conversation. benchmarks/chat_load_script.json has replay rules
+# that turn these turns into the matching tool calls.
+SCENARIOS = {
+    "book": [
+        "1",
+        "existing patient",
+        "I'm {name}, my phone is {phone}",
+        "Are there any {type} openings next week?",
+        "Please book the {type} at {start} for {name}, phone {phone}",
+    ],
+    "reschedule": [
+        "2",
+        "I'm {name}, my phone is {phone}",
+        "What are the appointments for {name}, phone {phone}?",
+        "Please move appointment {appointment_id} to {start}",
+    ],
+    "cancel": [
+        "2",
+        "I'm {name}, my phone is {phone}",
+        "Please cancel appointment {appointment_id}",
+    ],
+    "general": [
+        "3",
+        "What are your opening hours on Saturday?",
+        "Do you accept insurance?",
+    ],
+    "emergency": [
+        "I have a broken tooth and severe pain",
+        "I'm {name}, my phone is {phone}",
+    ],
+}
+DEFAULT_MIX = "book=4,reschedule=2,cancel=1,general=2,emergency=1"
+# the script answers a failed tool call ({"ok": false, "error": ...}) with this
+TOOL_ERROR_RE = re.compile(r"\(tool error: ([^)]*)\)")
+TYPES = ("cleaning", "checkup", "filling")
+
+
+def _mix(text: str):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise CommandError(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return list(weights), list(weights.values())
+
+
+class DbConnections:
+    """Connections opened by this process, and a sampled peak of the server's open connections (PostgreSQL)."""
+
+    def __init__(self, interval: float = 0.25):
+        self.opened = 0
+        self.samples = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._interval = interval
+        self._thread = None
+
+    def _created(self, sender, connection, **kwargs):
+        with self._lock:
+            self.opened += 1
+
+    def _sample(self):
+        try:
+            while not self._stop.wait(self._interval):
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
+                    self.samples.append(cursor.fetchone()[0])
+        finally:
+            close_old_connections()
+
+    def __enter__(self):
+        connection_created.connect(self._created)
+        if connection.vendor == "postgresql":
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self._created)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self):
+        out = {"opened": self.opened}
+        if self.samples:
+            out.update(server_peak=max(self.samples), server_mean=round(statistics.mean(self.samples), 1))
+        return out
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive /api/chat/ with scripted multi-turn conversations (book, reschedule, cancel, "
+        "general inquiry, emergency) at a given concurrency and arrival rate, and report "
+        "throughput, per-turn latency percentiles, errors and DB connection usage. Run the "
+        "target with CHAT_LLM_BACKEND=replay and CHAT_LLM_SCRIPT=benchmarks/chat_load_script.json, "
+        "against data from seed_bench_data; reschedule/cancel modify seeded appointments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", help="Chat endpoint of a running server; default runs requests in-process.")
+        parser.add_argument("--path", default="/api/chat/", help="Endpoint path for in-process requests.")
+        parser.add_argument("--host", default="localhost", help="Host header for in-process requests.")
+        parser.add_argument("--conversations", type=int, default=100)
+        parser.add_argument("--concurrency", type=int, default=10, help="Conversations in flight at once.")
+        parser.add_argument("--rate", type=float, default=0.0,
+                            help="New conversations per second (Poisson arrivals); 0 starts the next one "
+                                 "as soon as a worker is free.")
+        parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between a reply and the next turn.")
+        parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, e.g. book=3,general=1.")
+        parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout with --url.")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def handle(self, *args, **opts):
+        self.opts = opts
+        self.random = random.Random(opts["seed"])
+        if opts["conversations"] < 1 or opts["concurrency"] < 1:
+            raise CommandError("--conversations and --concurrency must be at least 1")
+        names, weights = _mix(opts["mix"])
+        self._pools()
+        # each reschedule/cancel gets an appointment of its own
+        self.random.shuffle(self._appointments)
+        conversations = [self._context(self.random.choices(names, weights)[0])
+                         for _ in range(opts["conversations"])]
+
+        self.turns = defaultdict(list)  # scenario -> per-turn seconds
+        self.errors = Counter()
+        self.queue_waits = []
+        self.completed = 0
+        self._lock = threading.Lock()
+        self._send_local = threading.local()
+
+        llm = getattr(settings, "CHAT_LLM", {})
+        if not opts["url"] and llm.get("BACKEND") != "replay":
+            self.stderr.write(self.style.WARNING("CHAT_LLM BACKEND is not 'replay': this will call Gemini."))
+        elif not opts["url"] and not llm.get("SCRIPT"):
+            self.stderr.write(self.style.WARNING(f"No CHAT_LLM SCRIPT; the load-test rules are in {SCRIPT}"))
+
+        with DbConnections() as db, ThreadPoolExecutor(max_workers=opts["concurrency"]) as pool:
+            t0 = clock.perf_counter()
+            futures = []
+            for ctx in conversations:
+                futures.append(pool.submit(self._run, ctx, clock.perf_counter()))
+                if opts["rate"] > 0:
+                    clock.sleep(self.random.expovariate(opts["rate"]))
+            for f in futures:
+                f.result()
+            elapsed = clock.perf_counter() - t0
+
+        report = self._report(elapsed, db.summary())
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self._print(report)
+
+    # -- conversations
+
+    def _pools(self):
+        """Seeded patients and upcoming appointments to draw conversations from."""
+        limit = 10000
+        self._patients = list(
+            Patient.objects.filter(phone__startswith=PHONE_PREFIX)
+            .order_by("id").values("full_name", "phone")[:limit]
+        )
+        self._appointments = list(
+            Appointment.objects.filter(
+                patient__phone__startswith=PHONE_PREFIX, status=Appointment.Status.BOOKED, start__gte=timezone.now()
+            ).order_by("id").values("id", "type", "patient__full_name", "patient__phone")[:limit]
+        )
+        if not self._patients or not self._appointments:
+            raise CommandError("No seeded patients or upcoming appointments; run seed_bench_data first.")
+
+    def _context(self, scenario: str):
+        """Placeholder values for one conversation: a seeded patient and, if needed, one of their appointments."""
+        ctx = {"scenario": scenario, "type": self.random.choice(TYPES), "start": self._start()}
+        if scenario in ("reschedule", "cancel"):
+            if not self._appointments:
+                raise CommandError("More reschedule/cancel conversations than seeded upcoming appointments.")
+            appt = self._appointments.pop()
+            ctx.update(appointment_id=appt["id"], type=appt["type"],
+                       name=appt["patient__full_name"], phone=appt["patient__phone"])
+        else:
+            patient = self.random.choice(self._patients)
+            ctx.update(name=patient["full_name"], phone=patient["phone"])
+        return ctx
+
+    def _start(self) -> str:
+        """A random slot start in the next two weeks on the seeded grid (clinic-local ISO)."""
+        slots_per_day = (CLOSE_HOUR - OPEN_HOUR) * 60 // SLOT_MINUTES
+        day = timezone.localdate() + timedelta(days=self.random.randint(1, 14))
+        if day.weekday() == 6:
+            day += timedelta(days=1)
+        start = datetime.combine(day, time(OPEN_HOUR)) + timedelta(
+            minutes=SLOT_MINUTES * self.random.randrange(slots_per_day)
+        )
+        return start.isoformat(timespec="minutes")
+
+    def _send(self, body: dict):
+        """(status, json) for one POST."""
+        if self.opts["url"]:
+            import httpx
+
+            client = getattr(self._send_local, "client", None)
+            if client is None:
+                client = self._send_local.client = httpx.Client(timeout=self.opts["timeout"])
+            r = client.post(self.opts["url"], json=body)
+            return r.status_code, (r.json() if r.headers.get("content-type", "").startswith("application/json") else {})
+        client = getattr(self._send_local, "client", None)
+        if client is None:
+            client = self._send_local.client = Client(raise_request_exception=False, HTTP_HOST=self.opts["host"])
+        r = client.post(self.opts["path"], body, content_type="application/json")
+        return r.status_code, (r.json() if r.get("Content-Type", "").startswith("application/json") else {})
+
+    def _run(self, ctx, submitted: float):
+        started = clock.perf_counter()
+        scenario = ctx["scenario"]
+        try:
+            conversation_id = None
+            for n, template in enumerate([""] + SCENARIOS[scenario]):
+                body = {"message": template.format(**ctx)}
+                if conversation_id:
+                    body["conversation_id"] = conversation_id
+                t0 = clock.perf_counter()
+                try:
+                    status, data = self._send(body)
+                except Exception as e:
+                    status, data = None, {"error": type(e).__name__}
+                seconds = clock.perf_counter() - t0
+                with self._lock:
+                    self.turns[scenario].append(seconds)
+                    if status is None or status >= 400:
+                        self.errors[f"{scenario}:{status or data['error']}"] += 1
+                    elif data.get("partial"):
+                        self.errors[f"{scenario}:partial_{data.get('stop_reason')}"] += 1
+                    else:
+                        failed = TOOL_ERROR_RE.search(data.get("reply") or "")
+                        if failed:
+                            self.errors[f"{scenario}:tool_{failed.group(1) or 'failed'}"] += 1
+                if status is None or status >= 400:
+                    return
+                conversation_id = data.get("conversation_id", conversation_id)
+                if self.opts["think_time"] and n < len(SCENARIOS[scenario]):
+                    clock.sleep(self.opts["think_time"])
+            with self._lock:
+                self.completed += 1
+        finally:
+            with self._lock:
+                self.queue_waits.append(started - submitted)
+
+    # -- report
+
+    def _report(self, elapsed: float, db: dict) -> dict:
+        def stats(values):
+            ms = [v * 1000 for v in values]
+            return {
+                "turns": len(ms),
+                "p50_ms": round(percentile(ms, 50), 1),
+                "p95_ms": round(percentile(ms, 95), 1),
+                "p99_ms": round(percentile(ms, 99), 1),
+                "max_ms": round(max(ms), 1) if ms else 0.0,
+            }
+
+        every = [v for values in self.turns.values() for v in values]
+        errors = sum(self.errors.values())
+        return {
+            "target": self.opts["url"] or f"in-process {self.opts['path']}",
+            "conversations": self.opts["conversations"],
+            "completed": self.completed,
+            "concurrency": self.opts["concurrency"],
+            "rate": self.opts["rate"],
+            "elapsed_s": round(elapsed, 2),
+            "turns_per_s": round(len(every) / elapsed, 1),
+            "conversations_per_s": round(self.completed / elapsed, 2),
+            "error_rate": round(errors / len(every), 4) if every else 0.0,
+            "errors": dict(self.errors),
+            "queue_wait_p95_ms": round(percentile([w * 1000 for w in self.queue_waits], 95), 1),
+            "latency": {"all": stats(every), **{name: stats(v) for name, v in sorted(self.turns.items())}},
+            "db_connections": db,
+        }
+
+    def _print(self, r):
+        self.stdout.write(
+            f"target={r['target']} conversations={r['completed']}/{r['conversations']} "
+            f"concurrency={r['concurrency']} rate={r['rate'] or 'closed-loop'} elapsed={r['elapsed_s']}s"
+        )
+        self.stdout.write(
+            f"throughput {r['turns_per_s']} turns/s, {r['conversations_per_s']} conversations/s; "
+            f"queue wait p95 {r['queue_wait_p95_ms']}ms"
+        )
+        self.stdout.write(f"{'scenario':<12} {'turns':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, s in r["latency"].items():
+            self.stdout.write(
+                f"{name:<12} {s['turns']:>6} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}"
+            )
+        self.stdout.write(f"error rate {r['error_rate']:.2%}")
+        for key, n in sorted(r["errors"].items()):
+            self.stdout.write(f"  {key:<32} {n}")
+        db = r["db_connections"]
+        line = f"db connections opened {db['opened']}"
+        if "server_peak" in db:
+            line += f", server peak {db['server_peak']} (mean {db['server_mean']})"
+        self.stdout.write(line)
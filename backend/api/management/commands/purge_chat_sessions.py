@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.sessions import DatabaseSessionStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete ChatSession rows idle for longer than CHAT_SESSION_STORE['TTL'] seconds "
+        "(the database session store never evicts on its own). Run it from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl", type=int, default=None,
+                            help="Idle seconds after which a conversation is deleted (default: the setting).")
+
+    def handle(self, *args, **opts):
+        conf = getattr(settings, "CHAT_SESSION_STORE", {}) or {}
+        ttl = opts["ttl"] if opts["ttl"] is not None else int(conf.get("TTL", 3600))
+        deleted = DatabaseSessionStore(ttl=ttl).purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired chat sessions."))
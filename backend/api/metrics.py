@@ -0,0 +1,49 @@
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+from chat.answer_cache import answer_cache_stats
+from chat.compaction import compaction_stats
+from chat.intent import intent_stats
+from chat.llm import replay_stats
+from chat.router import tool_pool_stats
+from scheduling.availability_cache import availability_cache_stats
+from chat.prompt_cache import token_usage
+from chat.tracing import render
+from scheduling.fuzzy import cache_stats as fuzzy_cache_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _counters():
+    """Totals kept by the existing *_stats objects, exported next to the histograms."""
+    return [
+        ("llm_calls_total", "counter", "Gemini calls", token_usage.calls),
+        ("llm_prompt_tokens_total", "counter", "Prompt tokens sent to Gemini", token_usage.prompt_tokens),
+        ("llm_cached_tokens_total", "counter", "Prompt tokens served from the context cache", token_usage.cached_tokens),
+        ("llm_output_tokens_total", "counter", "Output tokens generated by Gemini", token_usage.output_tokens),
+        ("fuzzy_range_cache_hits_total", "counter", "Fuzzy date range cache hits", fuzzy_cache_stats.hits),
+        ("fuzzy_range_cache_misses_total", "counter", "Fuzzy date range cache misses", fuzzy_cache_stats.misses),
+        ("history_compactions_total", "counter", "Chat histories compacted", compaction_stats.compacted),
+        ("history_tokens_saved_total", "counter", "Estimated tokens removed by compaction", compaction_stats.tokens_saved),
+        ("intent_routed_total", "counter", "Turns routed by the local intent router", intent_stats.routed),
+        ("intent_llm_calls_avoided_total", "counter", "Turns answered without a model call", intent_stats.llm_calls_avoided),
+        ("answer_cache_lookups_total", "counter", "General-inquiry answer cache lookups", answer_cache_stats.lookups),
+        ("answer_cache_hits_total", "counter", "General-inquiry answer cache hits", answer_cache_stats.hits),
+        ("availability_cache_hits_total", "counter", "Availability cache day hits", availability_cache_stats.hits),
+        ("availability_cache_misses_total", "counter", "Availability cache day misses", availability_cache_stats.misses),
+        ("availability_cache_invalidations_total", "counter", "Availability cache days invalidated",
+         availability_cache_stats.invalidations),
+        ("tool_timeouts_total", "counter", "Pooled read-only tool calls that outlived the turn deadline",
+         tool_pool_stats.timeouts),
+        ("tool_abandoned_running", "gauge", "Timed-out tool calls still holding a pool thread",
+         tool_pool_stats.abandoned_running),
+        ("llm_replay_recorded_total", "counter", "Replayed model calls served from recordings", replay_stats.recorded),
+        ("llm_replay_scripted_total", "counter", "Replayed model calls served by scripted rules", replay_stats.scripted),
+        ("llm_replay_misses_total", "counter", "Replayed model calls with no response", replay_stats.misses),
+    ]
+
+
+@require_GET
+def metrics(request):
+    """Prometheus scrape endpoint."""
+    return HttpResponse(render(_counters()), content_type=CONTENT_TYPE)
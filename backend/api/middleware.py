@@ -0,0 +1,41 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from chat.tracing import observe_request, request_trace, traced_stream
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.url_name or match.view_name if match else "unmatched"
+
+
+def _observe(request, response, trace, t0):
+    def finish():
+        observe_request(trace, _view_name(request), request.method, response.status_code, perf_counter() - t0)
+
+    if response.streaming:
+        # the body (e.g. an SSE chat turn) runs after we return; record it when it ends
+        response.streaming_content = traced_stream(response.streaming_content, trace, finish)
+    else:
+        finish()
+    return response
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """Per-request latency, DB query count/time and span summary (see chat.tracing)."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            t0 = perf_counter()
+            with request_trace() as trace:
+                response = await get_response(request)
+            return _observe(request, response, trace, t0)
+    else:
+        def middleware(request):
+            t0 = perf_counter()
+            with request_trace() as trace:
+                response = get_response(request)
+            return _observe(request, response, trace, t0)
+    return middleware
@@ -1,3 +1,15 @@
 from django.db import models
 
 # Create your models here.
+
+
+class ChatSession(models.Model):
+    """Server-side conversation history for the chat endpoint (chat.sessions)."""
+    id = models.CharField(primary_key=True, max_length=64)
+    flow = models.CharField(max_length=64, default="general_info")
+    messages = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["updated_at"])]
@@ -1,3 +1,187 @@
-from django.test import TestCase
+from datetime import datetime, time
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from chat.answer_cache import AnswerCache, borrows_from
+from chat.router import ToolCallScanner, extract_tool_calls
+from scheduling.fuzzy import FuzzyContext, _rule_parse_range
+
+
+def _local(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class RuleParseRangeTests(SimpleTestCase):
+    ctx = FuzzyContext(open_time=time(9), close_time=time(17), open_weekdays=frozenset(range(6)))
+    # a Friday
+    morning = _local(2025, 6, 13, 10, 15)
+    after_hours = _local(2025, 6, 13, 18, 30)
+
+    def check(self, now, cases):
+        for phrase, expected in cases:
+            with self.subTest(phrase=phrase, now=now):
+                got = _rule_parse_range(phrase, now, self.ctx)
+                if expected is None:
+                    self.assertIsNone(got)
+                else:
+                    self.assertEqual(got, (_local(*expected[0]), _local(*expected[1])))
+
+    def test_relative_days(self):
+        self.check(self.morning, [
+            ("today", ((2025, 6, 13, 10, 15), (2025, 6, 13, 17))),
+            ("tomorrow", ((2025, 6, 14, 9), (2025, 6, 14, 17))),
+            ("the day after tomorrow", ((2025, 6, 15, 9), (2025, 6, 15, 17))),
+            ("in 2 days", ((2025, 6, 15, 9), (2025, 6, 15, 17))),
+            ("next 3 days", ((2025, 6, 13, 10, 15), (2025, 6, 16, 17))),
+            ("within the next two weeks", ((2025, 6, 13, 10, 15), (2025, 6, 27, 17))),
+            ("next 0 days", None),
+            ("in 0 days", None),
+            ("june 20", ((2025, 6, 20, 9), (2025, 6, 20, 17))),
+            ("2025-06-18", ((2025, 6, 18, 9), (2025, 6, 18, 17))),
+        ])
+
+    def test_weekdays(self):
+        self.check(self.morning, [
+            ("monday", ((2025, 6, 16, 9), (2025, 6, 16, 17))),
+            ("on tue", ((2025, 6, 17, 9), (2025, 6, 17, 17))),
+            ("friday", ((2025, 6, 13, 10, 15), (2025, 6, 13, 17))),
+            ("next friday", ((2025, 6, 20, 9), (2025, 6, 20, 17))),
+            ("wednesday afternoon", ((2025, 6, 18, 12), (2025, 6, 18, 17))),
+            ("later next week", ((2025, 6, 19, 9), (2025, 6, 21, 17))),
+            ("early this week", None),
+        ])
+
+    def test_after_hours_today(self):
+        self.check(self.after_hours, [
+            ("today", None),
+            ("friday", None),
+            ("friday afternoon", None),
+            ("this morning", ((2025, 6, 14, 9), (2025, 6, 14, 12))),
+            ("next 3 days", ((2025, 6, 14, 9), (2025, 6, 16, 17))),
+            ("this week", ((2025, 6, 14, 9), (2025, 6, 14, 17))),
+            ("next 0 days", None),
+        ])
+        # Saturday evening: the next open day is Monday
+        self.check(_local(2025, 6, 14, 19), [
+            ("this morning", ((2025, 6, 16, 9), (2025, 6, 16, 12))),
+            ("at 10am", ((2025, 6, 16, 10), (2025, 6, 16, 10, 30))),
+            ("this week", None),
+            ("next 2 days", ((2025, 6, 16, 9), (2025, 6, 16, 17))),
+        ])
+
+    def test_explicit_times(self):
+        self.check(self.morning, [
+            ("tomorrow at 3pm", ((2025, 6, 14, 15), (2025, 6, 14, 15, 30))),
+            ("monday 10:30", ((2025, 6, 16, 10, 30), (2025, 6, 16, 11))),
+            ("at 10am", ((2025, 6, 14, 10), (2025, 6, 14, 10, 30))),
+            ("at 4pm", ((2025, 6, 13, 16), (2025, 6, 13, 16, 30))),
+            ("tomorrow at 8am", None),
+            ("12am tomorrow", None),
+            ("tomorrow at 5pm", None),
+            ("today at 9am", None),
+            ("tomorrow at 13pm", None),
+        ])
+        self.check(self.after_hours, [
+            ("at 3pm", ((2025, 6, 14, 15), (2025, 6, 14, 15, 30))),
+            ("today at 3pm", None),
+        ])
+
+    def test_ranges_are_never_inverted(self):
+        phrases = ["today", "tomorrow", "this week", "next week", "early next week", "this month",
+                   "next 2 days", "friday", "this afternoon", "this evening", "at noon", "monday morning"]
+        for now in (self.morning, self.after_hours, _local(2025, 6, 15, 23, 59)):
+            for phrase in phrases:
+                with self.subTest(phrase=phrase, now=now):
+                    got = _rule_parse_range(phrase, now, self.ctx)
+                    if got is not None:
+                        self.assertLess(got[0], got[1])
+                        self.assertGreaterEqual(got[1], now)
+
+
+class ToolCallScannerTests(SimpleTestCase):
+    find = '{"tool": "find_slots", "parameters": {"type": "cleaning"}}'
+    book = '{"tool": "book_appointment", "parameters": {"notes": "use } and { here"}}'
+    escaped = r'{"tool": "book_appointment", "parameters": {"notes": "say \"hi\" } \\"}}'
+
+    def test_complete_replies(self):
+        cases = [
+            ("plain", self.find, [("find_slots", {"type": "cleaning"})]),
+            ("prose around", f"Let me look.\n{self.find}\nOne moment.", [("find_slots", {"type": "cleaning"})]),
+            ("braces in strings", self.book, [("book_appointment", {"notes": "use } and { here"})]),
+            ("escaped quotes", self.escaped, [("book_appointment", {"notes": 'say "hi" } \\'})]),
+            ("two calls", f"{self.find} then {self.book}",
+             [("find_slots", {"type": "cleaning"}), ("book_appointment", {"notes": "use } and { here"})]),
+            ("stray brace first", f"Sure {{ checking {self.find}", [("find_slots", {"type": "cleaning"})]),
+            ("not a call", '{"answer": 42} and {"tool": "x"}', []),
+            ("no json", "We open at 9.", []),
+        ]
+        for name, text, expected in cases:
+            with self.subTest(name):
+                calls = extract_tool_calls(text)
+                self.assertEqual([(c.tool, c.parameters) for c in calls], expected)
+                for call in calls:
+                    self.assertEqual(text[call.start], "{")
+                    self.assertEqual(text[call.end - 1], "}")
+
+    def test_chunked_input(self):
+        text = f"ok {self.escaped} and {self.book}"
+        splits = [
+            ("inside a string", [text.index("say") + 2]),
+            ("at an escape", [text.index("\\\\") + 1]),
+            ("every character", range(1, len(text))),
+        ]
+        for name, cuts in splits:
+            with self.subTest(name):
+                bounds = [0, *cuts, len(text)]
+                scanner = ToolCallScanner()
+                streamed = []
+                for lo, hi in zip(bounds, bounds[1:]):
+                    streamed += scanner.feed(text[lo:hi])
+                streamed += scanner.finish()
+                self.assertEqual(streamed, extract_tool_calls(text))
+                self.assertEqual([c.tool for c in streamed], ["book_appointment", "book_appointment"])
+
+    def test_call_completes_in_the_chunk_that_closes_it(self):
+        scanner = ToolCallScanner()
+        self.assertEqual(scanner.feed(self.find[:-1]), [])
+        self.assertEqual([c.tool for c in scanner.feed("}")], ["find_slots"])
+        self.assertEqual(scanner.finish(), [])
+
+
+class AnswerCacheTests(SimpleTestCase):
+    prompt = "We are open Monday to Saturday, 8am to 6pm."
+
+    def setUp(self):
+        self.cache = AnswerCache()
+        for question, answer in [
+            ("Are you open on Saturday morning?", "Yes, from 8am."),
+            ("How much does a cleaning cost?", "A cleaning is $120."),
+            ("Do you accept Delta Dental PPO insurance?", "Yes, we accept Delta Dental PPO."),
+            ("Is there parking on Main St?", "Yes, behind the clinic on Main St."),
+        ]:
+            self.cache.set(question, self.prompt, answer)
+
+    def test_similar_questions_hit(self):
+        for question, expected in [
+            ("are you open saturday mornings", "Yes, from 8am."),
+            ("How much does a cleaning cost??", "A cleaning is $120."),
+            ("do you accept delta dental ppo", None),
+        ]:
+            with self.subTest(question):
+                self.assertEqual(self.cache.get(question, self.prompt), expected)
+
+    def test_deciding_word_differs(self):
+        for question in [
+            "Are you open on Sunday morning?",
+            "How much does a filling cost?",
+            "Do you accept Delta Dental HMO insurance?",
+            "Is there parking on Oak St?",
+        ]:
+            with self.subTest(question):
+                self.assertIsNone(self.cache.get(question, self.prompt))
+
+    def test_answers_that_depend_on_the_conversation(self):
+        earlier = ["I'm Bob Smith, 604-555-0199"]
+        self.assertTrue(borrows_from("Hi Bob, we open at 8am.", earlier, "When do you open?", self.prompt))
+        self.assertFalse(borrows_from("We open at 8am.", earlier, "When do you open?", self.prompt))
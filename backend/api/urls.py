@@ -1,7 +1,10 @@
 from django.urls import path
-from .views import HelloView, ChatbotView
+from .views import HelloView, ChatbotView, AsyncChatbotView
+from .metrics import metrics
 
 urlpatterns = [
     path('hello/', HelloView.as_view(), name='hello'),
     path('chat/', ChatbotView.as_view(), name='chat'),
+    path('chat/async/', AsyncChatbotView.as_view(), name='chat-async'),
+    path('metrics/', metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -35,108 +35,562 @@ class HelloView(APIView):
 
 import os
 import json
-import datetime
+import logging
+from dataclasses import dataclass
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from dotenv import load_dotenv
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
 import re
 from prompts.flows import get_prompt_for_flow
-from chat.router import maybe_parse_tool_call, execute_tool
+from chat.router import ToolCallScanner, extract_tool_calls, execute_tool_calls
+from chat.sessions import Conversation, get_session_store
+from chat.compaction import compact_history
+from chat.prompt_cache import build_prompt_cache, is_cache_rejection, token_usage
+from chat.deadline import Deadline, DeadlineExceeded, StageTimer, current_deadline
+from chat.intent import build_intent_router
+from chat.answer_cache import borrows_from, build_answer_cache
+from chat.serializer import encode_tool_result
+from chat.tracing import record_llm_tokens, span
+from chat.llm import get_llm_client
 
-from google import genai
 from google.genai import types
 
 load_dotenv(dotenv_path=".env")
 
-client = genai.Client()
-
-def convert_to_gemini_contents(messages):
-    contents = []
-    for m in messages:
-        role = m["role"]
-        if role == "assistant":
-            role = "model"
-        contents.append(
-            types.Content(
-                role=role,
-                parts=[types.Part(text=m["content"])]
+client = get_llm_client()
+
+logger = logging.getLogger(__name__)
+
+MODEL = "gemini-2.5-flash"
+
+MENU = (
+    "Hi, this is DentalBot, your virtual assistant! How can I help today?\n"
+    "1) Book appointment\n"
+    "2) Change appointment\n"
+    "3) General inquiry\n"
+)
+
+# Reply used when a turn runs out of time or tool rounds before the model answers.
+PARTIAL_REPLY = (
+    "Sorry, that is taking longer than expected. "
+    "Could you repeat your last request, or try a slightly different one?"
+)
+
+prompt_cache = build_prompt_cache(MODEL)
+intent_router = build_intent_router(MENU)
+answer_cache = build_answer_cache()
+
+def turn_budget():
+    """(deadline, max tool rounds) for one chat turn, from settings."""
+    deadline = Deadline(float(getattr(settings, "CHAT_TURN_BUDGET_SECONDS", 30)))
+    return deadline, int(getattr(settings, "CHAT_MAX_TOOL_ROUNDS", 6))
+
+def generation_config(system_prompt, max_output_tokens, cached_content=None, deadline=None):
+    options = {"temperature": 0.1, "top_p": 0.9, "max_output_tokens": max_output_tokens}
+    if cached_content:
+        # the system prompt already lives in the cached content
+        options["cached_content"] = cached_content
+    else:
+        options["system_instruction"] = system_prompt
+    if deadline is not None:
+        options["http_options"] = types.HttpOptions(timeout=deadline.timeout_ms())
+    return types.GenerateContentConfig(**options)
+
+def generate(contents, system_prompt, max_output_tokens, deadline=None):
+    """generate_content using the cached flow prompt, retrying inline if the cache is rejected."""
+    cached_content = prompt_cache.get(client, system_prompt)
+    with span("llm_call", purpose="chat"):
+        try:
+            completion = client.models.generate_content(
+                model=MODEL,
+                contents=contents,
+                config=generation_config(system_prompt, max_output_tokens, cached_content, deadline),
+            )
+        except Exception as e:
+            if not cached_content or not is_cache_rejection(e) or (deadline is not None and deadline.expired()):
+                raise
+            prompt_cache.invalidate(system_prompt)
+            completion = client.models.generate_content(
+                model=MODEL,
+                contents=contents,
+                config=generation_config(system_prompt, max_output_tokens, deadline=deadline),
+            )
+    record_llm_tokens(token_usage.record(completion), purpose="chat")
+    return completion
+
+async def agenerate(contents, system_prompt, max_output_tokens, deadline=None):
+    """Async variant of generate()."""
+    cached_content = await prompt_cache.aget(client, system_prompt)
+    with span("llm_call", purpose="chat"):
+        try:
+            completion = await client.aio.models.generate_content(
+                model=MODEL,
+                contents=contents,
+                config=generation_config(system_prompt, max_output_tokens, cached_content, deadline),
+            )
+        except Exception as e:
+            if not cached_content or not is_cache_rejection(e) or (deadline is not None and deadline.expired()):
+                raise
+            prompt_cache.invalidate(system_prompt)
+            completion = await client.aio.models.generate_content(
+                model=MODEL,
+                contents=contents,
+                config=generation_config(system_prompt, max_output_tokens, deadline=deadline),
+            )
+    record_llm_tokens(token_usage.record(completion), purpose="chat")
+    return completion
+
+def generate_stream(contents, system_prompt, max_output_tokens, deadline=None):
+    """
+    generate_content_stream using the cached flow prompt; if the cache is
+    rejected before the first chunk, the stream is retried with the prompt inline.
+    """
+    cached_content = prompt_cache.get(client, system_prompt)
+    started = False
+    try:
+        for chunk in client.models.generate_content_stream(
+            model=MODEL,
+            contents=contents,
+            config=generation_config(system_prompt, max_output_tokens, cached_content, deadline),
+        ):
+            started = True
+            yield chunk
+        return
+    except Exception as e:
+        if started or not cached_content or not is_cache_rejection(e) or (deadline is not None and deadline.expired()):
+            raise
+        prompt_cache.invalidate(system_prompt)
+    yield from client.models.generate_content_stream(
+        model=MODEL,
+        contents=contents,
+        config=generation_config(system_prompt, max_output_tokens, deadline=deadline),
+    )
+
+def tool_result_message(tool_calls, tool_results):
+    """One TOOL_RESULT message per reply: the bare result for a single call, else a list."""
+    if len(tool_calls) == 1:
+        payload = tool_results[0]
+    else:
+        payload = [{"tool": c.tool, "result": r} for c, r in zip(tool_calls, tool_results)]
+    return {"role": "user", "content": f"TOOL_RESULT: {encode_tool_result(payload)}"}
+
+def tool_end_event(tool_call, tool_result):
+    tool_end = {"tool": tool_call.tool, "ok": bool(tool_result.get("ok"))}
+    if tool_result.get("error"):
+        tool_end["error"] = tool_result["error"]
+    return sse_event("tool_end", tool_end)
+
+def chat_payload(assistant_text, assistant_chain, conversation, stop_reason=None):
+    payload = {
+        "reply": assistant_text,
+        "assistant_chain": [{"role": "assistant", "content": t} for t in assistant_chain],
+    }
+    if stop_reason:
+        payload["partial"] = True
+        payload["stop_reason"] = stop_reason
+    if conversation.id:
+        payload["conversation_id"] = conversation.id
+    else:
+        # legacy clients send the flow back with the next request
+        payload["messages"] = conversation.messages
+        payload["flow"] = conversation.flow
+    return payload
+
+class ChatRequestError(Exception):
+    def __init__(self, error, status=400):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+
+def load_conversation(data):
+    """
+    Session mode: {"conversation_id"?: str, "message": str, "flow"?: str} -- the
+    history lives server-side (chat.sessions) and only the new message is sent.
+    Legacy mode: {"messages": [...], "flow"?: str} -- the client re-sends the
+    whole history every turn.
+    """
+    flow = data.get("flow", "general_info")
+    if "message" not in data and "conversation_id" not in data:
+        return Conversation(None, flow, data.get("messages", []))
+
+    store = get_session_store()
+    conversation_id = data.get("conversation_id")
+    if conversation_id:
+        if not data.get("message"):
+            raise ChatRequestError("No message provided")
+        conversation = store.get(conversation_id)
+        if conversation is None:
+            raise ChatRequestError("conversation_not_found", status=404)
+        if data.get("flow"):
+            conversation.flow = data["flow"]
+    else:
+        conversation = store.create(flow)
+    if data.get("message"):
+        conversation.append("user", data["message"])
+    return conversation
+
+def save_conversation(conversation):
+    if conversation.id:
+        get_session_store().save(conversation)
+
+def menu_payload(conversation):
+    if not conversation.id:
+        return {"reply": MENU}
+    conversation.append("assistant", MENU)
+    save_conversation(conversation)
+    return {"reply": MENU, "conversation_id": conversation.id}
+
+def routed_payload(conversation):
+    """
+    Answer fixed steps (menu choice, new vs existing patient) and repeated
+    general questions without the model. Returns None when the model has to
+    answer; the intent router may still have switched conversation.flow to
+    the matching prompt.
+    """
+    reply = intent_router.route(conversation)
+    if reply is None and conversation.flow == "general_info":
+        reply = answer_cache.get(conversation.messages[-1]["content"], get_prompt_for_flow("general_info"))
+    if reply is None:
+        return None
+    if conversation.id:
+        conversation.append("assistant", reply)
+        save_conversation(conversation)
+    return chat_payload(reply, [reply], conversation)
+
+def remember_answer(conversation, assistant_chain, stop_reason):
+    """
+    Cache a general_info answer the model gave directly, without tools, unless
+    it repeats something said earlier in this conversation (a name, details).
+    """
+    if conversation.flow != "general_info" or stop_reason or len(assistant_chain) != 1:
+        return
+    if not conversation.messages or conversation.messages[-1]["role"] != "user":
+        return
+    question = conversation.messages[-1]["content"]
+    system_prompt = get_prompt_for_flow("general_info")
+    earlier = [m["content"] for m in conversation.messages[:-1] if m["role"] == "user"]
+    if borrows_from(assistant_chain[0], earlier, question, system_prompt):
+        return
+    answer_cache.set(question, system_prompt, assistant_chain[0])
+
+def model_contents(conversation, flow):
+    """(contents, tokens saved) for the next model call, compacting long histories."""
+    messages, saved = compact_history(conversation.messages, flow)
+    if messages is conversation.messages:
+        return conversation.contents, 0
+    return conversation.contents_for(messages), saved
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_stream(request):
+    """Streaming is opt-in via {"stream": true} in the body or ?stream=1."""
+    flag = request.data.get("stream", request.query_params.get("stream", False))
+    if isinstance(flag, str):
+        return flag.lower() in ("1", "true", "yes")
+    return bool(flag)
+
+@dataclass
+class LlmStep:
+    """Ask the model; the driver sends back (reply text, (calls, results) it already ran or None)."""
+    contents: list
+    system_prompt: str
+    max_output_tokens: int
+    # False once the round limit is reached: tool calls in this reply will not be run
+    run_tools: bool
+
+@dataclass
+class ToolStep:
+    """Run these tool calls; the driver sends back their results."""
+    calls: list
+
+class ChatTurn:
+    """
+    One model turn: generate -> extract tool calls -> execute them -> append
+    the results -> generate again, until the model answers without a tool
+    call, CHAT_MAX_TOOL_ROUNDS is reached or the deadline passes.
+
+    steps() is a generator that yields the LlmStep / ToolStep it needs and
+    receives each result through send(), so the sync view, the async view
+    and the SSE stream share this loop and only differ in how they call the
+    model and the tools (see run_turn, arun_turn and stream_chat).
+    """
+
+    def __init__(self, conversation):
+        self.conversation = conversation
+        self.deadline, self.max_rounds = turn_budget()
+        self.assistant_chain = []
+        self.assistant_text = ""
+        self.stop_reason = None
+        self.tokens_saved = 0
+
+    def steps(self):
+        flow = self.conversation.flow
+        system_prompt = get_prompt_for_flow(flow)
+        max_output_tokens = 400
+        rounds = 0
+        while True:
+            contents, saved = model_contents(self.conversation, flow)
+            self.tokens_saved += saved
+            assistant_text, ran = yield LlmStep(
+                contents, system_prompt, max_output_tokens, rounds < self.max_rounds
             )
-        )
-    return contents
+            logger.debug("assistant reply: %s", assistant_text)
+            self.assistant_text = assistant_text
+            self.assistant_chain.append(assistant_text)
+            tool_calls, tool_results = ran if ran is not None else (extract_tool_calls(assistant_text), None)
+            logger.debug("tool chain: %s", [c.as_request() for c in tool_calls])
+            if not tool_calls:
+                return
+            if rounds >= self.max_rounds:
+                self.stop_reason = "max_tool_rounds"
+                return
+            rounds += 1
+            if ran is None:
+                tool_results = yield ToolStep(tool_calls)
+            logger.debug("tool results: %s", tool_results)
+
+            flow = tool_calls[-1].tool
+            system_prompt = get_prompt_for_flow(flow)
+            self.conversation.append("assistant", assistant_text)
+            self.conversation.append(**tool_result_message(tool_calls, tool_results))
+            max_output_tokens = 1000
+
+    def stopped(self, exc):
+        """Whether `exc` ends the turn early at the deadline (True) rather than being an error."""
+        if isinstance(exc, DeadlineExceeded) or self.deadline.expired():
+            self.stop_reason = "deadline"
+            return True
+        return False
+
+    def finish(self):
+        """The response payload; the caller saves the conversation."""
+        if self.stop_reason:
+            self.assistant_text = PARTIAL_REPLY
+            self.assistant_chain.append(PARTIAL_REPLY)
+        remember_answer(self.conversation, self.assistant_chain, self.stop_reason)
+        if self.conversation.id:
+            # legacy clients append the final reply themselves
+            self.conversation.append("assistant", self.assistant_text)
+        return chat_payload(self.assistant_text, self.assistant_chain, self.conversation, self.stop_reason)
+
+def run_turn(conversation, timer):
+    """Drive a ChatTurn with blocking model and tool calls."""
+    turn = ChatTurn(conversation)
+    token = current_deadline.set(turn.deadline)
+    try:
+        steps, result = turn.steps(), None
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration:
+                break
+            if isinstance(step, LlmStep):
+                with timer.stage("llm"):
+                    completion = generate(step.contents, step.system_prompt, step.max_output_tokens, turn.deadline)
+                result = (completion.text, None)
+            else:
+                with timer.stage("tool"):
+                    result = execute_tool_calls(step.calls, turn.deadline)
+    except Exception as e:
+        if not turn.stopped(e):
+            raise
+    finally:
+        current_deadline.reset(token)
+    return turn
+
+async def arun_turn(conversation, timer):
+    """Drive a ChatTurn with the async model client; tools run in worker threads."""
+    turn = ChatTurn(conversation)
+    # sync_to_async copies the context, so tool threads see this deadline too
+    token = current_deadline.set(turn.deadline)
+    try:
+        steps, result = turn.steps(), None
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration:
+                break
+            if isinstance(step, LlmStep):
+                with timer.stage("llm"):
+                    completion = await agenerate(step.contents, step.system_prompt, step.max_output_tokens,
+                                                 turn.deadline)
+                result = (completion.text, None)
+            else:
+                with timer.stage("tool"):
+                    result = await aexecute_tool_calls(step.calls, turn.deadline)
+    except Exception as e:
+        if not turn.stopped(e):
+            raise
+    finally:
+        current_deadline.reset(token)
+    return turn
+
+def turn_response(turn, payload, timer, response_class):
+    response = response_class(payload)
+    response["X-History-Tokens-Saved"] = str(turn.tokens_saved)
+    response["Server-Timing"] = timer.server_timing()
+    return response
+
+def stream_chat(conversation):
+    """
+    Run the ChatTurn loop, yielding server-sent events:
+      token       -- {"text"} delta of a user-facing reply, as the model produces it
+      assistant   -- {"role", "content"} an intermediate assistant_chain entry (tool call)
+      tool_start  -- {"tool", "parameters"} before a tool runs
+      tool_end    -- {"tool", "ok", "error"?} after it returns
+      done        -- the regular non-streaming payload
+      error       -- {"error"} if the chain aborts
+    """
+    payload = routed_payload(conversation)
+    if payload is not None:
+        yield sse_event("token", {"text": payload["reply"]})
+        yield sse_event("done", payload)
+        return
+    turn = ChatTurn(conversation)
+    deadline = turn.deadline
+    token = current_deadline.set(deadline)
+    streaming = False
+    try:
+        steps, result = turn.steps(), None
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration:
+                break
+            if isinstance(step, ToolStep):
+                result = execute_tool_calls(step.calls, deadline)
+                continue
+            if turn.assistant_chain:
+                # the previous reply was a tool call and its results are in
+                yield sse_event("assistant", {"role": "assistant", "content": turn.assistant_chain[-1]})
+            assistant_text = ""
+            # Tool calls are bare JSON objects per the prompt contract, so hold
+            # tokens back until the reply clearly is not one.
+            streaming = False
+            # calls are executed as soon as their JSON closes, while the
+            # model is still generating the rest of the reply
+            scanner = ToolCallScanner()
+            tool_results = []
+            chunk = None
+            with span("llm_call", purpose="chat_stream") as llm_span:
+                for chunk in generate_stream(step.contents, step.system_prompt, step.max_output_tokens, deadline):
+                    delta = chunk.text or ""
+                    assistant_text += delta
+                    if streaming:
+                        yield sse_event("token", {"text": delta})
+                    elif assistant_text.strip() and not assistant_text.lstrip().startswith("{"):
+                        streaming = True
+                        yield sse_event("token", {"text": assistant_text})
+                    if not step.run_tools:
+                        continue
+                    for call in scanner.feed(delta):
+                        # the stream stays open, but tool time belongs to the tool spans
+                        with llm_span.paused():
+                            yield sse_event("tool_start", {"tool": call.tool, "parameters": call.parameters})
+                            tool_results += execute_tool_calls([call], deadline)
+                            yield tool_end_event(call, tool_results[-1])
+            # the last chunk carries the usage totals for the whole stream
+            record_llm_tokens(token_usage.record(chunk), purpose="chat_stream")
+            if step.run_tools:
+                for call in scanner.finish():
+                    yield sse_event("tool_start", {"tool": call.tool, "parameters": call.parameters})
+                    tool_results += execute_tool_calls([call], deadline)
+                    yield tool_end_event(call, tool_results[-1])
+            result = (assistant_text, (scanner.calls, tool_results) if step.run_tools else None)
+    except Exception as e:
+        if not turn.stopped(e):
+            yield sse_event("error", {"error": str(e)})
+            return
+    finally:
+        current_deadline.reset(token)
+
+    payload = turn.finish()
+    if turn.stop_reason or (not streaming and turn.assistant_text):
+        yield sse_event("token", {"text": turn.assistant_text})
+    save_conversation(conversation)
+    yield sse_event("done", payload)
 
 class ChatbotView(APIView):
     def post(self, request):
         data = request.data
-        flow = data.get("flow", "general_info")
-        messages = data.get("messages", [])
+        try:
+            conversation = load_conversation(data)
+        except ChatRequestError as e:
+            return Response({"error": e.error}, status=e.status)
         #--------------------------------------------------------
         # If conversation just started, show the menu deterministically
         #--------------------------------------------------------
-        if not messages:
-            menu = (
-                "Hi, this is DentalBot, your virtual assistant! How can I help today?\n"
-                "1) Book appointment\n"
-                "2) Change appointment\n"
-                "3) General inquiry\n"
-            )
-            return Response({"reply": menu})
+        if not conversation.messages:
+            return Response(menu_payload(conversation))
         #--------------------------------------------------------
-        system_prompt = get_prompt_for_flow(flow)
+        if wants_stream(request):
+            response = StreamingHttpResponse(stream_chat(conversation), content_type="text/event-stream")
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"
+            return response
+        payload = routed_payload(conversation)
+        if payload is not None:
+            return Response(payload)
 
-        completion = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=convert_to_gemini_contents(messages),
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                temperature=0.1,
-                top_p=0.9,
-                max_output_tokens=400,
-            ),
-        )
-        assistant_text = completion.text
-
-        # collect all assistant messages (chain-of-thought / intermediate replies)
-        assistant_chain = [assistant_text]
-
-        # Chain of Thought loop
-        while True:
-            print("Assistant reply:", assistant_text)
-            tool_req = maybe_parse_tool_call(assistant_text)
-            print("Tool Chain:", tool_req)
-            if not tool_req:
-                break
+        timer = StageTimer()
+        turn = run_turn(conversation, timer)
+        payload = turn.finish()
+        save_conversation(conversation)
+        return turn_response(turn, payload, timer, Response)
 
-            system_prompt = get_prompt_for_flow(tool_req["tool"])
-            tool_result = execute_tool(tool_req["tool"], tool_req["parameters"])
-            print("Tool result:", tool_result)
 
-            tool_result_json = json.dumps(
-                tool_result,
-                default=lambda o: o.isoformat() if isinstance(o, (datetime.date, datetime.datetime)) else str(o),
-            )
+def _execute_tool_calls_in_thread(calls, deadline):
+    # Executor threads keep their own persistent DB connection; recycle it the
+    # way Django does around a request (and chat.router's tool pool does) so
+    # CONN_MAX_AGE and broken connections are honoured.
+    close_old_connections()
+    try:
+        return execute_tool_calls(calls, deadline)
+    finally:
+        close_old_connections()
 
-            messages = messages + [
-                {"role": "assistant", "content": assistant_text},
-                {"role": "user", "content": f"TOOL_RESULT: {tool_result_json}"},
-            ]
-
-            followup = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=convert_to_gemini_contents(messages),
-                config=types.GenerateContentConfig(
-                    system_instruction=system_prompt,
-                    temperature=0.1,
-                    top_p=0.9,
-                    max_output_tokens=1000,
-                ),
-            )
 
-            assistant_text = followup.text
-            assistant_chain.append(assistant_text)
+# Tool calls hit the ORM (and possibly the fuzzy-date LLM), so they run in a
+# worker thread. thread_sensitive=False lets tool calls from different
+# conversations run in parallel, each thread holding its own DB connection.
+aexecute_tool_calls = sync_to_async(_execute_tool_calls_in_thread, thread_sensitive=False)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncChatbotView(View):
+    """
+    Same contract as ChatbotView, but non-blocking: Gemini is called through
+    the SDK's async client, so under an ASGI server (backend.asgi) a single
+    process can hold many in-flight conversations while they wait on the model.
+    """
+    http_method_names = ["post"]
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "invalid_json"}, status=400)
+        try:
+            conversation = await sync_to_async(load_conversation)(data)
+        except ChatRequestError as e:
+            return JsonResponse({"error": e.error}, status=e.status)
+        if not conversation.messages:
+            return JsonResponse(await sync_to_async(menu_payload)(conversation))
+        payload = await sync_to_async(routed_payload)(conversation)
+        if payload is not None:
+            return JsonResponse(payload)
 
-        return Response({
-            "reply": assistant_text,
-            "assistant_chain": [{"role": "assistant", "content": t} for t in assistant_chain],
-            "messages": messages,
-        })
+        timer = StageTimer()
+        turn = await arun_turn(conversation, timer)
+        payload = turn.finish()
+        await sync_to_async(save_conversation)(conversation)
+        return turn_response(turn, payload, timer, JsonResponse)
@@ -1,3 +1,3 @@
 from django.contrib import admin
-from .models import Patient, Family, FamilyMember, Availability, Appointment, StaffAlert
-admin.site.register([Patient, Family, FamilyMember, Availability, Appointment, StaffAlert])
+from .models import Patient, Family, FamilyMember, Availability, Appointment, StaffAlert, OpeningHours, ScheduleException
+admin.site.register([Patient, Family, FamilyMember, Availability, Appointment, StaffAlert, OpeningHours, ScheduleException])
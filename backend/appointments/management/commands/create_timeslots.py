@@ -1,14 +1,19 @@
+import time as clock
 from datetime import datetime, time, timedelta
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
 from appointments.models import Availability, Appointment
+from scheduling.availability_cache import availability_cache
+from scheduling.availability_index import availability_index
 from django.core.management.base import BaseCommand
 
-OPEN_HOUR = 8
-CLOSE_HOUR = 18
-SLOT_MINUTES = 30
-OPEN_WEEKDAYS = {0,1,2,3,4,5}  # Mon..Sat (0=Mon, 6=Sun)
+CLINIC_HOURS = getattr(settings, "CLINIC_HOURS", {}) or {}
+OPEN_HOUR = int(CLINIC_HOURS.get("OPEN_HOUR", 8))
+CLOSE_HOUR = int(CLINIC_HOURS.get("CLOSE_HOUR", 18))
+SLOT_MINUTES = int(CLINIC_HOURS.get("SLOT_MINUTES", 30))
+OPEN_WEEKDAYS = set(CLINIC_HOURS.get("WEEKDAYS", range(6)))  # 0=Mon, 6=Sun
 
 DEFAULT_TYPES = (
     Availability.ApptType.CLEANING,
@@ -24,6 +29,11 @@ def _dt(day, hh, mm=0):
 def _overlaps(a_start, a_end, b_start, b_end) -> bool:
     return not (a_end <= b_start or b_end <= a_start)
 
+def _window_changed(start_day, days: int, appt_types) -> None:
+    # slots appear in bulk: reload the in-memory index and drop the cached days
+    availability_index.invalidate()
+    availability_cache.invalidate(appt_types, [start_day.date() + timedelta(days=d) for d in range(days)])
+
 @transaction.atomic
 def generate_availability_window(
     start_dt: Optional[datetime] = None,
@@ -42,6 +52,8 @@ def generate_availability_window(
     # normalize to start-of-day
     start_day = start_dt.replace(hour=0, minute=0, second=0, microsecond=0)
 
+    appt_types = list(appt_types)
+    transaction.on_commit(lambda: _window_changed(start_day, days, appt_types))
     created = 0
     for d in range(days):
         print("Generating day", d)
@@ -88,16 +100,114 @@ def generate_availability_window(
 
     return created
 
+def _iter_open_slots(start_day, days: int, slot_minutes: int) -> Iterator[Tuple[datetime, datetime]]:
+    """Yield (start, end) for every slot in opening hours, in chronological order."""
+    step = timedelta(minutes=slot_minutes)
+    for d in range(days):
+        day = start_day + timedelta(days=d)
+        if day.weekday() not in OPEN_WEEKDAYS:
+            continue
+        t, day_close = _dt(day, OPEN_HOUR), _dt(day, CLOSE_HOUR)
+        while t + step <= day_close:
+            yield t, t + step
+            t += step
+
+def _merge_intervals(intervals: Iterable[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """Merge start-sorted intervals into disjoint busy blocks so one forward sweep can test overlaps."""
+    merged: List[Tuple[datetime, datetime]] = []
+    for a0, a1 in intervals:
+        if merged and a0 <= merged[-1][1]:
+            if a1 > merged[-1][1]:
+                merged[-1] = (merged[-1][0], a1)
+        else:
+            merged.append((a0, a1))
+    return merged
+
+@transaction.atomic
+def bulk_generate_availability_window(
+    start_dt: Optional[datetime] = None,
+    days: int = 14,
+    slot_minutes: int = SLOT_MINUTES,
+    appt_types: Iterable[str] = DEFAULT_TYPES,
+    skip_if_exists: bool = True,
+    batch_size: int = 1000,
+) -> int:
+    """
+    Set-based equivalent of generate_availability_window: loads existing
+    slots and booked appointments for the whole window with one query each,
+    sweeps the sorted slot grid against the merged appointment blocks in
+    memory and writes the free slots with bulk_create.
+    Returns number of slots created.
+
+    Availability has no unique key (parallel chairs are rows with the same
+    start), so skip_if_exists is checked against the rows that existed when
+    the window was loaded: two runs over the same window at the same time
+    can both insert a slot.
+    """
+    start_dt = start_dt or timezone.now()
+    start_day = start_dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    appt_types = list(appt_types)
+    window_open = _dt(start_day, 0)
+    window_close = _dt(start_day + timedelta(days=days), 0)
+
+    existing = set()
+    if skip_if_exists:
+        existing = set(
+            Availability.objects.filter(start__gte=window_open, start__lt=window_close)
+            .values_list("start", "end")
+        )
+    busy = _merge_intervals(
+        Appointment.objects.filter(
+            start__lt=window_close, end__gt=window_open, status=Appointment.Status.BOOKED
+        ).order_by("start").values_list("start", "end")
+    )
+
+    transaction.on_commit(lambda: _window_changed(start_day, days, appt_types))
+    created = 0
+    pending: List[Availability] = []
+    i = 0
+    for slot_start, slot_end in _iter_open_slots(start_day, days, slot_minutes):
+        # drop busy blocks that end before this slot; slots only move forward
+        while i < len(busy) and busy[i][1] <= slot_start:
+            i += 1
+        if i < len(busy) and busy[i][0] < slot_end:
+            continue
+        if (slot_start, slot_end) in existing:
+            continue
+        pending.extend(
+            Availability(start=slot_start, end=slot_end, appointment_type=appt_type)
+            for appt_type in appt_types
+        )
+        if len(pending) >= batch_size:
+            Availability.objects.bulk_create(pending, batch_size=batch_size)
+            created += len(pending)
+            pending = []
+
+    if pending:
+        Availability.objects.bulk_create(pending, batch_size=batch_size)
+        created += len(pending)
+    return created
+
 class Command(BaseCommand):
     help = "Generate availability (default next 14 days). Skips Sundays and overlaps with existing appointments."
 
     def add_arguments(self, parser):
         parser.add_argument("--days", type=int, default=14, help="How many days ahead to generate.")
         parser.add_argument("--from", dest="from_iso", type=str, default=None, help="Start ISO datetime (optional).")
+        parser.add_argument("--bulk", action="store_true", help="Load the window once and insert with bulk_create.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per INSERT in --bulk mode.")
 
     def handle(self, *args, **opts):
         start = timezone.now()
         if opts.get("from_iso"):
             start = timezone.make_aware(timezone.datetime.fromisoformat(opts["from_iso"]))
-        n = generate_availability_window(start_dt=start, days=opts["days"])
-        self.stdout.write(self.style.SUCCESS(f"Created {n} availability slots."))
+        t0 = clock.perf_counter()
+        if opts["bulk"]:
+            n = bulk_generate_availability_window(start_dt=start, days=opts["days"], batch_size=opts["batch_size"])
+        else:
+            n = generate_availability_window(start_dt=start, days=opts["days"])
+        elapsed = clock.perf_counter() - t0
+        rate = n / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {n} availability slots in {elapsed:.2f}s ({rate:.0f} slots/s)."
+        ))
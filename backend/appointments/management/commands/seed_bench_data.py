@@ -0,0 +1,157 @@
+import math
+import time as clock
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from appointments.models import Appointment, Availability, Patient, normalize_name, normalize_phone
+
+# every seeded patient's phone starts with this, so --clear can find them
+PHONE_PREFIX = "5550"
+OPEN_HOUR = 8
+CLOSE_HOUR = 18
+SLOT_MINUTES = 30
+TYPES = (Availability.ApptType.CLEANING, Availability.ApptType.CHECKUP, Availability.ApptType.FILLING)
+FIRST_NAMES = ("Alice", "Bob", "Cara", "Dan", "Eve", "Farid", "Grace", "Hiro", "Ines", "Jon", "Kim", "Lena")
+LAST_NAMES = ("Kim", "Singh", "Nguyen", "Smith", "Garcia", "Chen", "Brown", "Patel", "Lee", "Martin")
+
+
+def bench_phone(i: int) -> str:
+    return f"{PHONE_PREFIX}{i:07d}"
+
+
+def bench_name(i: int) -> str:
+    return f"{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]} {i}"
+
+
+def _batched(rows: Iterable, size: int) -> Iterator[list]:
+    it = iter(rows)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _open_days(first: date, days: int) -> Iterator[date]:
+    for d in range(days):
+        day = first + timedelta(days=d)
+        if day.weekday() != 6:
+            yield day
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load a large synthetic dataset for the benchmarks (bench_tools): patients, "
+        "availability with parallel chairs, and appointments. Intended for a dedicated "
+        "benchmark database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=200_000)
+        parser.add_argument("--availability", type=int, default=2_000_000,
+                            help="Approximate Availability rows; spread over --days as parallel chairs.")
+        parser.add_argument("--appointments", type=int, default=500_000)
+        parser.add_argument("--days", type=int, default=365, help="Availability horizon from today.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--clear", action="store_true",
+                            help="First delete seeded patients (and their appointments) and ALL availability. "
+                                 "Needs --i-know-this-is-a-bench-db.")
+        parser.add_argument("--i-know-this-is-a-bench-db", action="store_true", dest="bench_db",
+                            help="Confirm that --clear may wipe every Availability row in this database.")
+
+    def handle(self, *args, **opts):
+        if opts["patients"] < 1 and opts["appointments"]:
+            raise CommandError("--appointments needs at least one patient")
+        if opts["clear"] and not opts["bench_db"]:
+            # seeded availability rows carry no marker, so --clear cannot tell them from real ones
+            raise CommandError("--clear deletes ALL availability; pass --i-know-this-is-a-bench-db to confirm.")
+        batch = opts["batch_size"]
+        if opts["clear"]:
+            self._timed("clear", lambda: self._clear())
+
+        patient_ids = self._timed("patients", lambda: self._seed_patients(opts["patients"], batch))
+        self._timed("availability", lambda: self._seed_availability(opts["availability"], opts["days"], batch))
+        self._timed("appointments", lambda: self._seed_appointments(opts["appointments"], patient_ids, batch))
+
+    def _timed(self, label, fn):
+        t0 = clock.perf_counter()
+        result = fn()
+        self.stdout.write(f"{label:<14} {clock.perf_counter() - t0:8.1f}s")
+        return result
+
+    def _clear(self):
+        """Seeded patients are found by PHONE_PREFIX; availability has no marker and is wiped whole."""
+        Patient.objects.filter(phone__startswith=PHONE_PREFIX).delete()
+        Availability.objects.all().delete()
+
+    def _insert(self, model, rows: Iterable, batch: int) -> int:
+        total = 0
+        for chunk in _batched(rows, batch):
+            with transaction.atomic():
+                model.objects.bulk_create(chunk, batch_size=batch)
+            total += len(chunk)
+        return total
+
+    def _seed_patients(self, n: int, batch: int) -> List[int]:
+        """Insert n patients; returns their ids in insertion order."""
+        dob = date(1980, 1, 1)
+
+        def rows():
+            for i in range(n):
+                name, phone = bench_name(i), bench_phone(i)
+                # bulk_create skips save(), so set the lookup keys here
+                yield Patient(full_name=name, phone=phone, dob=dob + timedelta(days=i % 15000),
+                              name_key=normalize_name(name), phone_digits=normalize_phone(phone))
+
+        before = Patient.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        count = self._insert(Patient, rows(), batch)
+        self.stdout.write(f"  {count} patients")
+        # ids can skip values (e.g. after --clear), and not every backend returns
+        # them from bulk_create, so read back the rows just inserted
+        return list(
+            Patient.objects.filter(id__gt=before, phone__startswith=PHONE_PREFIX)
+            .order_by("id").values_list("id", flat=True)
+        )
+
+    def _seed_availability(self, n: int, days: int, batch: int) -> None:
+        slots_per_day = (CLOSE_HOUR - OPEN_HOUR) * 60 // SLOT_MINUTES
+        open_days = list(_open_days(timezone.localdate(), days))
+        chairs = max(1, math.ceil(n / (len(open_days) * slots_per_day * len(TYPES))))
+        step = timedelta(minutes=SLOT_MINUTES)
+
+        def rows():
+            made = 0
+            for day in open_days:
+                opening = timezone.make_aware(datetime.combine(day, time(OPEN_HOUR)))
+                for s in range(slots_per_day):
+                    start = opening + s * step
+                    for appt_type in TYPES:
+                        for _ in range(chairs):
+                            if made >= n:
+                                return
+                            made += 1
+                            yield Availability(start=start, end=start + step, appointment_type=appt_type)
+
+        count = self._insert(Availability, rows(), batch)
+        self.stdout.write(f"  {count} availability rows ({chairs} chairs x {len(open_days)} days)")
+
+    def _seed_appointments(self, n: int, patient_ids: List[int], batch: int) -> None:
+        # half in the past year, half in the next; each patient's rows are a week apart,
+        # so (patient, start, end) stays unique
+        base = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=365), time(OPEN_HOUR)))
+        slots_per_day = (CLOSE_HOUR - OPEN_HOUR) * 60 // SLOT_MINUTES
+        step = timedelta(minutes=SLOT_MINUTES)
+        patients = len(patient_ids)
+
+        def rows():
+            for j in range(n):
+                k, p = divmod(j, patients)
+                start = base + timedelta(days=(k * 7 + p) % 730) + (p % slots_per_day) * step
+                status = Appointment.Status.CANCELED if j % 10 == 0 else Appointment.Status.BOOKED
+                yield Appointment(patient_id=patient_ids[p], type=TYPES[j % len(TYPES)],
+                                  start=start, end=start + step, status=status)
+
+        count = self._insert(Appointment, rows(), batch)
+        self.stdout.write(f"  {count} appointments")
@@ -0,0 +1,40 @@
+from datetime import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from appointments.management.commands.create_timeslots import DEFAULT_TYPES
+from appointments.models import OpeningHours
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the weekly OpeningHours template used by the computed scheduling engine "
+        "from settings.CLINIC_HOURS: one row per open weekday and appointment type."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--types", nargs="+", default=list(DEFAULT_TYPES), help="Appointment types to open.")
+        parser.add_argument("--replace", action="store_true", help="Delete the existing template first.")
+
+    @transaction.atomic
+    def handle(self, *args, **opts):
+        if OpeningHours.objects.exists():
+            if not opts["replace"]:
+                self.stdout.write("OpeningHours already has rows; pass --replace to rewrite them.")
+                return
+            OpeningHours.objects.all().delete()
+        hours = getattr(settings, "CLINIC_HOURS", {}) or {}
+        rows = OpeningHours.objects.bulk_create(
+            OpeningHours(
+                weekday=weekday,
+                open_time=time(int(hours.get("OPEN_HOUR", 8))),
+                close_time=time(int(hours.get("CLOSE_HOUR", 18))),
+                appointment_type=appt_type,
+                slot_minutes=int(hours.get("SLOT_MINUTES", 30)),
+            )
+            for weekday in sorted(hours.get("WEEKDAYS", range(6)))
+            for appt_type in opts["types"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Created {len(rows)} OpeningHours rows."))
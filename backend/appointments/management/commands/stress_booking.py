@@ -0,0 +1,120 @@
+import threading
+import time as clock
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Count
+from django.utils import timezone
+
+from appointments.models import Appointment, Availability, Patient
+from chat import tools
+from scheduling import engine
+
+PHONE_PREFIX = "555999"
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire many simultaneous book_appointment calls at a few slots of one day and "
+        "report throughput, conflicts and double bookings. Uses its own far-future day "
+        "and removes everything it created unless --keep is given. Writes to the database, "
+        "so it needs --i-know-this-is-a-bench-db."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16, help="Concurrent booking threads.")
+        parser.add_argument("--bookings", type=int, default=8, help="Booking attempts per thread.")
+        parser.add_argument("--slots", type=int, default=10, help="Slots on the contested day.")
+        parser.add_argument("--type", default=Availability.ApptType.FILLING, help="Appointment type to book.")
+        parser.add_argument("--days-ahead", type=int, default=400, help="Which day to use, counted from today.")
+        parser.add_argument("--keep", action="store_true", help="Keep the created rows for inspection.")
+        parser.add_argument("--i-know-this-is-a-bench-db", action="store_true", dest="bench_db",
+                            help="Confirm that this database may be used for the stress test.")
+
+    def handle(self, *args, **opts):
+        if not opts["bench_db"]:
+            raise CommandError("stress_booking books and deletes rows; pass --i-know-this-is-a-bench-db to confirm.")
+        appt_type = opts["type"]
+        day = timezone.localdate() + timedelta(days=opts["days_ahead"])
+        # the computed engine only has openings on OpeningHours weekdays
+        while day.weekday() == 6:
+            day += timedelta(days=1)
+        first = timezone.make_aware(datetime.combine(day, time(9, 0)))
+        starts = [first + timedelta(minutes=30 * i) for i in range(opts["slots"])]
+        self._cleanup(appt_type, day)
+        slot_ids = []
+        if not engine.is_enabled():
+            existing = Availability.objects.filter(appointment_type=appt_type, start__date=day).count()
+            if existing:
+                # they are not ours to delete, and they would skew the counts below
+                raise CommandError(f"{day} already has {existing} {appt_type} slots; pick another --days-ahead.")
+            before = Availability.objects.order_by("-id").values_list("id", flat=True).first() or 0
+            Availability.objects.bulk_create(
+                Availability(start=s, end=s + timedelta(minutes=30), appointment_type=appt_type) for s in starts
+            )
+            slot_ids = list(Availability.objects.filter(
+                id__gt=before, appointment_type=appt_type, start__in=starts
+            ).values_list("id", flat=True))
+
+        outcomes: Counter = Counter()
+        lock = threading.Lock()
+        barrier = threading.Barrier(opts["threads"])
+
+        def worker(n: int):
+            barrier.wait()
+            try:
+                for i in range(opts["bookings"]):
+                    # everyone aims at the same few slots to force conflicts
+                    start = timezone.localtime(starts[(n + i) % len(starts)])
+                    params = {
+                        "patient_info": {"name": f"Stress {n}-{i}", "phone": f"{PHONE_PREFIX}{n:02d}{i:02d}"},
+                        "type": appt_type,
+                        "start": start.replace(tzinfo=None).isoformat(),
+                    }
+                    try:
+                        result = tools.book_appointment(params)
+                        key = "booked" if result.get("ok") else result.get("error", "failed")
+                    except Exception as e:
+                        key = f"error:{type(e).__name__}"
+                    with lock:
+                        outcomes[key] += 1
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(opts["threads"])]
+        t0 = clock.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = clock.perf_counter() - t0
+
+        booked = Appointment.objects.filter(
+            type=appt_type, start__date=day, status=Appointment.Status.BOOKED, patient__phone__startswith=PHONE_PREFIX
+        )
+        doubles = booked.values("start").annotate(n=Count("id")).filter(n__gt=1).count()
+        attempts = sum(outcomes.values())
+        self.stdout.write(
+            f"engine={'computed' if engine.is_enabled() else 'materialized'} threads={opts['threads']} "
+            f"attempts={attempts} slots={len(starts)} elapsed={elapsed:.2f}s "
+            f"throughput={attempts / elapsed:.1f} bookings/s"
+        )
+        for key, n in sorted(outcomes.items()):
+            self.stdout.write(f"  {key:<24} {n}")
+        self.stdout.write(f"  appointments in DB       {booked.count()}")
+        self.stdout.write(f"  double-booked starts     {doubles}")
+        # the computed engine may also book the free half-hours around the contested slots
+        overbooked = not engine.is_enabled() and booked.count() > len(starts)
+        if overbooked or doubles:
+            self.stderr.write(self.style.ERROR("Slots were booked more than once."))
+        elif not opts["keep"]:
+            self._cleanup(appt_type, day, slot_ids)
+
+    def _cleanup(self, appt_type, day, slot_ids=()):
+        """Remove this command's patients and appointments, and the unbooked slots it created."""
+        Appointment.objects.filter(type=appt_type, start__date=day, patient__phone__startswith=PHONE_PREFIX).delete()
+        Patient.objects.filter(phone__startswith=PHONE_PREFIX, appointments__isnull=True).delete()
+        if slot_ids:
+            Availability.objects.filter(id__in=slot_ids).delete()
@@ -0,0 +1,130 @@
+import random
+import time as clock
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from django.utils import timezone
+
+from appointments.models import Appointment, Availability, Patient
+from chat import tools
+from scheduling import engine
+from scheduling.availability_index import availability_index
+
+HOURS = list(tools.SLOT_PREFERENCES.values())
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the in-memory availability index and check it against the DB: random "
+        "range queries must return the same slots as the Availability query, and after "
+        "--mutate random book/cancel/reschedule calls (committed!) the incrementally "
+        "updated bitmaps must equal a fresh build."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=200, help="Random range queries to compare.")
+        parser.add_argument("--mutate", type=int, default=0,
+                            help="Book/cancel/reschedule calls to make through chat.tools before verifying.")
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **opts):
+        if engine.is_enabled():
+            raise CommandError("The availability index serves the materialized engine only.")
+        rnd = random.Random(opts["seed"])
+        enabled = availability_index.enabled
+        availability_index.enabled = True
+        try:
+            availability_index.build()
+            self.stdout.write(
+                f"built in {availability_index.build_seconds * 1000:.1f}ms, "
+                f"horizon {availability_index.horizon_days} days, ~{availability_index.memory_bytes()} bytes"
+            )
+            self._compare(rnd, opts["queries"])
+            if opts["mutate"]:
+                self._mutate(rnd, opts["mutate"])
+            problems = availability_index.verify()
+        finally:
+            availability_index.enabled = enabled
+        for problem in problems[:20]:
+            self.stdout.write(f"  {problem}")
+        if problems:
+            raise CommandError(f"{len(problems)} type-days differ from the DB")
+        self.stdout.write(self.style.SUCCESS("index matches the DB"))
+
+    def _range(self, rnd):
+        today = timezone.localdate()
+        first = timezone.make_aware(datetime.combine(today + timedelta(days=rnd.randrange(availability_index.horizon_days)),
+                                                     time(rnd.randrange(24), rnd.choice((0, 15, 30)))))
+        end = first + timedelta(hours=rnd.choice((3, 8, 24, 72, 168)))
+        return first, end
+
+    def _compare(self, rnd, n):
+        index_s = db_s = 0.0
+        compared = 0
+        for _ in range(n):
+            appt_type = rnd.choice(Availability.ApptType.values)
+            hours = rnd.choice(HOURS)
+            start, end = self._range(rnd)
+            if not availability_index.covers(start, end):
+                continue
+            t0 = clock.perf_counter()
+            ours = [(s["start"], s["end"]) for s in availability_index.slots(appt_type, start, end, hours)]
+            t1 = clock.perf_counter()
+            qs = Availability.objects.filter(appointment_type=appt_type, start__gte=start, end__lte=end)
+            if hours[0] is not None:
+                qs = qs.filter(start__hour__gte=hours[0])
+            if hours[1] is not None:
+                qs = qs.filter(start__hour__lt=hours[1])
+            theirs = list(qs.order_by("start", "id").values_list("start", "end"))
+            t2 = clock.perf_counter()
+            index_s += t1 - t0
+            db_s += t2 - t1
+            compared += 1
+            if ours != theirs:
+                raise CommandError(
+                    f"{appt_type} {start:%Y-%m-%d %H:%M}..{end:%Y-%m-%d %H:%M} hours={hours}: "
+                    f"index has {len(ours)} slots, DB {len(theirs)}"
+                )
+        if compared:
+            self.stdout.write(
+                f"{compared} range queries identical; mean index {index_s / compared * 1000:.3f}ms, "
+                f"DB {db_s / compared * 1000:.3f}ms"
+            )
+
+    def _mutate(self, rnd, n):
+        patients = list(Patient.objects.order_by("id").values("full_name", "phone")[:1000])
+        if not patients:
+            raise CommandError("--mutate needs patients")
+        horizon = timezone.now() + timedelta(days=availability_index.horizon_days)
+        outcomes = {}
+        for _ in range(n):
+            op = rnd.choice(("book", "book", "cancel", "reschedule"))
+            slot = (
+                Availability.objects.filter(start__gt=timezone.now(), start__lt=horizon)
+                .order_by("start")[rnd.randrange(50):][:1].first()
+            )
+            booked = (
+                Appointment.objects.filter(status=Appointment.Status.BOOKED, start__gt=timezone.now(),
+                                           start__lt=horizon, type__in=Availability.ApptType.values)
+                .order_by("-id").first()
+            )
+            if op == "book" and slot:
+                patient = rnd.choice(patients)
+                info = {"name": patient["full_name"], "phone": patient["phone"]}
+                start = timezone.localtime(slot.start).replace(tzinfo=None).isoformat()
+                try:
+                    result = tools.book_appointment({"patient_info": info, "type": slot.appointment_type, "start": start})
+                except IntegrityError:
+                    # this patient already has that time
+                    continue
+            elif op == "cancel" and booked:
+                result = tools.cancel_appointment({"appointment_id": booked.id})
+            elif op == "reschedule" and booked and slot:
+                start = timezone.localtime(slot.start).replace(tzinfo=None).isoformat()
+                result = tools.reschedule_appointment({"appointment_id": booked.id, "new_start": start})
+            else:
+                continue
+            key = f"{op}:{'ok' if result.get('ok') else result.get('error')}"
+            outcomes[key] = outcomes.get(key, 0) + 1
+        self.stdout.write("mutations: " + ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('open_time', models.TimeField()),
+                ('close_time', models.TimeField()),
+                ('appointment_type', models.CharField(blank=True, choices=[('cleaning', 'Cleaning'), ('checkup', 'Checkup'), ('filling', 'Filling'), ('emergency', 'Emergency')], max_length=24, null=True)),
+                ('slot_minutes', models.PositiveSmallIntegerField(default=30)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['weekday', 'appointment_type'], name='appointment_weekday_6dc557_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ScheduleException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('kind', models.CharField(choices=[('closed', 'Closed'), ('open', 'Open')], default='closed', max_length=16)),
+                ('appointment_type', models.CharField(blank=True, choices=[('cleaning', 'Cleaning'), ('checkup', 'Checkup'), ('filling', 'Filling'), ('emergency', 'Emergency')], max_length=24, null=True)),
+                ('reason', models.CharField(blank=True, max_length=200)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start', 'end'], name='appointment_start_e514cb_idx')],
+            },
+        ),
+    ]
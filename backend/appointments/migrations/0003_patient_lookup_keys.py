@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:30
+
+import re
+
+from django.db import migrations, models
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    # Same rules as appointments.models.normalize_phone / normalize_name,
+    # copied so the migration does not depend on current model code.
+    Patient = apps.get_model("appointments", "Patient")
+    batch = []
+    for p in Patient.objects.only("id", "full_name", "phone").iterator(chunk_size=2000):
+        digits = re.sub(r"\D+", "", p.phone or "")
+        if len(digits) == 11 and digits.startswith("1"):
+            digits = digits[1:]
+        p.phone_digits = digits
+        p.name_key = " ".join((p.full_name or "").split()).casefold()
+        batch.append(p)
+        if len(batch) >= 2000:
+            Patient.objects.bulk_update(batch, ["phone_digits", "name_key"])
+            batch = []
+    if batch:
+        Patient.objects.bulk_update(batch, ["phone_digits", "name_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_schedule_templates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=120),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='phone_digits',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['phone_digits', 'name_key'], name='appointment_phone_d_ca7e32_idx'),
+        ),
+    ]
@@ -1,17 +1,52 @@
+import re
+
 from django.db import models
 
+NON_DIGITS = re.compile(r"\D+")
+
+
+def normalize_phone(phone: str) -> str:
+    """Digits only, dropping the +1 country code of 11-digit NANP numbers."""
+    digits = NON_DIGITS.sub("", phone or "")
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits
+
+
+def normalize_name(name: str) -> str:
+    """Casefolded with whitespace collapsed, for case-insensitive exact matches."""
+    return " ".join((name or "").split()).casefold()
+
+
 class Patient(models.Model):
     full_name = models.CharField(max_length=120)
     phone = models.CharField(max_length=32)
     dob = models.DateField()
     insurance_name = models.CharField(max_length=120, blank=True, null=True)
+    # lookup keys derived from full_name/phone on save(); bulk writes must set them too
+    name_key = models.CharField(max_length=120, default="", editable=False)
+    phone_digits = models.CharField(max_length=32, default="", editable=False)
 
     class Meta:
         indexes = [
             models.Index(fields=["phone"]),
             models.Index(fields=["full_name"]),
+            models.Index(fields=["phone_digits", "name_key"]),
         ]
 
+    def save(self, *args, **kwargs):
+        self.name_key = normalize_name(self.full_name)
+        self.phone_digits = normalize_phone(self.phone)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if "full_name" in update_fields:
+                update_fields.add("name_key")
+            if "phone" in update_fields:
+                update_fields.add("phone_digits")
+            kwargs["update_fields"] = update_fields
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.full_name} ({self.phone})"
 
@@ -58,6 +93,53 @@ class Availability(models.Model):
         ]
 
 
+class OpeningHours(models.Model):
+    """Weekly opening template used by the computed scheduling engine (scheduling.engine)."""
+    class Weekday(models.IntegerChoices):
+        MONDAY = 0, "Monday"
+        TUESDAY = 1, "Tuesday"
+        WEDNESDAY = 2, "Wednesday"
+        THURSDAY = 3, "Thursday"
+        FRIDAY = 4, "Friday"
+        SATURDAY = 5, "Saturday"
+        SUNDAY = 6, "Sunday"
+
+    weekday = models.PositiveSmallIntegerField(choices=Weekday.choices)
+    open_time = models.TimeField()
+    close_time = models.TimeField()
+    # blank = applies to every appointment type
+    appointment_type = models.CharField(max_length=24, choices=Availability.ApptType.choices, blank=True, null=True)
+    slot_minutes = models.PositiveSmallIntegerField(default=30)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["weekday", "appointment_type"]),
+        ]
+
+    def __str__(self):
+        kind = self.appointment_type or "all types"
+        return f"{self.get_weekday_display()} {self.open_time:%H:%M}-{self.close_time:%H:%M} ({kind})"
+
+
+class ScheduleException(models.Model):
+    """One-off closure (holiday, staff absence) or extra opening on top of OpeningHours."""
+    class Kind(models.TextChoices):
+        CLOSED = "closed", "Closed"
+        OPEN = "open", "Open"
+
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    kind = models.CharField(max_length=16, choices=Kind.choices, default=Kind.CLOSED)
+    # blank = applies to every appointment type
+    appointment_type = models.CharField(max_length=24, choices=Availability.ApptType.choices, blank=True, null=True)
+    reason = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["start", "end"]),
+        ]
+
+
 class Appointment(models.Model):
     class Status(models.TextChoices):
         BOOKED = "booked", "Booked"
@@ -53,6 +53,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'corsheaders.middleware.CorsMiddleware',
+    "api.middleware.request_metrics_middleware",
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -101,6 +102,145 @@ DATABASES = {
 # }
 
 
+# Cache for LLM-resolved fuzzy date ranges (scheduling.fuzzy).
+# BACKEND is "local" (per-process LRU) or "django" (shared via CACHES[ALIAS]).
+FUZZY_RANGE_CACHE = {
+    "BACKEND": os.environ.get("FUZZY_RANGE_CACHE_BACKEND", "local"),
+    "ALIAS": "default",
+    "MAXSIZE": 1024,
+    "TTL": 3600,
+}
+
+
+# Clinic opening hours (local time; weekdays 0 = Monday). The rule-based date
+# parser (scheduling.fuzzy), create_timeslots and the OpeningHours template
+# written by `manage.py seed_opening_hours` all read these.
+CLINIC_HOURS = {
+    "OPEN_HOUR": 8,
+    "CLOSE_HOUR": 18,
+    "WEEKDAYS": [0, 1, 2, 3, 4, 5],
+    "SLOT_MINUTES": 30,
+}
+
+# Where free appointment slots come from (chat.tools / scheduling.engine):
+#   "materialized" - one Availability row per slot, consumed on booking
+#   "computed"     - derived from OpeningHours + ScheduleException minus booked Appointments
+SCHEDULING_ENGINE = os.environ.get("SCHEDULING_ENGINE", "materialized")
+
+# In-memory per-day bitmaps of free slots (scheduling.availability_index) for
+# the materialized engine, covering today + HORIZON_DAYS. Rebuilt from the DB
+# after MAX_AGE seconds, which bounds how stale other processes' bookings
+# can look; off by default for multi-process deployments.
+AVAILABILITY_INDEX = {
+    "ENABLED": os.environ.get("AVAILABILITY_INDEX", "0") == "1",
+    "HORIZON_DAYS": 60,
+    "MAX_AGE": 300,
+}
+
+# Read-through cache of free Availability rows per type and local day
+# (scheduling.availability_cache), in CACHES[ALIAS]. Invalidated after commit
+# by bookings, cancellations, reschedules and generate_availability_window;
+# with the per-process LocMemCache other workers only see those after TTL,
+# so point ALIAS at a shared cache (Redis, Memcached) before enabling it there.
+AVAILABILITY_CACHE = {
+    "ENABLED": os.environ.get("AVAILABILITY_CACHE", "0") == "1",
+    "ALIAS": os.environ.get("AVAILABILITY_CACHE_ALIAS", "default"),
+    "TTL": 300,
+    "MAX_DAYS": 62,
+}
+
+
+# Server-side chat history (chat.sessions). BACKEND is "memory" (per-process
+# LRU) or "database" (api.ChatSession rows; delete expired ones with
+# `manage.py purge_chat_sessions`). Conversations expire after TTL seconds idle.
+CHAT_SESSION_STORE = {
+    "BACKEND": os.environ.get("CHAT_SESSION_BACKEND", "memory"),
+    "MAXSIZE": 1000,
+    "TTL": 3600,
+}
+
+
+# Gemini context caching of the static flow prompts (chat.prompt_cache).
+GEMINI_PROMPT_CACHE = {
+    "ENABLED": os.environ.get("GEMINI_PROMPT_CACHE", "1") == "1",
+    "TTL": 3600,
+}
+
+
+# History compaction before each model call (chat.compaction). The last
+# KEEP_TURNS user turns stay verbatim; TOKEN_BUDGET is per flow/prompt key.
+CHAT_HISTORY_COMPACTION = {
+    "ENABLED": True,
+    "KEEP_TURNS": 4,
+    "TOKEN_BUDGET": {
+        "default": 6000,
+        "find_slots": 4000,
+        "list_appointments": 4000,
+    },
+}
+
+
+# Thread pool size for running independent read-only tool calls of one model
+# reply concurrently (chat.router). Each worker holds its own DB connection.
+CHAT_TOOL_WORKERS = int(os.environ.get("CHAT_TOOL_WORKERS", "4"))
+
+
+# Latency budget per chat turn: every model and tool call shares this
+# deadline, and the tool loop stops after CHAT_MAX_TOOL_ROUNDS rounds.
+CHAT_TURN_BUDGET_SECONDS = float(os.environ.get("CHAT_TURN_BUDGET_SECONDS", "30"))
+CHAT_MAX_TOOL_ROUNDS = int(os.environ.get("CHAT_MAX_TOOL_ROUNDS", "6"))
+
+
+# Local intent router: menu selections and other fixed steps are answered
+# without a model call when the match is at least MIN_CONFIDENCE.
+CHAT_INTENT_ROUTER = {
+    "ENABLED": os.environ.get("CHAT_INTENT_ROUTER", "1") == "1",
+    "MIN_CONFIDENCE": 0.8,
+}
+
+
+# Answer cache for the general_info flow. Similar questions (trigram TF-IDF
+# cosine >= MIN_SIMILARITY) reuse a cached answer; TTL is per entry.
+CHAT_ANSWER_CACHE = {
+    "ENABLED": os.environ.get("CHAT_ANSWER_CACHE", "1") == "1",
+    "TTL": 86400,
+    "MIN_SIMILARITY": 0.6,
+    "MAXSIZE": 512,
+}
+
+
+# TOOL_RESULT encoding (chat.serializer): columnar record lists, short
+# clinic-local times, JSON_BACKEND "auto" uses orjson when installed.
+CHAT_TOOL_RESULT_FORMAT = {
+    "COLUMNAR": True,
+    "LOCAL_TIMES": True,
+    "JSON_BACKEND": os.environ.get("CHAT_TOOL_RESULT_JSON", "auto"),
+}
+
+
+# Model backend (chat.llm): "gemini", "record" (gemini, appending every call
+# to RECORDINGS) or "replay" (offline: RECORDINGS, then SCRIPT rules, else
+# DEFAULT_REPLY, after a simulated LATENCY). Replay makes load tests of the
+# chat view reproducible without network access or an API key.
+CHAT_LLM = {
+    "BACKEND": os.environ.get("CHAT_LLM_BACKEND", "gemini"),
+    "RECORDINGS": os.environ.get("CHAT_LLM_RECORDINGS", str(BASE_DIR / "benchmarks" / "llm_recordings.jsonl")),
+    "SCRIPT": os.environ.get("CHAT_LLM_SCRIPT", ""),
+    "MATCH": "last_message",
+    "DEFAULT_REPLY": None,
+    "LATENCY": {
+        "DISTRIBUTION": os.environ.get("CHAT_LLM_LATENCY", "recorded"),
+        "MS": 800,
+        "MIN_MS": 300,
+        "MAX_MS": 1500,
+        "MEDIAN_MS": 800,
+        "SIGMA": 0.5,
+        "SCALE": 1.0,
+        "SEED": None,
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
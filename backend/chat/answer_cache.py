@@ -0,0 +1,260 @@
+"""
+answer_cache.py
+---------------
+Response cache for the general_info flow.
+
+Questions about hours, location, insurance and policies are answered from
+the fixed facts in prompts.flows, so once Gemini has answered one, the same
+(or a similar) question can be answered locally.
+
+- Questions are normalized (case, punctuation, filler words) and looked up by
+  exact key first.
+- Otherwise a character-trigram TF-IDF index finds the most similar cached
+  question. Its answer is used only if the cosine similarity reaches
+  MIN_SIMILARITY and both questions have the same content words: each word
+  must pair with one on the other side, spelled alike (plurals and small
+  typos pass), and entity words -- days, times of day, procedures, numbers --
+  must be identical. "Sunday" never matches "Saturday", nor "HMO" "PPO".
+- Only messages that mention a general-info topic are looked up or stored, so
+  conversational replies ("yes", a name) are never matched against the cache.
+- Answers that repeat anything from earlier in the conversation (a name, a
+  phone number) that is neither in the question nor in the system prompt are
+  not stored: they depend on the conversation, not just on the question.
+- Every entry has its own expiry; entries are bound to a hash of the system
+  prompt, so editing the prompt text invalidates all of them.
+
+Configured with settings.CHAT_ANSWER_CACHE.
+"""
+
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from django.conf import settings
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "do", "does", "you", "your", "i", "me", "my", "we",
+    "can", "could", "would", "please", "tell", "what", "whats", "hi", "hello", "hey",
+    "to", "of", "for", "on", "at", "there", "any", "know", "like", "want", "just", "so",
+}
+NGRAM = 3
+# words that decide the answer: a match on the rest of the sentence is not enough
+ENTITY_WORDS = {
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "weekday", "weekend", "holiday", "today", "tomorrow", "tonight",
+    "morning", "afternoon", "evening", "night", "early", "late",
+    "cleaning", "checkup", "filling", "emergency", "whitening", "crown", "extraction",
+    "implant", "brace", "root", "canal", "xray", "cavity", "child", "kid", "adult",
+}
+# trigram similarity two differing non-entity words need to count as the same word
+WORD_SIMILARITY = 0.75
+TOPIC_RE = re.compile(
+    r"\b(?:hours?|open\w*|clos\w*|location|located|address|where|directions?|parking|"
+    r"insurance|insured|coverage|cost|price|fees?|pay\w*|policy|policies|weekends?|"
+    r"saturday|sunday|holidays?|accept\w*)\b"
+)
+
+Vector = Dict[str, float]
+
+
+@dataclass
+class _Entry:
+    answer: str
+    expires_at: float
+    grams: Counter
+    terms: FrozenSet[str]
+
+
+@dataclass
+class AnswerCacheStats:
+    lookups: int = 0
+    exact_hits: int = 0
+    similar_hits: int = 0
+    stores: int = 0
+    invalidations: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.exact_hits + self.similar_hits
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+answer_cache_stats = AnswerCacheStats()
+
+
+def normalize_question(text: str) -> str:
+    words = re.findall(r"[a-z0-9]+", text.casefold().replace("'", ""))
+    return " ".join(w for w in words if w not in STOPWORDS)
+
+
+def is_general_question(text: str) -> bool:
+    return bool(TOPIC_RE.search(text.casefold()))
+
+
+def _grams(key: str) -> Counter:
+    padded = f" {key} "
+    return Counter(padded[i:i + NGRAM] for i in range(max(1, len(padded) - NGRAM + 1)))
+
+
+def _stem(word: str) -> str:
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _terms(key: str) -> FrozenSet[str]:
+    return frozenset(_stem(w) for w in key.split())
+
+
+def _word_matches(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if a in ENTITY_WORDS or b in ENTITY_WORDS or any(c.isdigit() for c in a + b):
+        return False
+    ga, gb = set(_grams(a)), set(_grams(b))
+    return len(ga & gb) / math.sqrt(len(ga) * len(gb)) >= WORD_SIMILARITY
+
+
+def _same_terms(a: FrozenSet[str], b: FrozenSet[str]) -> bool:
+    """Every content word on each side pairs with one on the other."""
+    return (all(any(_word_matches(x, y) for y in b) for x in a - b)
+            and all(any(_word_matches(y, x) for x in a) for y in b - a))
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.casefold().replace("'", "")))
+
+
+def borrows_from(answer: str, earlier: Iterable[str], question: str, system_prompt: str) -> bool:
+    """
+    Whether `answer` repeats a word from `earlier` messages that is in neither
+    the question nor the system prompt -- i.e. it depends on the conversation.
+    """
+    said = set()
+    for text in earlier:
+        said |= _words(text)
+    said -= _words(question) | _words(system_prompt) | STOPWORDS
+    return bool(said & _words(answer))
+
+
+class AnswerCache:
+    def __init__(self, ttl: int = 86400, min_similarity: float = 0.6, maxsize: int = 512,
+                 enabled: bool = True):
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self._prompt_key: Optional[str] = None
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._df: Counter = Counter()       # trigram -> number of entries containing it
+        self._vectors: Dict[str, Vector] = {}  # entry vectors for the current df; reset when it changes
+        self._lock = threading.Lock()
+
+    # -- index maintenance (caller holds the lock) -------------------------
+
+    def _check_prompt(self, system_prompt: str) -> None:
+        key = hashlib.sha1(system_prompt.encode()).hexdigest()
+        if key != self._prompt_key:
+            if self._entries:
+                answer_cache_stats.invalidations += 1
+            self._entries.clear()
+            self._df.clear()
+            self._vectors.clear()
+            self._prompt_key = key
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._df.subtract(entry.grams.keys())
+        self._df += Counter()   # drop zero counts
+        self._vectors.clear()
+
+    def _vector(self, grams: Counter) -> Vector:
+        n = len(self._entries) + 1
+        vec = {g: c * (math.log(n / (1 + self._df[g])) + 1.0) for g, c in grams.items()}
+        norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+        return {g: v / norm for g, v in vec.items()}
+
+    def _most_similar(self, grams: Counter, terms: FrozenSet[str]) -> Tuple[float, Optional[str]]:
+        """Best-scoring live entry with the same content words as the query."""
+        query = self._vector(grams)
+        best, best_key = 0.0, None
+        now = monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry.expires_at <= now:
+                self._remove(key)
+                continue
+            candidate = self._vectors.get(key)
+            if candidate is None:
+                candidate = self._vectors[key] = self._vector(entry.grams)
+            score = sum(w * candidate.get(g, 0.0) for g, w in query.items())
+            if score > best and _same_terms(terms, entry.terms):
+                best, best_key = score, key
+        return best, best_key
+
+    # -- public API --------------------------------------------------------
+
+    def get(self, question: str, system_prompt: str) -> Optional[str]:
+        """Cached answer for this question (or a similar enough one), else None."""
+        if not self.enabled:
+            return None
+        key = normalize_question(question)
+        if not key or not is_general_question(question):
+            return None
+        with self._lock:
+            answer_cache_stats.lookups += 1
+            self._check_prompt(system_prompt)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > monotonic():
+                    self._entries.move_to_end(key)
+                    answer_cache_stats.exact_hits += 1
+                    return entry.answer
+                self._remove(key)
+            score, similar = self._most_similar(_grams(key), _terms(key))
+            if similar is None or score < self.min_similarity:
+                return None
+            self._entries.move_to_end(similar)
+            answer_cache_stats.similar_hits += 1
+            return self._entries[similar].answer
+
+    def set(self, question: str, system_prompt: str, answer: str, ttl: Optional[int] = None) -> None:
+        if not self.enabled:
+            return
+        key = normalize_question(question)
+        if not key or not is_general_question(question):
+            return
+        with self._lock:
+            self._check_prompt(system_prompt)
+            if key in self._entries:
+                self._remove(key)
+            grams = _grams(key)
+            self._entries[key] = _Entry(answer, monotonic() + (self.ttl if ttl is None else ttl), grams, _terms(key))
+            self._df.update(grams.keys())
+            self._vectors.clear()
+            answer_cache_stats.stores += 1
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._df.clear()
+            self._vectors.clear()
+
+
+def build_answer_cache() -> AnswerCache:
+    conf = getattr(settings, "CHAT_ANSWER_CACHE", {}) or {}
+    return AnswerCache(
+        ttl=int(conf.get("TTL", 86400)),
+        min_similarity=float(conf.get("MIN_SIMILARITY", 0.6)),
+        maxsize=int(conf.get("MAXSIZE", 512)),
+        enabled=bool(conf.get("ENABLED", True)),
+    )
@@ -0,0 +1,169 @@
+"""
+compaction.py
+-------------
+Token-budgeted history compaction before a model call.
+
+Long conversations (especially reschedules) carry every TOOL_RESULT ever
+returned, e.g. full find_slots slot lists. Before each call:
+
+1. The last KEEP_TURNS user turns (and everything after them) stay verbatim;
+   KEEP_TURNS = 0 keeps none.
+2. Older TOOL_RESULT messages are collapsed to a short structured summary:
+   scalar fields are kept (ids, ok/error), lists become their length plus
+   the first few items.
+3. If the history is still over the flow's TOKEN_BUDGET, the oldest turns
+   before the verbatim tail are dropped, whole turns at a time (a user
+   message up to the next one), so no TOOL_RESULT loses the call it answers
+   and the history never starts with a model turn.
+4. If it is still over budget -- a short conversation holding one huge
+   TOOL_RESULT -- TOOL_RESULTs in the tail are collapsed too, oldest first.
+
+Tokens are estimated at ~4 characters per token; this only has to be
+consistent, not exact. Configured with settings.CHAT_HISTORY_COMPACTION.
+"""
+
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TOOL_RESULT_PREFIX = "TOOL_RESULT: "
+SUMMARY_PREFIX = "TOOL_RESULT (summary): "
+CHARS_PER_TOKEN = 4
+LIST_PREVIEW = 3
+
+Message = Dict[str, Any]
+
+
+@dataclass
+class CompactionStats:
+    requests: int = 0
+    compacted: int = 0
+    tokens_saved: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, saved: int) -> None:
+        # sync views and async-view worker threads compact concurrently
+        with self._lock:
+            self.requests += 1
+            if saved > 0:
+                self.compacted += 1
+                self.tokens_saved += saved
+
+
+compaction_stats = CompactionStats()
+
+
+def estimate_tokens(messages: List[Message]) -> int:
+    return sum(len(m["content"]) for m in messages) // CHARS_PER_TOKEN + len(messages)
+
+
+def _conf() -> Dict[str, Any]:
+    return getattr(settings, "CHAT_HISTORY_COMPACTION", {}) or {}
+
+
+def token_budget(flow: str) -> int:
+    budgets = _conf().get("TOKEN_BUDGET", {})
+    return int(budgets.get(flow, budgets.get("default", 6000)))
+
+
+def _is_turn_start(m: Message) -> bool:
+    return m["role"] == "user" and not m["content"].startswith((TOOL_RESULT_PREFIX, SUMMARY_PREFIX))
+
+
+def _summarize_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return {"count": len(value), "first": [_summarize_value(v) for v in value[:LIST_PREVIEW]]}
+    if isinstance(value, dict):
+        return {k: _summarize_value(v) for k, v in value.items() if not isinstance(v, (list, dict)) or v}
+    return value
+
+
+def _is_tool_result(m: Message) -> bool:
+    return m["role"] == "user" and m["content"].startswith(TOOL_RESULT_PREFIX)
+
+
+def _split_turns(messages: List[Message]) -> List[List[Message]]:
+    """Messages grouped into turns, each starting at a user message (the first may be a model prelude)."""
+    turns: List[List[Message]] = []
+    for m in messages:
+        if _is_turn_start(m) or not turns:
+            turns.append([])
+        turns[-1].append(m)
+    return turns
+
+
+# the same old TOOL_RESULTs are summarized again on every model call
+@lru_cache(maxsize=512)
+def summarize_tool_result(content: str) -> str:
+    """Collapse a TOOL_RESULT message to its scalar fields and list previews."""
+    try:
+        payload = json.loads(content[len(TOOL_RESULT_PREFIX):])
+    except ValueError:
+        return content
+    summary = SUMMARY_PREFIX + json.dumps(_summarize_value(payload), separators=(",", ":"))
+    return summary if len(summary) < len(content) else content
+
+
+def compact_history(messages: List[Message], flow: str) -> Tuple[List[Message], int]:
+    """
+    Return (messages to send, tokens saved). The original list is returned
+    unchanged (same object) when nothing needed compacting.
+    """
+    compacted, saved = _compact(messages, flow)
+    compaction_stats.record(saved)
+    return compacted, saved
+
+
+def _compact(messages: List[Message], flow: str) -> Tuple[List[Message], int]:
+    conf = _conf()
+    if not conf.get("ENABLED", True):
+        return messages, 0
+
+    keep_turns = int(conf.get("KEEP_TURNS", 4))
+    budget = token_budget(flow)
+    before = estimate_tokens(messages)
+
+    turn_starts = [i for i, m in enumerate(messages) if _is_turn_start(m)]
+    if keep_turns <= 0:
+        # nothing stays verbatim ([-0] would keep every turn)
+        tail_start = len(messages)
+    else:
+        tail_start = turn_starts[-keep_turns] if len(turn_starts) >= keep_turns else 0
+    if tail_start == 0 and before <= budget:
+        return messages, 0
+
+    head = [
+        {"role": m["role"], "content": summarize_tool_result(m["content"])} if _is_tool_result(m) else m
+        for m in messages[:tail_start]
+    ]
+    tail = list(messages[tail_start:])
+
+    # still over budget: drop the oldest whole turns, never the verbatim tail
+    turns = _split_turns(head)
+    tokens = estimate_tokens(head) + estimate_tokens(tail)
+    while turns and tokens > budget:
+        tokens -= estimate_tokens(turns.pop(0))
+    head = [m for turn in turns for m in turn]
+
+    # and then the tail's TOOL_RESULTs, oldest first
+    for i, m in enumerate(tail):
+        if tokens <= budget:
+            break
+        if _is_tool_result(m):
+            summary = {"role": m["role"], "content": summarize_tool_result(m["content"])}
+            tokens += estimate_tokens([summary]) - estimate_tokens([m])
+            tail[i] = summary
+
+    compacted = head + tail
+    saved = before - estimate_tokens(compacted)
+    if saved <= 0:
+        return messages, 0
+    logger.info("history compacted for flow=%s: %d -> %d tokens (saved %d)", flow, before, before - saved, saved)
+    return compacted, saved
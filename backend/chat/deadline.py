@@ -0,0 +1,71 @@
+"""
+deadline.py
+-----------
+Per-request latency budget for a chat turn.
+
+A Deadline is created when a turn starts and handed to every model call and
+tool call in it. It is also published through a ContextVar, so code deeper
+in the stack (e.g. the LLM fallback in scheduling.fuzzy) can cap its own
+timeouts without extra parameters. StageTimer records where the time went.
+"""
+
+import contextvars
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+from typing import List, Optional, Tuple
+
+current_deadline: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        if self.expired():
+            raise DeadlineExceeded(f"turn budget of {self.seconds}s exhausted")
+
+    def timeout_ms(self) -> int:
+        """Remaining budget as an HTTP timeout; raises if nothing is left."""
+        self.check()
+        return max(1, int(self.remaining() * 1000))
+
+
+class StageTimer:
+    """Accumulates wall time per stage ("llm", "tool", ...) for one request."""
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+        self._started = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, (perf_counter() - t0) * 1000))
+
+    def totals(self) -> dict:
+        out: dict = {}
+        for name, ms in self.stages:
+            out[name] = out.get(name, 0.0) + ms
+        out["total"] = (perf_counter() - self._started) * 1000
+        return out
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header (shown in browser dev tools)."""
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.totals().items())
@@ -0,0 +1,205 @@
+"""
+intent.py
+---------
+Local intent routing that runs before the model call.
+
+The first steps of every conversation are fixed: the menu ("1) Book
+appointment ...") and, for bookings, "new or existing patient?". A reply like
+"1" or "book appointment" to those needs no LLM, so it is answered here with
+the same wording the prompt would produce, and the matching PROMPT_MAP flow
+is selected for the rest of the conversation.
+
+Rules are keyword / regex matches scored with a confidence; anything below
+MIN_CONFIDENCE (or longer free text that needs the model to read it) falls
+through to Gemini unchanged. Configured with settings.CHAT_INTENT_ROUTER.
+"""
+
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+ASK_PATIENT_STATUS = "Are you a new patient or an existing patient?"
+
+# Messages up to this many words can be answered directly; longer ones usually
+# carry details (dates, names) and go to the model with the selected flow.
+SHORT_REPLY_WORDS = 6
+
+
+@dataclass
+class Intent:
+    name: str
+    flow: str
+    confidence: float
+    reply: Optional[str] = None
+
+
+@dataclass
+class Rule:
+    name: str
+    flow: str
+    exact: Pattern
+    keywords: Pattern
+    reply: Optional[str] = None
+
+
+@dataclass
+class IntentStats:
+    requests: int = 0
+    routed: int = 0
+    llm_calls_avoided: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, routed: bool = False, answered: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            if routed:
+                self.routed += 1
+            if answered:
+                self.llm_calls_avoided += 1
+
+
+intent_stats = IntentStats()
+
+
+def _words(*alternatives: str) -> Pattern:
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b")
+
+
+def _choice(number: int, ordinal: str, *labels: str) -> Pattern:
+    options = [rf"{number}\)?", rf"#{number}", rf"option {number}", ordinal, *labels]
+    return re.compile(r"^(?:" + "|".join(options) + r")$")
+
+
+MENU_RULES = [
+    Rule(
+        "book", "find_slots",
+        _choice(1, "one|first", r"book(?:ing)?(?: an?)?(?: appointment)?", r"(?:make|schedule) an? appointment"),
+        _words(r"book(?:ing)?", r"new appointment", r"make an? appointment", r"schedule an? appointment"),
+        ASK_PATIENT_STATUS,
+    ),
+    Rule(
+        "change", "reschedule_appointment",
+        _choice(2, "two|second", r"change(?: (?:my|an?))?(?: appointment)?", r"reschedule", r"cancel"),
+        _words(r"change", r"reschedul\w*", r"cancel\w*", r"move my"),
+        "Sure! Please confirm your full name and phone number.",
+    ),
+    Rule(
+        "general", "general_info",
+        _choice(3, "three|third", r"general(?: inquiry| question)?", r"(?:an? )?(?:inquiry|question)"),
+        _words(r"inquiry", r"question", r"hours", r"location", r"address", r"insurance", r"open"),
+        "Of course! What would you like to know?",
+    ),
+]
+
+PATIENT_STATUS_RULES = [
+    Rule(
+        "new_patient", "new_patient",
+        re.compile(r"^(?:new|new patient|(?:i'?m|i am) (?:a )?new(?: patient)?|first time)$"),
+        _words(r"new", r"first time", r"never been"),
+        "Great! May I have your full name?",
+    ),
+    Rule(
+        "existing_patient", "verify_patient",
+        re.compile(r"^(?:existing|existing patient|returning|(?:i'?m|i am) (?:an? )?(?:existing|returning)(?: patient)?)$"),
+        _words(r"existing", r"returning", r"been (?:here|there) before", r"already a patient"),
+        "Thanks! Could you please confirm your full name and phone number?",
+    ),
+]
+
+# Checked on every turn; only selects the flow prompt, the model still answers.
+EMERGENCY_RULE = Rule(
+    "emergency", "emergency",
+    re.compile(r"^emergency$"),
+    _words(r"emergenc\w*", r"bleed\w*", r"broken tooth", r"tooth (?:broke|cracked)", r"severe pain",
+           r"swell\w*", r"swollen", r"knocked out", r"abscess"),
+)
+
+
+def normalize(text: str) -> str:
+    text = text.casefold().replace("’", "'")
+    text = re.sub(r"[^\w#)' ]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _last_assistant(messages: List[Dict[str, Any]]) -> Optional[str]:
+    for m in reversed(messages[:-1]):
+        if m["role"] == "assistant":
+            return normalize(m["content"])
+    return None
+
+
+def _score(rules: List[Rule], text: str) -> Optional[Intent]:
+    exact = [r for r in rules if r.exact.match(text)]
+    if len(exact) == 1:
+        r = exact[0]
+        return Intent(r.name, r.flow, 1.0, r.reply)
+    matched = [r for r in rules if r.keywords.search(text)]
+    if len(matched) != 1:
+        # nothing, or several options mentioned at once: let the model sort it out
+        return None
+    r = matched[0]
+    if len(text.split()) <= SHORT_REPLY_WORDS:
+        return Intent(r.name, r.flow, 0.9, r.reply)
+    return Intent(r.name, r.flow, 0.8)
+
+
+class IntentRouter:
+    def __init__(self, menu: str, min_confidence: float = 0.8, enabled: bool = True):
+        self.menu = menu.strip()
+        self.min_confidence = min_confidence
+        self.enabled = enabled
+        # compared normalized and by prefix: clients show the same prompt with
+        # different whitespace or a trailing "Please choose one."
+        self._contexts: List[Tuple[str, List[Rule]]] = [
+            (normalize(self.menu), MENU_RULES),
+            (normalize(ASK_PATIENT_STATUS), PATIENT_STATUS_RULES),
+        ]
+
+    def classify(self, messages: List[Dict[str, Any]]) -> Optional[Intent]:
+        """Intent of the latest user message, given the assistant message it answers."""
+        if not messages or messages[-1]["role"] != "user":
+            return None
+        text = normalize(messages[-1]["content"])
+        if EMERGENCY_RULE.keywords.search(text):
+            return Intent(EMERGENCY_RULE.name, EMERGENCY_RULE.flow, 0.9)
+        previous = _last_assistant(messages)
+        if not previous:
+            return None
+        for prompt, rules in self._contexts:
+            if previous.startswith(prompt):
+                return _score(rules, text)
+        return None
+
+    def route(self, conversation) -> Optional[str]:
+        """
+        Select the flow for this turn and return a deterministic reply, or
+        None when the model has to answer (conversation.flow may still change).
+        """
+        if not self.enabled:
+            return None
+        intent = self.classify(conversation.messages)
+        if intent is None or intent.confidence < self.min_confidence:
+            intent_stats.record()
+            return None
+        intent_stats.record(routed=True, answered=intent.reply is not None)
+        conversation.flow = intent.flow
+        if intent.reply is None:
+            logger.debug("intent %s -> flow %s (%.2f)", intent.name, intent.flow, intent.confidence)
+            return None
+        logger.debug("intent %s answered locally (%.2f)", intent.name, intent.confidence)
+        return intent.reply
+
+
+def build_intent_router(menu: str) -> IntentRouter:
+    conf = getattr(settings, "CHAT_INTENT_ROUTER", {}) or {}
+    return IntentRouter(
+        menu=menu,
+        min_confidence=float(conf.get("MIN_CONFIDENCE", 0.8)),
+        enabled=bool(conf.get("ENABLED", True)),
+    )
@@ -0,0 +1,401 @@
+"""
+llm.py
+------
+Pluggable backends behind the part of the Gemini client the chat code uses
+(models.generate_content / generate_content_stream, aio.models.generate_content
+and caches.create, sync and async):
+
+- "gemini"  the real genai.Client().
+- "record"  the real client, appending every request/response pair and its
+            latency to a JSONL recordings file.
+- "replay"  no network and no API key: answers from the recordings, then from
+            scripted rules, after a delay drawn from a latency distribution.
+
+Replay matches a request to recordings by its last message with digit runs
+masked (MATCH "last_message"), so dates, ids and TOOL_RESULT payloads that
+differ between runs still match; MATCH "exact" hashes the whole history.
+Several recordings under one key are served round-robin.
+
+Scripted rules are a JSON list of {"match": regex, "reply": template,
+"latency_ms"?: n}; the first whose regex is found in the last message wins
+and its reply is expanded with the match groups (\\g<name>), so a rule can
+turn "I'm Alice Kim, my phone is 6045550101" into a verify_patient call.
+
+Configured with settings.CHAT_LLM. api.views and scheduling.fuzzy share the
+client returned by get_llm_client().
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from google.genai import types
+
+from chat.compaction import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_CHARS = 40
+# share of a simulated stream's latency spent before the first chunk
+TTFT_FRACTION = 0.3
+
+_DIGITS = re.compile(r"\d+")
+
+
+def _conf() -> Dict[str, Any]:
+    return getattr(settings, "CHAT_LLM", {}) or {}
+
+
+def _messages(contents) -> List[Tuple[str, str]]:
+    """(role, text) pairs for contents given as a string, dicts or types.Content."""
+    if isinstance(contents, str):
+        return [("user", contents)]
+    out = []
+    for c in contents:
+        if isinstance(c, dict):
+            text = c.get("content") or "".join(p.get("text", "") for p in c.get("parts", []))
+            out.append((c.get("role", "user"), text))
+        else:
+            out.append((c.role or "user", "".join(p.text or "" for p in c.parts or [])))
+    return out
+
+
+def request_key(model: str, messages: List[Tuple[str, str]], match: str = "last_message") -> str:
+    if match == "last_message":
+        messages = [(role, _DIGITS.sub("#", text)) for role, text in messages[-1:]]
+    blob = json.dumps([model, messages], ensure_ascii=False)
+    return hashlib.sha256(blob.encode()).hexdigest()[:24]
+
+
+def _usage_of(response) -> Dict[str, int]:
+    meta = getattr(response, "usage_metadata", None)
+    return {
+        "prompt_tokens": getattr(meta, "prompt_token_count", None) or 0,
+        "cached_tokens": getattr(meta, "cached_content_token_count", None) or 0,
+        "output_tokens": getattr(meta, "candidates_token_count", None) or 0,
+    }
+
+
+def make_response(text: str, usage: Optional[Dict[str, int]] = None) -> types.GenerateContentResponse:
+    """A GenerateContentResponse carrying text (and usage_metadata when given)."""
+    meta = None
+    if usage:
+        meta = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=usage.get("prompt_tokens"),
+            cached_content_token_count=usage.get("cached_tokens") or None,
+            candidates_token_count=usage.get("output_tokens"),
+        )
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+        usage_metadata=meta,
+    )
+
+
+# --------------------------------------------------------------------------- #
+# RECORDING
+# --------------------------------------------------------------------------- #
+
+class Recorder:
+    """Appends one JSON line per model call; safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def write(self, model: str, contents, text: str, usage: Dict[str, int], latency: float,
+              ttft: Optional[float] = None) -> None:
+        entry = {
+            "model": model,
+            "messages": _messages(contents),
+            "text": text,
+            "usage": usage,
+            "latency_ms": round(latency * 1000, 1),
+        }
+        if ttft is not None:
+            entry["ttft_ms"] = round(ttft * 1000, 1)
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class _RecordingModels:
+    def __init__(self, models, recorder: Recorder):
+        self._models = models
+        self._recorder = recorder
+
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        t0 = time.perf_counter()
+        response = self._models.generate_content(model=model, contents=contents, config=config, **kwargs)
+        self._recorder.write(model, contents, response.text or "", _usage_of(response), time.perf_counter() - t0)
+        return response
+
+    def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        t0 = time.perf_counter()
+        ttft, text, chunk = None, "", None
+        for chunk in self._models.generate_content_stream(model=model, contents=contents, config=config, **kwargs):
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            text += chunk.text or ""
+            yield chunk
+        self._recorder.write(model, contents, text, _usage_of(chunk), time.perf_counter() - t0, ttft)
+
+
+class _RecordingAsyncModels(_RecordingModels):
+    async def generate_content(self, *, model, contents, config=None, **kwargs):
+        t0 = time.perf_counter()
+        response = await self._models.generate_content(model=model, contents=contents, config=config, **kwargs)
+        self._recorder.write(model, contents, response.text or "", _usage_of(response), time.perf_counter() - t0)
+        return response
+
+
+class RecordingClient:
+    """Wraps a genai.Client and records every generate call."""
+
+    def __init__(self, client, recorder: Recorder):
+        self.models = _RecordingModels(client.models, recorder)
+        self.caches = client.caches
+        self.aio = SimpleNamespace(
+            models=_RecordingAsyncModels(client.aio.models, recorder),
+            caches=client.aio.caches,
+        )
+
+
+# --------------------------------------------------------------------------- #
+# REPLAY
+# --------------------------------------------------------------------------- #
+
+class LatencyModel:
+    """
+    Simulated model latency, in seconds:
+      none      -- 0
+      fixed     -- MS
+      uniform   -- between MIN_MS and MAX_MS
+      lognormal -- median MEDIAN_MS, shape SIGMA (a long right tail, like real calls)
+      recorded  -- the recording's own latency (times SCALE), else MS
+    """
+
+    def __init__(self, distribution: str = "recorded", ms: float = 0, min_ms: float = 0, max_ms: float = 0,
+                 median_ms: float = 0, sigma: float = 0.5, scale: float = 1.0, seed: Optional[int] = None):
+        if distribution not in ("none", "fixed", "uniform", "lognormal", "recorded"):
+            raise ValueError(f"unknown latency distribution {distribution!r}")
+        self.distribution = distribution
+        self.ms, self.min_ms, self.max_ms = ms, min_ms, max_ms
+        self.median_ms, self.sigma, self.scale = median_ms, sigma, scale
+        self._random = random.Random(seed)
+
+    def sample(self, recorded_ms: Optional[float] = None) -> float:
+        if self.distribution == "none":
+            return 0.0
+        if self.distribution == "uniform":
+            ms = self._random.uniform(self.min_ms, self.max_ms)
+        elif self.distribution == "lognormal":
+            ms = self.median_ms * self._random.lognormvariate(0.0, self.sigma)
+        elif self.distribution == "recorded" and recorded_ms is not None:
+            ms = recorded_ms * self.scale
+        else:
+            ms = self.ms
+        return max(ms, 0.0) / 1000
+
+
+class ReplayMiss(LookupError):
+    """No recording, scripted rule or default reply for a request."""
+
+
+@dataclass
+class ReplayStats:
+    recorded: int = 0
+    scripted: int = 0
+    defaulted: int = 0
+    misses: int = 0
+
+
+replay_stats = ReplayStats()
+
+
+@dataclass
+class _Answer:
+    text: str
+    usage: Dict[str, int]
+    latency: float
+    ttft: Optional[float] = None
+
+
+class ReplayBackend:
+    def __init__(self, recordings: List[Dict[str, Any]], rules: List[Dict[str, Any]], latency: LatencyModel,
+                 match: str = "last_message", default_reply: Optional[str] = None):
+        self.match = match
+        self.latency = latency
+        self.default_reply = default_reply
+        self.rules = [(re.compile(r["match"], re.I | re.S), r) for r in rules]
+        self._recorded: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in recordings:
+            key = request_key(entry["model"], [tuple(m) for m in entry["messages"]], match)
+            self._recorded.setdefault(key, []).append(entry)
+        self._turn: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _estimate(messages: List[Tuple[str, str]], text: str) -> Dict[str, int]:
+        prompt = sum(len(t) for _, t in messages)
+        return {"prompt_tokens": prompt // CHARS_PER_TOKEN, "cached_tokens": 0,
+                "output_tokens": len(text) // CHARS_PER_TOKEN}
+
+    def answer(self, model: str, contents) -> _Answer:
+        messages = _messages(contents)
+        key = request_key(model, messages, self.match)
+        with self._lock:
+            entries = self._recorded.get(key)
+            if entries:
+                turn = self._turn.get(key, 0)
+                self._turn[key] = turn + 1
+                replay_stats.recorded += 1
+        if entries:
+            entry = entries[turn % len(entries)]
+            latency = self.latency.sample(entry.get("latency_ms"))
+            ttft = entry.get("ttft_ms")
+            if ttft is not None and entry.get("latency_ms"):
+                ttft = latency * ttft / entry["latency_ms"]
+            return _Answer(entry["text"], entry.get("usage") or self._estimate(messages, entry["text"]), latency, ttft)
+
+        last = messages[-1][1] if messages else ""
+        for pattern, rule in self.rules:
+            found = pattern.search(last)
+            if found:
+                replay_stats.scripted += 1
+                text = found.expand(rule["reply"])
+                return _Answer(text, self._estimate(messages, text), self.latency.sample(rule.get("latency_ms")))
+        if self.default_reply is not None:
+            replay_stats.defaulted += 1
+            return _Answer(self.default_reply, self._estimate(messages, self.default_reply), self.latency.sample())
+        replay_stats.misses += 1
+        raise ReplayMiss(f"no recorded or scripted response for: {last[:80]!r}")
+
+    @staticmethod
+    def chunks(answer: _Answer) -> Iterator[Tuple[float, types.GenerateContentResponse]]:
+        """(delay before it, chunk) pairs for a simulated stream; the last chunk carries usage."""
+        pieces = [answer.text[i:i + STREAM_CHUNK_CHARS]
+                  for i in range(0, len(answer.text), STREAM_CHUNK_CHARS)] or [""]
+        ttft = answer.ttft if answer.ttft is not None else answer.latency * TTFT_FRACTION
+        gap = (answer.latency - ttft) / max(len(pieces) - 1, 1)
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            yield (ttft if i == 0 else gap), make_response(piece, answer.usage if last else None)
+
+
+class _ReplayModels:
+    def __init__(self, backend: ReplayBackend):
+        self._backend = backend
+
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        answer = self._backend.answer(model, contents)
+        time.sleep(answer.latency)
+        return make_response(answer.text, answer.usage)
+
+    def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        for delay, chunk in self._backend.chunks(self._backend.answer(model, contents)):
+            time.sleep(delay)
+            yield chunk
+
+
+class _ReplayAsyncModels(_ReplayModels):
+    async def generate_content(self, *, model, contents, config=None, **kwargs):
+        answer = self._backend.answer(model, contents)
+        await asyncio.sleep(answer.latency)
+        return make_response(answer.text, answer.usage)
+
+
+class _ReplayCaches:
+    def create(self, *, model, config=None):
+        name = getattr(config, "display_name", None) or "prompt"
+        return types.CachedContent(name=f"cachedContents/replay-{name}", model=model)
+
+
+class _ReplayAsyncCaches(_ReplayCaches):
+    async def create(self, *, model, config=None):
+        return super().create(model=model, config=config)
+
+
+class ReplayClient:
+    """Offline stand-in for genai.Client."""
+
+    def __init__(self, backend: ReplayBackend):
+        self.backend = backend
+        self.models = _ReplayModels(backend)
+        self.caches = _ReplayCaches()
+        self.aio = SimpleNamespace(models=_ReplayAsyncModels(backend), caches=_ReplayAsyncCaches())
+
+
+def load_recordings(path) -> List[Dict[str, Any]]:
+    path = Path(path)
+    if not path.exists():
+        logger.warning("LLM recordings %s not found; replaying scripted responses only", path)
+        return []
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_script(script) -> List[Dict[str, Any]]:
+    """Scripted rules from a list or a JSON file path."""
+    if not script:
+        return []
+    if isinstance(script, (list, tuple)):
+        return list(script)
+    return json.loads(Path(script).read_text(encoding="utf-8"))
+
+
+def build_llm_client(conf: Optional[Dict[str, Any]] = None):
+    conf = _conf() if conf is None else conf
+    backend = conf.get("BACKEND", "gemini")
+    if backend == "replay":
+        lat = conf.get("LATENCY", {}) or {}
+        latency = LatencyModel(
+            distribution=lat.get("DISTRIBUTION", "recorded"),
+            ms=float(lat.get("MS", 0)),
+            min_ms=float(lat.get("MIN_MS", 0)),
+            max_ms=float(lat.get("MAX_MS", 0)),
+            median_ms=float(lat.get("MEDIAN_MS", 0)),
+            sigma=float(lat.get("SIGMA", 0.5)),
+            scale=float(lat.get("SCALE", 1.0)),
+            seed=lat.get("SEED"),
+        )
+        return ReplayClient(ReplayBackend(
+            load_recordings(conf["RECORDINGS"]),
+            load_script(conf.get("SCRIPT")),
+            latency,
+            match=conf.get("MATCH", "last_message"),
+            default_reply=conf.get("DEFAULT_REPLY"),
+        ))
+
+    from google import genai
+    client = genai.Client()
+    if backend == "record":
+        return RecordingClient(client, Recorder(conf["RECORDINGS"]))
+    if backend != "gemini":
+        raise ValueError(f"unknown CHAT_LLM BACKEND {backend!r}")
+    return client
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """The process-wide client for settings.CHAT_LLM, built on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_llm_client()
+    return _client
@@ -0,0 +1,196 @@
+"""
+prompt_cache.py
+---------------
+Provider-side context caching for the static flow prompts in prompts.flows.
+
+Every chat call sends one of the multi-kilobyte PROMPT_MAP entries as the
+system instruction. Instead, each distinct prompt is uploaded once as a Gemini
+cached content and later calls reference it by name, so those tokens are billed
+at the cached rate and not re-processed.
+
+- Entries are keyed by a hash of the prompt text, so editing a prompt simply
+  creates a new cache entry.
+- Entries are recreated shortly before their TTL expires.
+- If caching fails (unsupported model, prompt below the minimum size, quota...)
+  the prompt is sent inline as before and caching is retried after a backoff.
+- If a call is rejected because of the cache name itself (is_cache_rejection),
+  callers invalidate the entry and retry inline; any other error (429, 5xx,
+  timeouts) propagates untouched. Provider-side caches are created with a TTL,
+  so a forgotten name expires on its own.
+- Concurrent first requests for a prompt create one cache between them; other
+  prompts do not wait for it, and while an entry is being refreshed the
+  current (still valid) name keeps being served.
+
+Token usage of every call is recorded in `token_usage` so the saving shows up
+as cached_tokens / prompt_tokens.
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from google.genai import errors, types
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    name: Optional[str]
+    expires_at: datetime
+
+
+@dataclass
+class TokenUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, response) -> Dict[str, int]:
+        """Add one response's usage_metadata to the totals and return that call's numbers."""
+        meta = getattr(response, "usage_metadata", None)
+        call = {
+            "prompt_tokens": (getattr(meta, "prompt_token_count", None) or 0),
+            "cached_tokens": (getattr(meta, "cached_content_token_count", None) or 0),
+            "output_tokens": (getattr(meta, "candidates_token_count", None) or 0),
+        }
+        # called from request threads and the async event loop
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += call["prompt_tokens"]
+            self.cached_tokens += call["cached_tokens"]
+            self.output_tokens += call["output_tokens"]
+        logger.debug("gemini usage %s", call)
+        return call
+
+    @property
+    def cached_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+token_usage = TokenUsage()
+
+
+def is_cache_rejection(exc: Exception) -> bool:
+    """Whether a generate call failed because the cached-content name was refused (expired, deleted, invalid)."""
+    if not isinstance(exc, errors.ClientError) or exc.code not in (400, 403, 404):
+        return False
+    return "cache" in f"{exc.message or ''} {exc.details or ''}".lower()
+
+
+class PromptCache:
+    def __init__(self, model: str, ttl: int = 3600, refresh_margin: int = 300, retry_after: int = 600,
+                 enabled: bool = True):
+        self.model = model
+        self.ttl = ttl
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.retry_after = timedelta(seconds=retry_after)
+        self.enabled = enabled
+        self._entries: Dict[str, _Entry] = {}
+        # guards _key_locks; creation itself only holds the prompt's own lock
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._async_locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _key(system_prompt: str) -> str:
+        return hashlib.sha1(system_prompt.encode()).hexdigest()
+
+    def _lookup(self, key: str) -> Tuple[bool, Optional[str]]:
+        """(fresh, name): fresh entries need no network call; name None means send inline."""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at - self.refresh_margin <= datetime.now(timezone.utc):
+            return False, None
+        return True, entry.name
+
+    def _current(self, key: str) -> Optional[str]:
+        """Name of an entry that is due for refresh but has not expired yet."""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= datetime.now(timezone.utc):
+            return None
+        return entry.name
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _create_config(self, key: str, system_prompt: str) -> types.CreateCachedContentConfig:
+        return types.CreateCachedContentConfig(
+            system_instruction=system_prompt,
+            ttl=f"{self.ttl}s",
+            display_name=f"dentalbot-prompt-{key[:12]}",
+        )
+
+    def _store(self, key: str, cached) -> Optional[str]:
+        expires_at = getattr(cached, "expire_time", None) or datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        self._entries[key] = _Entry(cached.name, expires_at)
+        return cached.name
+
+    def _failed(self, key: str, exc: Exception) -> None:
+        logger.warning("prompt caching unavailable, sending prompt inline: %s", exc)
+        self._entries[key] = _Entry(None, datetime.now(timezone.utc) + self.retry_after + self.refresh_margin)
+
+    def get(self, client, system_prompt: str) -> Optional[str]:
+        """Cached-content name for this prompt (creating it if needed), or None to send it inline."""
+        if not self.enabled:
+            return None
+        key = self._key(system_prompt)
+        fresh, name = self._lookup(key)
+        if fresh:
+            return name
+        lock = self._key_lock(key)
+        current = self._current(key)
+        # another request is refreshing this prompt: keep using the valid name
+        if not lock.acquire(blocking=current is None):
+            return current
+        try:
+            fresh, name = self._lookup(key)
+            if fresh:
+                return name
+            try:
+                cached = client.caches.create(model=self.model, config=self._create_config(key, system_prompt))
+            except Exception as e:
+                self._failed(key, e)
+                return None
+            return self._store(key, cached)
+        finally:
+            lock.release()
+
+    async def aget(self, client, system_prompt: str) -> Optional[str]:
+        """Async variant of get() using the SDK's async client."""
+        if not self.enabled:
+            return None
+        key = self._key(system_prompt)
+        fresh, name = self._lookup(key)
+        if fresh:
+            return name
+        async with self._async_locks.setdefault(key, asyncio.Lock()):
+            fresh, name = self._lookup(key)
+            if fresh:
+                return name
+            try:
+                cached = await client.aio.caches.create(model=self.model, config=self._create_config(key, system_prompt))
+            except Exception as e:
+                self._failed(key, e)
+                return None
+            return self._store(key, cached)
+
+    def invalidate(self, system_prompt: str) -> None:
+        """Forget the entry after the provider rejected its cache name (see is_cache_rejection)."""
+        self._entries.pop(self._key(system_prompt), None)
+
+
+def build_prompt_cache(model: str) -> PromptCache:
+    conf = getattr(settings, "GEMINI_PROMPT_CACHE", {}) or {}
+    return PromptCache(
+        model=model,
+        ttl=int(conf.get("TTL", 3600)),
+        enabled=bool(conf.get("ENABLED", True)),
+    )
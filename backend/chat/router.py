@@ -1,53 +1,291 @@
+import contextvars
 import json
-from typing import Dict, Any
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
 
 from . import tools
+from .deadline import Deadline
+from .tracing import span, traced_queries
 
 TOOL_FNS = {
     "verify_patient": tools.verify_patient,
     "list_appointments": tools.list_appointments,
     "find_slots": tools.find_slots,
     "book_appointment": tools.book_appointment,
+    "book_family_appointments": tools.book_family_appointments,
     "reschedule_appointment": tools.reschedule_appointment,
     "cancel_appointment": tools.cancel_appointment,
     "create_staff_alert": tools.create_staff_alert,
 }
 
+# Tools that only read; consecutive calls to these from one reply run concurrently.
+READ_ONLY_TOOLS = {"verify_patient", "list_appointments", "find_slots"}
+
+
+@dataclass
+class ToolCall:
+    tool: str
+    parameters: Dict[str, Any]
+    # [start, end) offsets of the JSON object in the scanned text
+    start: int
+    end: int
+
+    def as_request(self) -> Dict[str, Any]:
+        return {"tool": self.tool, "parameters": self.parameters}
+
+
+# characters that matter inside a JSON object / inside a JSON string
+_OBJECT_TOKENS = re.compile(r'[{}"]')
+_STRING_TOKENS = re.compile(r'["\\]')
+
+
+class ToolCallScanner:
+    """
+    Incremental scanner for {"tool": ..., "parameters": {...}} objects in model
+    output. Braces are only counted outside JSON strings (escapes honoured), so
+    parameters like {"notes": "use } here"} are handled, and every call in the
+    text is found, not just the first. Text can be fed in streamed chunks;
+    feed() returns the calls completed by that chunk.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0            # next unscanned offset
+        self._depth = 0
+        self._in_string = False
+        self._obj_start = -1
+        self.calls: List[ToolCall] = []
+
+    def feed(self, chunk: str) -> List[ToolCall]:
+        self.text += chunk
+        found: List[ToolCall] = []
+        text, n = self.text, len(self.text)
+        pos = self._pos
+        while pos < n:
+            if self._depth == 0:
+                pos = text.find("{", pos)
+                if pos < 0:
+                    pos = n
+                    break
+                self._obj_start = pos
+                self._depth = 1
+                pos += 1
+            elif self._in_string:
+                m = _STRING_TOKENS.search(text, pos)
+                if m is None:
+                    pos = n
+                    break
+                if m.group() == "\\":
+                    if m.end() >= n:
+                        # escape split across chunks; resume at the backslash
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                else:
+                    self._in_string = False
+                    pos = m.end()
+            else:
+                m = _OBJECT_TOKENS.search(text, pos)
+                if m is None:
+                    pos = n
+                    break
+                pos = m.end()
+                c = m.group()
+                if c == '"':
+                    self._in_string = True
+                elif c == "{":
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        call = self._parse(self._obj_start, pos)
+                        if call:
+                            found.append(call)
+        self._pos = pos
+        self.calls.extend(found)
+        return found
+
+    def finish(self) -> List[ToolCall]:
+        """
+        End of input. If an object never closed (e.g. a stray "{" in prose),
+        rescan from just after it so calls later in the text are not lost.
+        """
+        found: List[ToolCall] = []
+        while self._depth:
+            restart = self._obj_start + 1
+            self._depth, self._in_string, self._pos = 0, False, restart
+            found += self.feed("")
+        return found
+
+    def _parse(self, start: int, end: int) -> Optional[ToolCall]:
+        try:
+            obj = json.loads(self.text[start:end])
+        except ValueError:
+            return None
+        if isinstance(obj, dict) and isinstance(obj.get("tool"), str) and isinstance(obj.get("parameters"), dict):
+            return ToolCall(obj["tool"], obj["parameters"], start, end)
+        return None
+
+
+def extract_tool_calls(text: str) -> List[ToolCall]:
+    """All tool calls in a complete assistant reply, in order, with their spans."""
+    scanner = ToolCallScanner()
+    scanner.feed(text)
+    scanner.finish()
+    return scanner.calls
+
 
 def maybe_parse_tool_call(text: str) -> Dict[str, Any] | None:
     """
     If assistant responded with a JSON tool call (per your prompt contract),
-    return {"tool": "...", "parameters": {...}} else None.
+    return {"tool": "...", "parameters": {...}} of the first one, else None.
     """
-    s = text.strip()
+    calls = extract_tool_calls(text)
+    return calls[0].as_request() if calls else None
 
-    if "{\"tool\":" not in s:
-        return None
-    try:
-        start_index = s.find("{\"tool\":")
-        count = 0
-        for i in range(start_index, len(s)):
-            if s[i] == "{":
-                count += 1
-            elif s[i] == "}":
-                count -= 1
-            if count == 0:
-                break
-            end_index = i + 1
-        s = s[start_index:end_index+1]
-        print(s)
-        obj = json.loads(s)
-        if isinstance(obj, dict) and "tool" in obj and "parameters" in obj:
-            return obj
-    except Exception:
-        pass
-    return None
 
 def execute_tool(tool_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
     fn = TOOL_FNS.get(tool_name)
     if not fn:
         return {"ok": False, "error": f"unknown_tool:{tool_name}"}
+    with span("tool", tool=tool_name) as sp, traced_queries():
+        try:
+            result = fn(params)
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        sp.labels["ok"] = str(bool(result.get("ok"))).lower()
+        return result
+
+
+@dataclass
+class ToolPoolStats:
+    # reads that outlived the turn's deadline
+    timeouts: int = 0
+    # of those, the ones still running on a pool thread
+    abandoned_running: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def abandoned(self, future: Future) -> None:
+        with self._lock:
+            self.timeouts += 1
+            self.abandoned_running += 1
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future: Future) -> None:
+        with self._lock:
+            self.abandoned_running -= 1
+
+
+tool_pool_stats = ToolPoolStats()
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=int(getattr(settings, "CHAT_TOOL_WORKERS", 4)),
+                    thread_name_prefix="chat-tool",
+                )
+    return _pool
+
+
+@contextmanager
+def _statement_timeout(deadline: Optional[Deadline]):
+    """
+    On PostgreSQL, cap this thread's queries at the turn's remaining budget,
+    so a read the turn stopped waiting for is cancelled by the server instead
+    of holding a pool thread and a connection.
+    """
+    if deadline is None or connection.vendor != "postgresql":
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('statement_timeout', %s, false)",
+                       [f"{max(1, int(deadline.remaining() * 1000))}ms"])
     try:
-        return fn(params)
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+        yield
+    finally:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("RESET statement_timeout")
+        except DatabaseError:
+            # broken connection; close_old_connections() replaces it
+            pass
+
+
+def _execute_read(tool_name: str, params: Dict[str, Any], deadline: Optional[Deadline]) -> Dict[str, Any]:
+    with _statement_timeout(deadline):
+        return execute_tool(tool_name, params)
+
+
+def _execute_in_worker(tool_name: str, params: Dict[str, Any], deadline: Optional[Deadline]) -> Dict[str, Any]:
+    # Each pool thread has its own DB connection; recycle it the way Django
+    # does around a request so CONN_MAX_AGE and broken connections are honoured.
+    close_old_connections()
+    try:
+        return _execute_read(tool_name, params, deadline)
+    finally:
+        close_old_connections()
+
+
+def _submit(tool_name: str, params: Dict[str, Any], deadline: Optional[Deadline]):
+    # copy the context so the worker sees the caller's current_deadline
+    ctx = contextvars.copy_context()
+    return _get_pool().submit(ctx.run, _execute_in_worker, tool_name, params, deadline)
+
+
+def execute_tool_calls(calls: List[ToolCall], deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+    """
+    Run every call from one reply; results line up with `calls`.
+
+    Runs of two or more consecutive read-only calls execute in parallel on a
+    bounded thread pool; a lone read and every write run in the caller's
+    thread, in order, so a write never races a read that the model placed
+    before or after it.
+
+    With a deadline, pooled reads that outlive it come back as
+    {"ok": False, "error": "tool_timeout"} (counted in tool_pool_stats while
+    they keep running), and on PostgreSQL every read's queries carry a
+    statement_timeout at the remaining budget so they do not keep running
+    for long. Writes are not started once the deadline has passed, but a
+    write that has started always runs to completion, so the reply never
+    contradicts the database.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(calls)
+    i = 0
+    while i < len(calls):
+        j = i
+        while j < len(calls) and calls[j].tool in READ_ONLY_TOOLS:
+            j += 1
+        if j - i > 1:
+            futures = [_submit(c.tool, c.parameters, deadline) for c in calls[i:j]]
+            for k, f in enumerate(futures):
+                try:
+                    results[i + k] = f.result(timeout=deadline.remaining() if deadline else None)
+                except FutureTimeout:
+                    results[i + k] = {"ok": False, "error": "tool_timeout"}
+                    tool_pool_stats.abandoned(f)
+            i = j
+        elif deadline is not None and deadline.expired():
+            results[i] = {"ok": False, "error": "deadline_exceeded"}
+            i += 1
+        else:
+            call = calls[i]
+            if call.tool in READ_ONLY_TOOLS:
+                results[i] = _execute_read(call.tool, call.parameters, deadline)
+            else:
+                results[i] = execute_tool(call.tool, call.parameters)
+            i += 1
+    return results
@@ -0,0 +1,194 @@
+"""
+sessions.py
+-----------
+Server-side conversation history for the chat endpoint, so clients send only
+their new message each turn instead of the whole transcript.
+
+Two store backends, picked by settings.CHAT_SESSION_STORE["BACKEND"]:
+  - "memory":   per-process LRU with idle TTL (single worker / dev)
+  - "database": api.ChatSession rows (shared between workers)
+
+A Conversation keeps the Gemini `types.Content` list alongside the plain
+messages and appends to both, so a turn never rebuilds the whole history.
+
+Stores hand out and keep independent copies: a turn appends to its own
+Conversation and only save() publishes it, so a turn that raises midway
+leaves the stored history as it was. Both stores drop conversations idle for
+longer than TTL seconds; `manage.py purge_chat_sessions` deletes those rows
+from the database store.
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from time import monotonic
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+from google.genai import types
+
+from api.models import ChatSession
+
+
+def to_gemini_content(m: Dict[str, Any]) -> types.Content:
+    role = m["role"]
+    if role == "assistant":
+        role = "model"
+    return types.Content(role=role, parts=[types.Part(text=m["content"])])
+
+
+def convert_to_gemini_contents(messages: List[Dict[str, Any]]) -> List[types.Content]:
+    return [to_gemini_content(m) for m in messages]
+
+
+class Conversation:
+    """Chat history plus its Gemini contents, built lazily and then appended to."""
+
+    def __init__(self, id: Optional[str], flow: str, messages: Optional[List[Dict[str, Any]]] = None):
+        self.id = id
+        self.flow = flow
+        self.messages: List[Dict[str, Any]] = list(messages or [])
+        self._contents: Optional[List[types.Content]] = None
+        # Content of rewritten (compacted) messages from the last contents_for() call
+        self._rewritten: Dict[Tuple[str, str], types.Content] = {}
+
+    @property
+    def contents(self) -> List[types.Content]:
+        if self._contents is None:
+            self._contents = convert_to_gemini_contents(self.messages)
+        return self._contents
+
+    def append(self, role: str, content: str) -> None:
+        m = {"role": role, "content": content}
+        self.messages.append(m)
+        if self._contents is not None:
+            self._contents.append(to_gemini_content(m))
+
+    def contents_for(self, messages: List[Dict[str, Any]]) -> List[types.Content]:
+        """
+        Contents for a compacted view of this history: messages kept as they
+        are reuse their Content, rewritten ones (summaries) reuse the Content
+        built for the same text on the previous call.
+        """
+        own = {id(m): c for m, c in zip(self.messages, self.contents)}
+        rewritten: Dict[Tuple[str, str], types.Content] = {}
+        out = []
+        for m in messages:
+            content = own.get(id(m))
+            if content is None:
+                key = (m["role"], m["content"])
+                content = rewritten.get(key) or self._rewritten.get(key) or to_gemini_content(m)
+                rewritten[key] = content
+            out.append(content)
+        self._rewritten = rewritten
+        return out
+
+    def copy(self) -> "Conversation":
+        """A copy that can be appended to without touching this one (messages are never mutated)."""
+        conv = Conversation(self.id, self.flow, self.messages)
+        if self._contents is not None:
+            conv._contents = list(self._contents)
+        conv._rewritten = dict(self._rewritten)
+        return conv
+
+
+class InMemorySessionStore:
+    """Per-process store; least recently used conversations are evicted past maxsize or idle TTL."""
+
+    def __init__(self, maxsize: int = 1000, ttl: int = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, flow: str) -> Conversation:
+        conv = Conversation(uuid.uuid4().hex, flow)
+        self.save(conv)
+        return conv
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        with self._lock:
+            item = self._data.get(conversation_id)
+            if item is None:
+                return None
+            touched_at, conv = item
+            if touched_at + self.ttl <= monotonic():
+                del self._data[conversation_id]
+                return None
+            self._data[conversation_id] = (monotonic(), conv)
+            self._data.move_to_end(conversation_id)
+            return conv.copy()
+
+    def save(self, conv: Conversation) -> None:
+        with self._lock:
+            self._data[conv.id] = (monotonic(), conv.copy())
+            self._data.move_to_end(conv.id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self._data.pop(conversation_id, None)
+
+
+class DatabaseSessionStore:
+    """Stores history in api.ChatSession so any worker can continue a conversation."""
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+
+    def _expired_before(self):
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+    def create(self, flow: str) -> Conversation:
+        row = ChatSession.objects.create(id=uuid.uuid4().hex, flow=flow)
+        return Conversation(row.id, row.flow)
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        row = ChatSession.objects.filter(id=conversation_id, updated_at__gte=self._expired_before()).first()
+        if row is None:
+            return None
+        return Conversation(row.id, row.flow, row.messages)
+
+    def save(self, conv: Conversation) -> None:
+        ChatSession.objects.update_or_create(
+            id=conv.id, defaults={"flow": conv.flow, "messages": conv.messages}
+        )
+
+    def delete(self, conversation_id: str) -> None:
+        ChatSession.objects.filter(id=conversation_id).delete()
+
+    def purge_expired(self) -> int:
+        """Delete conversations idle for longer than TTL; returns how many."""
+        deleted, _ = ChatSession.objects.filter(updated_at__lt=self._expired_before()).delete()
+        return deleted
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _build_session_store():
+    conf = getattr(settings, "CHAT_SESSION_STORE", {}) or {}
+    backend = conf.get("BACKEND", "memory")
+    if backend == "memory":
+        return InMemorySessionStore(maxsize=int(conf.get("MAXSIZE", 1000)), ttl=int(conf.get("TTL", 3600)))
+    if backend == "database":
+        return DatabaseSessionStore(ttl=int(conf.get("TTL", 3600)))
+    raise ValueError(f"unknown CHAT_SESSION_STORE backend: {backend}")
+
+
+def get_session_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _build_session_store()
+    return _store
+
+
+def set_session_store(store) -> None:
+    global _store
+    _store = store
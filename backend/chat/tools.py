@@ -1,33 +1,35 @@
+import heapq
+from collections import deque
 from dataclasses import dataclass
-from datetime import timedelta
+from datetime import time as datetime_time, timedelta
+from itertools import groupby, islice
+from operator import itemgetter
 from typing import List, Dict, Any, Optional, Tuple
 
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import Count, Q
 from django.utils import timezone
 
 from appointments.models import (
-    Patient, Family, FamilyMember, Availability, Appointment, StaffAlert
+    Patient, Family, FamilyMember, Availability, Appointment, StaffAlert, OpeningHours, ScheduleException,
+    normalize_name, normalize_phone,
 )
 from scheduling.fuzzy import parse_fuzzy_date_range
-import re
+from scheduling import engine
+from scheduling.availability_cache import availability_cache
+from scheduling.availability_index import availability_index
 
 
-PHONE_DIGITS = re.compile(r"\D+")
-
-def _norm_phone(p: str) -> str:
-    return PHONE_DIGITS.sub("", (p or "").strip())
-
 def _find_patient_by_name_phone(name: str, phone: str) -> Optional[Patient]:
     if not name or not phone:
         return None
-    phone_norm = _norm_phone(phone)
-    # Try exact digits match; allow "+1" leading
-    qs = Patient.objects.filter(full_name__iexact=name.strip())
-    for p in qs:
-        p_phone = _norm_phone(p.phone)
-        if p_phone == phone_norm or p_phone.endswith(phone_norm):
-            return p
-    return None
+    # one lookup on the (phone_digits, name_key) index; normalize_phone drops a leading "+1"
+    return (
+        Patient.objects
+        .filter(phone_digits=normalize_phone(phone), name_key=normalize_name(name))
+        .order_by("id")
+        .first()
+    )
 
 def verify_patient(params: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -87,15 +89,15 @@ def list_appointments(params: Dict[str, Any]) -> Dict[str, Any]:
         items.append({
             "appointment_id": appt.id,
             "type": appt.type,
-            "start": appt.start.isoformat(),
-            "end": appt.end.isoformat(),
+            "start": appt.start,
+            "end": appt.end,
             "notes": appt.notes or "",
         })
 
     return {
         "ok": True,
         "patient": {"user_id": patient.id, "name": patient.full_name, "phone": patient.phone},
-        "range": {"start": start.isoformat(), "end": end.isoformat()},
+        "range": {"start": start, "end": end},
         "appointments": items,
     }
 
@@ -106,10 +108,10 @@ def _get_or_create_patient(info: Dict[str, Any]) -> Patient:
     name = info.get("full_name") or info.get("name")
     phone = info.get("phone")
     dob = info.get("dob")
-    qs = Patient.objects.filter(full_name__iexact=name.strip(), phone=phone.strip())
+    qs = Patient.objects.filter(phone_digits=normalize_phone(phone), name_key=normalize_name(name))
     if dob:
         qs = qs.filter(dob=dob)
-    p = qs.first()
+    p = qs.order_by("id").first()
     if p:
         # update insurance if provided
         if info.get("insurance_name") and not p.insurance_name:
@@ -127,33 +129,359 @@ def _get_or_create_patient(info: Dict[str, Any]) -> Patient:
 def _slot_duration_minutes(start, end) -> int:
     return int((end - start).total_seconds() // 60)
 
+# find_slots preferences: local [from, to) hour window, None = open ended
+SLOT_PREFERENCES = {
+    "earliest": (None, None),
+    "closest": (None, None),
+    "morning": (None, 12),
+    "afternoon": (12, None),
+    "evening": (16, None),
+}
+DEFAULT_SLOT_COUNT = 10
+MAX_SLOT_COUNT = 50
+
+
+def _slot_target(near: Optional[str]):
+    """ "10:30" -> time of day (closest on any day), ISO datetime -> that instant."""
+    if not near:
+        return None
+    try:
+        return datetime_time.fromisoformat(near)
+    except ValueError:
+        pass
+    dt = timezone.datetime.fromisoformat(near.replace("Z", "+00:00"))
+    return dt if timezone.is_aware(dt) else timezone.make_aware(dt)
+
+
+def _closeness_key(target):
+    if isinstance(target, datetime_time):
+        minutes = target.hour * 60 + target.minute
+
+        def key(slot):
+            local = timezone.localtime(slot["start"])
+            return abs(local.hour * 60 + local.minute - minutes), slot["start"]
+    else:
+        def key(slot):
+            return abs((slot["start"] - target).total_seconds()), slot["start"]
+    return key
+
+
+def _in_window(slot_start, hours) -> bool:
+    lo, hi = hours
+    hour = timezone.localtime(slot_start).hour
+    return (lo is None or hour >= lo) and (hi is None or hour < hi)
+
+
+def _distinct_slots(slots):
+    """
+    Collapse parallel chairs -- free rows with the same (start, end) -- into
+    one entry with a "free" count. `slots` must be in start order.
+    """
+    for _, same_start in groupby(slots, key=itemgetter("start")):
+        merged: Dict[Any, Dict[str, Any]] = {}
+        for slot in same_start:
+            entry = merged.get(slot["end"])
+            if entry is None:
+                merged[slot["end"]] = {"start": slot["start"], "end": slot["end"], "free": 1}
+            else:
+                entry["free"] += 1
+        yield from sorted(merged.values(), key=itemgetter("end"))
+
+
+def _after(cursor: str):
+    """(start, end) of the last entry of the previous page, from an "after:" cursor."""
+    start, _, end = cursor[len("after:"):].partition("/")
+    start = timezone.datetime.fromisoformat(start)
+    return start, timezone.datetime.fromisoformat(end) if end else start
+
+
+def _day_summary(slots) -> List[Dict[str, Any]]:
+    """Per local day: distinct (start, end) slots and the first/last start. `slots` in start order."""
+    days: Dict[str, Dict[str, Any]] = {}
+    for slot in slots:
+        local = timezone.localtime(slot["start"])
+        day = days.setdefault(local.date().isoformat(), {"date": local.date().isoformat(), "count": 0})
+        day["count"] += 1
+        day.setdefault("first", local.strftime("%H:%M"))
+        day["last"] = local.strftime("%H:%M")
+    return list(days.values())
+
+
 def find_slots(params: Dict[str, Any]) -> Dict[str, Any]:
     """
     params: { "type": "cleaning"|"checkup"|"filling"|"emergency",
               "date_range": "tomorrow morning" | "next week" | ...,
-              "count": int=3,
-              "family_members": [names]? (optional)
+              "count": int=10 (max 50),
+              "prefer": "earliest"|"morning"|"afternoon"|"evening"|"closest" (optional),
+              "near": "10:30" | ISO8601 (optional, ranks by distance; implies "closest"),
+              "mode": "slots"|"summary" (optional; summary = per-day counts),
+              "cursor": str (optional, next_cursor of the previous page),
+              "family_members": [names]? (optional; or "party_size": int),
+              "together": "back_to_back"|"same_day" (optional, with family_members)
             }
+
+    Returns at most `count` distinct (start, end) slots whatever the size of
+    the range, each with "free": how many chairs are open then, plus
+    has_more / next_cursor to page through the rest. Chronological
+    preferences are pushed into the query as GROUP BY ... LIMIT; "closest"
+    keeps the best `count` in a heap while streaming the rows.
+
+    With two or more family members, returns "groups" instead of "slots":
+    one entry per set of back-to-back (or same-day) times, each with the
+    "starts" to pass to book_family_appointments.
     """
     appt_type = params["type"]
     phrase = params.get("date_range", "next 14 days")
-    # count = int(params.get("count", 100))
+    count = max(1, min(int(params.get("count") or DEFAULT_SLOT_COUNT), MAX_SLOT_COUNT))
+    target = _slot_target(params.get("near"))
+    prefer = params.get("prefer") or ("closest" if target else "earliest")
+    if prefer not in SLOT_PREFERENCES:
+        return {"ok": False, "error": f"invalid_prefer:{prefer}"}
+    if prefer == "closest" and target is None:
+        prefer = "earliest"
+    hours = SLOT_PREFERENCES[prefer]
+    cursor = params.get("cursor") or ""
     start, end = parse_fuzzy_date_range(phrase)
 
-    qs = (
-        Availability.objects
-        .filter(appointment_type=appt_type, start__gte=start, end__lte=end)
-        .order_by("start")
-    )
-    slots = list(qs.values("id", "start", "end"))
-
-    return {
+    result = {
         "ok": True,
         "type": appt_type,
-        "range": {"start": start.isoformat(), "end": end.isoformat()},
-        "slots": slots,
+        "range": {"start": start, "end": end},
     }
 
+    party = len(params["family_members"]) if params.get("family_members") else int(params.get("party_size") or 1)
+    if party > 1:
+        together = params.get("together") or "back_to_back"
+        if together not in ("back_to_back", "same_day"):
+            return {"ok": False, "error": f"invalid_together:{together}"}
+        groups = _family_groups(_candidate_slots(appt_type, start, end, hours), party, together)
+        if cursor.startswith("after:"):
+            after = _after(cursor)
+            groups = (g for g in groups if (g["start"], g["end"]) > after)
+        result["party_size"] = party
+        return _slot_page(result, list(islice(groups, count + 1)), count, "earliest", 0, key="groups")
+
+    if engine.is_enabled():
+        # computed slots are already in memory; filter and rank them here
+        matching = [
+            {"start": s, "end": e} for s, e in engine.free_slots(appt_type, start, end)
+            if _in_window(s, hours)
+        ]
+        if params.get("mode") == "summary":
+            result["days"] = _day_summary(matching)
+            return result
+        candidates = _distinct_slots(matching)
+    elif availability_index.covers(start, end):
+        # bit operations on the in-memory index instead of a range scan
+        if params.get("mode") == "summary":
+            result["days"] = availability_index.day_summary(appt_type, start, end, hours)
+            return result
+        candidates = _distinct_slots(availability_index.slots(appt_type, start, end, hours))
+    elif availability_cache.covers(start, end):
+        # per-day cached rows; days missing from the cache are loaded in one query
+        if params.get("mode") == "summary":
+            result["days"] = availability_cache.day_summary(appt_type, start, end, hours)
+            return result
+        candidates = _distinct_slots(availability_cache.slots(appt_type, start, end, hours))
+    else:
+        qs = Availability.objects.filter(appointment_type=appt_type, start__gte=start, end__lte=end)
+        lo, hi = hours
+        if lo is not None:
+            qs = qs.filter(start__hour__gte=lo)
+        if hi is not None:
+            qs = qs.filter(start__hour__lt=hi)
+        if params.get("mode") == "summary":
+            # count slots, not rows: parallel chairs collapse to one (start, end)
+            result["days"] = _day_summary(qs.values("start", "end").distinct().order_by("start", "end"))
+            return result
+        # one row per (start, end); parallel chairs become its "free" count
+        qs = qs.values("start", "end").annotate(free=Count("id")).order_by("start", "end")
+        if prefer != "closest":
+            if cursor.startswith("after:"):
+                after_start, after_end = _after(cursor)
+                qs = qs.filter(Q(start__gt=after_start) | Q(start=after_start, end__gt=after_end))
+            # one extra row tells us whether there is another page
+            return _slot_page(result, list(qs[:count + 1]), count, prefer, 0)
+        candidates = qs.iterator()
+
+    if prefer == "closest":
+        offset = int(cursor[len("offset:"):]) if cursor.startswith("offset:") else 0
+        page = heapq.nsmallest(offset + count + 1, candidates, key=_closeness_key(target))[offset:]
+        return _slot_page(result, page, count, prefer, offset)
+    if cursor.startswith("after:"):
+        after = _after(cursor)
+        candidates = (slot for slot in candidates if (slot["start"], slot["end"]) > after)
+    return _slot_page(result, list(islice(candidates, count + 1)), count, prefer, 0)
+
+
+def _candidate_slots(appt_type: str, start, end, hours):
+    """Free slots in [start, end) within the preferred hours, streamed in start order."""
+    if engine.is_enabled():
+        return ({"start": s, "end": e} for s, e in engine.free_slots(appt_type, start, end) if _in_window(s, hours))
+    if availability_index.covers(start, end):
+        return _distinct_slots(availability_index.slots(appt_type, start, end, hours))
+    if availability_cache.covers(start, end):
+        return _distinct_slots(availability_cache.slots(appt_type, start, end, hours))
+    qs = Availability.objects.filter(appointment_type=appt_type, start__gte=start, end__lte=end)
+    lo, hi = hours
+    if lo is not None:
+        qs = qs.filter(start__hour__gte=lo)
+    if hi is not None:
+        qs = qs.filter(start__hour__lt=hi)
+    return _distinct_slots(qs.order_by("start", "id").values("id", "start", "end").iterator())
+
+
+def _family_groups(slots, size: int, together: str):
+    """
+    Sliding window over distinct slots sorted by start, in one pass.
+
+    Every member gets a time of their own: parallel chairs at the same
+    minute are one slot here, so a group never seats two people at once.
+    back_to_back: every run of `size` slots where each starts when the
+    previous one ends.
+    same_day: successive sets of `size` slots on one local day.
+    """
+    window: deque = deque()
+    seen = set()
+    for slot in slots:
+        if window:
+            prev = window[-1]
+            if together == "same_day":
+                linked = timezone.localdate(slot["start"]) == timezone.localdate(prev["start"])
+            else:
+                linked = slot["start"] == prev["end"]
+            if not linked:
+                window.clear()
+        window.append(slot)
+        if len(window) > size:
+            window.popleft()
+        if len(window) == size:
+            starts = tuple(s["start"] for s in window)
+            if starts not in seen:
+                seen.add(starts)
+                yield {
+                    "start": starts[0],
+                    "end": max(s["end"] for s in window),
+                    "starts": list(starts),
+                }
+            if together == "same_day":
+                window.clear()
+
+
+def _slot_page(result, page, count, prefer, offset, key="slots") -> Dict[str, Any]:
+    has_more = len(page) > count
+    page = page[:count]
+    result[key] = page
+    result["has_more"] = has_more
+    if not has_more:
+        result["next_cursor"] = None
+    elif prefer == "closest":
+        result["next_cursor"] = f"offset:{offset + count}"
+    else:
+        last = page[-1]
+        result["next_cursor"] = f"after:{last['start'].isoformat()}/{last['end'].isoformat()}"
+    return result
+
+
+# candidates tried per query when claiming a slot by conditional delete
+CLAIM_ATTEMPTS = 5
+
+
+def _claim_slot(qs) -> Optional[Availability]:
+    """
+    Atomically take the first Availability row of `qs` (ordered by
+    preference) and delete it, so no other session can book it too.
+    Returns None when every candidate has been taken.
+
+    Must run inside a transaction. Backends with SKIP LOCKED (PostgreSQL)
+    lock the first row nobody else holds; elsewhere each candidate is
+    claimed with a DELETE ... WHERE id = ... and only counts if that
+    deleted the row.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        slot = qs.select_for_update(skip_locked=True).first()
+        if slot is not None:
+            Availability.objects.filter(id=slot.id).delete()
+            _slot_changed(slot.appointment_type, slot.start, slot.end, taken=True)
+        return slot
+    for slot in qs[:CLAIM_ATTEMPTS]:
+        deleted, _ = Availability.objects.filter(id=slot.id).delete()
+        if deleted:
+            _slot_changed(slot.appointment_type, slot.start, slot.end, taken=True)
+            return slot
+    return None
+
+
+def _release_slot(appt_type: str, start, end) -> None:
+    """Put a slot back into Availability (after a cancel or reschedule)."""
+    Availability.objects.create(start=start, end=end, appointment_type=appt_type)
+    _slot_changed(appt_type, start, end, taken=False)
+
+
+def _slot_changed(appt_type: str, start, end, taken: bool) -> None:
+    """
+    Once the transaction commits, apply a taken/released row to the in-memory
+    index and drop that day from the availability cache.
+    """
+    def apply():
+        if availability_index.enabled:
+            (availability_index.take if taken else availability_index.release)(appt_type, start, end)
+        availability_cache.invalidate([appt_type], [timezone.localdate(start)])
+
+    if availability_index.enabled or availability_cache.enabled:
+        transaction.on_commit(apply)
+
+
+def _lock_schedule(appt_type: str, day) -> None:
+    """
+    Serialize bookings of one type and day under the computed engine, which
+    has no slot row to lock: lock the OpeningHours rows of that weekday and
+    the ScheduleException rows overlapping the day, so a day opened only by
+    an OPEN exception is serialized too.
+    """
+    of_type = Q(appointment_type=appt_type) | Q(appointment_type__isnull=True) | Q(appointment_type="")
+    list(
+        OpeningHours.objects.select_for_update()
+        .filter(of_type, weekday=day.weekday())
+        .values_list("id", flat=True)
+    )
+    day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    list(
+        ScheduleException.objects.select_for_update()
+        .filter(of_type, start__lt=day_start + timedelta(days=1), end__gt=day_start)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+def _parse_start(value: str):
+    return timezone.make_aware(timezone.datetime.fromisoformat(value.replace("Z","")))
+
+
+def _book_slot(patient: Patient, appt_type: str, start, notes: Optional[str],
+               tolerance: timedelta = timedelta(minutes=30)) -> Optional[Appointment]:
+    """Book the slot at `start`, else the earliest free one within +/- tolerance. Call inside a transaction."""
+    if engine.is_enabled():
+        # computed model: the slot is free if no booked appointment covers it
+        _lock_schedule(appt_type, timezone.localtime(start))
+        free = engine.find_free_slot(appt_type, start, tolerance=tolerance)
+        if not free:
+            return None
+        return Appointment.objects.create(patient=patient, type=appt_type, start=free[0], end=free[1], notes=notes)
+
+    # consumptive model: claim (delete) a slot with the same start, else the
+    # earliest one within the tolerance that no concurrent booking has taken
+    slot = _claim_slot(Availability.objects.filter(appointment_type=appt_type, start=start).order_by("id"))
+    if not slot and tolerance:
+        slot = _claim_slot(Availability.objects.filter(
+            appointment_type=appt_type,
+            start__gte=start - tolerance,
+            start__lte=start + tolerance,
+        ).order_by("start", "id"))
+    if not slot:
+        return None
+    return Appointment.objects.create(patient=patient, type=appt_type, start=slot.start, end=slot.end, notes=notes)
+
 
 @transaction.atomic
 def book_appointment(params: Dict[str, Any]) -> Dict[str, Any]:
@@ -161,33 +489,66 @@ def book_appointment(params: Dict[str, Any]) -> Dict[str, Any]:
     params: { "patient_info": {...}, "type": "...", "start": ISO8601, "notes": optional }
     """
     patient = _get_or_create_patient(params["patient_info"])
-    appt_type = params["type"]
-    start = timezone.make_aware(timezone.datetime.fromisoformat(params["start"].replace("Z","")))
-    # find a matching availability slot with same start
-    slot = Availability.objects.filter(appointment_type=appt_type, start=start).order_by("start").first()
-    print(slot)
-    if not slot:
-        # try nearest within +/−30m
-        near = Availability.objects.filter(
-            appointment_type=appt_type,
-            start__gte=start - timezone.timedelta(minutes=30),
-            start__lte=start + timezone.timedelta(minutes=30),
-        ).order_by("start").first()
-        if not near:
-            return {"ok": False, "error": "slot_not_available"}
-
-        slot = near
-
-    appt = Appointment.objects.create(
-        patient=patient,
-        type=appt_type,
-        start=slot.start,
-        end=slot.end,
-        notes=params.get("notes"),
-    )
-    # consumptive model: delete the slot so it can't be rebooked
-    slot.delete()
-    return {"ok": True, "appointment_id": appt.id, "start": appt.start.isoformat(), "end": appt.end.isoformat()}
+    appt = _book_slot(patient, params["type"], _parse_start(params["start"]), params.get("notes"))
+    if not appt:
+        return {"ok": False, "error": "slot_not_available"}
+    return {"ok": True, "appointment_id": appt.id, "start": appt.start, "end": appt.end}
+
+
+@transaction.atomic
+def book_family_appointments(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    params: { "type": "...", "phone": str (family contact, used when a member has none),
+              "family_name": optional str,
+              "members": [{"name": str, "start": ISO8601, "phone"?: str, "dob"?: str,
+                           "relationship"?: "self"|"spouse"|"child"|"other", "type"?: str}],
+              "notes": optional }
+
+    All or nothing: each member gets exactly the requested start, and if any
+    of those slots is gone the whole booking is rolled back.
+    """
+    members = params.get("members") or []
+    if not members:
+        return {"ok": False, "error": "no_members"}
+    for i, member in enumerate(members):
+        if not isinstance(member, dict) or not member.get("name"):
+            return {"ok": False, "error": "member_missing_name", "member": i}
+        if not member.get("start"):
+            return {"ok": False, "error": "member_missing_start", "member": member["name"]}
+        if not (member.get("phone") or params.get("phone")):
+            return {"ok": False, "error": "missing_phone", "member": member["name"]}
+        if not (member.get("type") or params.get("type")):
+            return {"ok": False, "error": "missing_type", "member": member["name"]}
+
+    patients = []
+    for member in members:
+        info = {"name": member["name"], "phone": member.get("phone") or params["phone"]}
+        if member.get("dob"):
+            info["dob"] = member["dob"]
+        patients.append(_get_or_create_patient(info))
+
+    booked = []
+    for member, patient in zip(members, patients):
+        appt_type = member.get("type") or params["type"]
+        appt = _book_slot(patient, appt_type, _parse_start(member["start"]), params.get("notes"),
+                          tolerance=timedelta(0))
+        if not appt:
+            transaction.set_rollback(True)
+            return {"ok": False, "error": "slot_not_available", "member": member["name"], "start": member["start"]}
+        booked.append({"name": patient.full_name, "appointment_id": appt.id, "type": appt_type,
+                       "start": appt.start, "end": appt.end})
+
+    # keep the household together: reuse a family one of them already belongs to
+    family = Family.objects.filter(members__patient__in=patients).order_by("id").first()
+    if family is None:
+        family = Family.objects.create(name=params.get("family_name") or patients[0].full_name.split()[-1])
+    for member, patient in zip(members, patients):
+        FamilyMember.objects.get_or_create(
+            family=family,
+            patient=patient,
+            defaults={"relationship": member.get("relationship") or FamilyMember.Relationship.OTHER},
+        )
+    return {"ok": True, "family_id": family.id, "appointments": booked}
 
 
 @transaction.atomic
@@ -196,19 +557,29 @@ def reschedule_appointment(params: Dict[str, Any]) -> Dict[str, Any]:
     params: { "appointment_id": int, "new_start": ISO8601 }
     """
     appt = Appointment.objects.select_for_update().get(id=params["appointment_id"])
-    new_start = timezone.make_aware(timezone.datetime.fromisoformat(params["new_start"].replace("Z","")))
+    new_start = _parse_start(params["new_start"])
     duration = _slot_duration_minutes(appt.start, appt.end)
-    # look for availability matching type + new_start (+same duration)
-    slot = Availability.objects.filter(
+    if engine.is_enabled():
+        new_end = new_start + timezone.timedelta(minutes=duration)
+        _lock_schedule(appt.type, timezone.localtime(new_start))
+        free = engine.free_slots(appt.type, new_start, new_end, exclude_appointment_id=appt.id)
+        if (new_start, new_end) not in free:
+            return {"ok": False, "error": "no_matching_slot"}
+        Appointment.objects.filter(id=appt.id).update(start=new_start, end=new_end)
+        appt.refresh_from_db()
+        return {"ok": True, "appointment_id": appt.id, "start": appt.start, "end": appt.end}
+
+    # claim availability matching type + new_start (+same duration)
+    slot = _claim_slot(Availability.objects.filter(
         appointment_type=appt.type,
         start=new_start,
         end=new_start + timezone.timedelta(minutes=duration),
-    ).first()
+    ).order_by("id"))
     if not slot:
         return {"ok": False, "error": "no_matching_slot"}
 
     # free the old time (optional): create a new availability from old appt
-    Availability.objects.create(start=appt.start, end=appt.end, appointment_type=appt.type)
+    _release_slot(appt.type, appt.start, appt.end)
 
     # update appt and consume the new slot
     appt.start, appt.end = slot.start, slot.end
@@ -217,24 +588,27 @@ def reschedule_appointment(params: Dict[str, Any]) -> Dict[str, Any]:
     Appointment.objects.filter(id=appt.id).update(start=slot.start, end=slot.end)
     appt.refresh_from_db()
 
-    # consume the slot
-    slot.delete()
-
-    return {"ok": True, "appointment_id": appt.id, "start": appt.start.isoformat(), "end": appt.end.isoformat()}
+    return {"ok": True, "appointment_id": appt.id, "start": appt.start, "end": appt.end}
 
 
+@transaction.atomic
 def cancel_appointment(params: Dict[str, Any]) -> Dict[str, Any]:
     """
     params: { "appointment_id": int }
     """
-    appt = Appointment.objects.filter(id=params["appointment_id"]).first()
+    appt = Appointment.objects.select_for_update().filter(id=params["appointment_id"]).first()
     if not appt:
         return {"ok": False, "error": "not_found"}
+    if appt.status == Appointment.Status.CANCELED:
+        # a repeated cancel must not release the slot twice
+        return {"ok": True}
     appt.status = Appointment.Status.CANCELED
     appt.save(update_fields=["status"])
 
     # optionally release the slot back to availability
-    Availability.objects.create(start=appt.start, end=appt.end, appointment_type=appt.type)
+    # (the computed engine frees it implicitly once the appointment is canceled)
+    if not engine.is_enabled():
+        _release_slot(appt.type, appt.start, appt.end)
 
     return {"ok": True}
 
@@ -0,0 +1,295 @@
+"""
+tracing.py
+----------
+Lightweight spans and Prometheus histograms for the chat path.
+
+    with span("tool", tool="find_slots") as sp:
+        result = ...
+        sp.labels["ok"] = str(result.get("ok"))
+
+observes the duration in the histogram dentalbot_tool_seconds{tool,ok} and,
+during an HTTP request, appends it to the request's trace (a ContextVar, so
+it follows work into tool worker threads). Every connection gets an
+execute_wrapper when it opens, so DB queries run while a trace is active are
+counted and timed whichever thread runs them (sync_to_async included).
+A streaming response is traced until its body is exhausted or closed.
+
+render() returns every metric in the Prometheus text exposition format;
+api.metrics serves it on /api/metrics/.
+"""
+
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "dentalbot"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labels: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> ([count per bucket..., +Inf], sum)
+        self._series: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(k, list(c), t[0]) for k, (c, t) in sorted(self._series.items())]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%g"' % bound
+                yield f"{self.name}_bucket{_label_text(labels, le)} {cumulative}"
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_label_text(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(labels)} {total:.6f}"
+            yield f"{self.name}_count{_label_text(labels)} {cumulative}"
+
+
+_histograms: Dict[str, Histogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name: str, help: str = "", buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    """The registered histogram PREFIX_<name>, created on first use."""
+    full = f"{PREFIX}_{name}"
+    hist = _histograms.get(full)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(full, Histogram(full, help or name.replace("_", " "), buckets))
+    return hist
+
+
+@dataclass
+class RequestTrace:
+    """Everything recorded while handling one request."""
+    spans: List[Tuple[str, Dict[str, str], float]] = field(default_factory=list)
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add_span(self, name: str, labels: Dict[str, str], seconds: float) -> None:
+        with self._lock:
+            self.spans.append((name, dict(labels), seconds))
+
+    def add_query(self, seconds: float) -> None:
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+    def summary(self) -> Dict[str, float]:
+        """Total milliseconds per span name."""
+        out: Dict[str, float] = {}
+        for name, _, seconds in self.spans:
+            out[name] = out.get(name, 0.0) + seconds * 1000
+        return out
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+class Span:
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.seconds = 0.0
+        self._excluded = 0.0
+
+    def __enter__(self) -> "Span":
+        self._t0 = perf_counter()
+        return self
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """Leave the block's time out of this span, e.g. tools run while a model stream is still open."""
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self._excluded += perf_counter() - t0
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.seconds = perf_counter() - self._t0 - self._excluded
+        if exc_type is not None:
+            self.labels.setdefault("error", exc_type.__name__)
+        histogram(f"{self.name}_seconds", f"Duration of {self.name.replace('_', ' ')} spans").observe(
+            self.seconds, **self.labels
+        )
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(self.name, self.labels, self.seconds)
+
+
+def span(name: str, **labels: str) -> Span:
+    """Time a block into PREFIX_<name>_seconds; labels may be added on the span before it exits."""
+    return Span(name, {k: str(v) for k, v in labels.items()})
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    trace = current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    t0 = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_query(perf_counter() - t0)
+
+
+@receiver(connection_created)
+def _install_query_wrapper(sender, **kwargs):
+    # each thread opens its own connection; wrap them all so queries from
+    # sync_to_async and tool worker threads land in the trace they run under
+    wrappers = kwargs["connection"].execute_wrappers
+    if _query_wrapper not in wrappers:
+        wrappers.append(_query_wrapper)
+
+
+@contextmanager
+def traced_queries():
+    """Count this thread's DB queries into the current trace (no-op if already counting)."""
+    if _query_wrapper in connection.execute_wrappers:
+        yield
+        return
+    with connection.execute_wrapper(_query_wrapper):
+        yield
+
+
+@contextmanager
+def request_trace():
+    """Collect spans and DB queries for one request; yields the RequestTrace."""
+    trace = RequestTrace()
+    token = current_trace.set(trace)
+    try:
+        with traced_queries():
+            yield trace
+    finally:
+        current_trace.reset(token)
+
+
+_END = object()
+
+
+def traced_stream(content, trace: RequestTrace, on_close: Callable[[], None]):
+    """
+    Iterate a streaming response body under `trace` and call on_close() once
+    it is exhausted or closed, so a streamed turn is measured to its last chunk.
+    """
+    if hasattr(content, "__aiter__"):
+        return _atraced_stream(content, trace, on_close)
+    return _traced_stream(content, trace, on_close)
+
+
+def _traced_stream(content, trace, on_close):
+    iterator = iter(content)
+    try:
+        while True:
+            token = current_trace.set(trace)
+            try:
+                with traced_queries():
+                    chunk = next(iterator, _END)
+            finally:
+                current_trace.reset(token)
+            if chunk is _END:
+                return
+            yield chunk
+    finally:
+        on_close()
+
+
+async def _atraced_stream(content, trace, on_close):
+    iterator = content.__aiter__()
+    try:
+        while True:
+            token = current_trace.set(trace)
+            try:
+                chunk = await anext(iterator, _END)
+            finally:
+                current_trace.reset(token)
+            if chunk is _END:
+                return
+            yield chunk
+    finally:
+        on_close()
+
+
+def observe_request(trace: RequestTrace, view: str, method: str, status: int, seconds: float) -> None:
+    labels = {"view": view, "method": method, "status": str(status)}
+    histogram("request_seconds", "HTTP request duration").observe(seconds, **labels)
+    histogram("request_db_queries", "DB queries per request", QUERY_COUNT_BUCKETS).observe(
+        trace.db_queries, view=view
+    )
+    histogram("request_db_seconds", "Time spent in DB queries per request").observe(trace.db_seconds, view=view)
+    if trace.spans:
+        logger.info(
+            "%s %s %s %.1fms db=%d/%.1fms %s",
+            method, view, status, seconds * 1000, trace.db_queries, trace.db_seconds * 1000,
+            " ".join(f"{name}={ms:.1f}ms" for name, ms in trace.summary().items()),
+        )
+
+
+def record_llm_tokens(usage: Dict[str, int], **labels: str) -> None:
+    """Per-call token counts (the dict returned by TokenUsage.record)."""
+    tokens = histogram("llm_tokens", "Tokens per LLM call", TOKEN_BUCKETS)
+    tokens.observe(usage.get("prompt_tokens", 0), kind="input", **labels)
+    tokens.observe(usage.get("cached_tokens", 0), kind="cached", **labels)
+    tokens.observe(usage.get("output_tokens", 0), kind="output", **labels)
+
+
+def render(extra: Sequence[Tuple[str, str, str, float]] = ()) -> str:
+    """
+    Prometheus text format for every histogram, plus `extra` samples given
+    as (name, type, help, value) -- e.g. counters kept elsewhere.
+    """
+    lines: List[str] = []
+    for name, kind, help, value in extra:
+        full = f"{PREFIX}_{name}"
+        # full precision: large token counters must not round to a few digits
+        sample = str(value) if isinstance(value, int) else repr(float(value))
+        lines += [f"# HELP {full} {help}", f"# TYPE {full} {kind}", f"{full} {sample}"]
+    with _histograms_lock:
+        hists = sorted(_histograms.values(), key=lambda h: h.name)
+    for hist in hists:
+        lines.extend(hist.render())
+    return "\n".join(lines) + "\n"
@@ -54,11 +54,23 @@ BOOKING FLOW
    - Ask what type of appointment they want: cleaning, checkup, filling, or emergency.
    - Ask for a preferred date or time range (examples: “next week,” “Tuesday morning”).
    - When both type and date range are known, call:
-     {"tool":"find_slots","parameters":{"type":"<cleaning|checkup|filling|emergency>","date_range":"<phrase>","count":100}}
-5. Show the returned times to the user.
+     {"tool":"find_slots","parameters":{"type":"<cleaning|checkup|filling|emergency>","date_range":"<phrase>","count":5}}
+   - Optional find_slots parameters:
+       "prefer": "earliest" | "morning" | "afternoon" | "evening"
+       "near": "10:30" (or an ISO8601 time) to get the slots closest to a requested time
+       "mode": "summary" to get per-day counts ({"date","count","first","last"}) for wide ranges
+       "cursor": the "next_cursor" of the previous result, when the user wants more options
+5. Show the returned times to the user ("free" is how many chairs are open at that time). If
+   "has_more" is true, offer to show more.
 6. When they confirm one, call:
    {"tool":"book_appointment","parameters":{"patient_info":{...},"type":"<type>","start":"<ISO8601>"}}
 7. Confirm the booking back to them clearly.
+   For several family members at once, pass "family_members":[names] to find_slots (add
+   "together":"same_day" if they do not need to be back to back). Each group gives every member
+   their own time, one after the other; members are never seated at the same time. Book the
+   chosen group with
+   {"tool":"book_family_appointments","parameters":{"type":"<type>","phone":"<phone>","members":[{"name":"<name>","start":"<ISO8601>"}, ...]}}
+   It books everyone or no one.
 8. WHEN TRYING TO BOOK, NOTE THAT THE CURRENT YEAR IS 2025.
 
 ==============================
@@ -127,10 +139,14 @@ When calling a tool:
 - No explanations, markdown, or code fences.
 - When replying to the user, respond only in plain natural language and do not include tool JSON. Never mix both.
 - Appointment types allowed exactly: "cleaning", "checkup", "filling", "emergency".
+- If you need several INDEPENDENT lookups at once (verify_patient, list_appointments, find_slots),
+  you may output several tool JSON objects, one per line. They run together and you get back ONE
+  TOOL_RESULT containing a list of {"tool": ..., "result": ...} in the same order.
+  Never batch a call that needs the result of another call in the same batch.
 
 Valid examples:
 {"tool":"verify_patient","parameters":{"name":"Alice Kim","phone":"6045550101"}}
-{"tool":"find_slots","parameters":{"type":"checkup","date_range":"next week","count":100}}
+{"tool":"find_slots","parameters":{"type":"checkup","date_range":"next week","count":5}}
 
 Invalid examples:
 Great, I've found your record. Here are your upcoming appointments:
@@ -140,6 +156,9 @@ Great, I've found your record. Here are your upcoming appointments:
 AFTER TOOL CALLS
 ==============================
 - Wait for the tool result before continuing.
+- TOOL_RESULT times are clinic-local "YYYY-MM-DDTHH:MM"; pass them back unchanged as "start"/"new_start".
+- Lists in TOOL_RESULT may be columnar: {"cols":["id","start","end"],"rows":[[101,"2025-10-21T09:00","2025-10-21T09:30"], ...]}
+  means each row is one item with those fields.
 - When TOOL_RESULT shows success, summarize clearly (“You’re confirmed for Tuesday at 3 PM”).
 - When TOOL_RESULT shows failure, apologize and guide the user (“That time isn’t available—want to try another day?”).
 
@@ -203,8 +222,23 @@ Assistant: Perfect, I'll look for back-to-back cleaning slots for 2 patients.
 {"tool": "find_slots", "parameters": {
      "type": "cleaning",
      "family_members": ["Bob Singh", "Cara Singh"],
-     "date_range": "same day"
+     "date_range": "next week",
+     "count": 3
  }}
+TOOL_RESULT: {"ok":true,"type":"cleaning","party_size":2,"groups":[{"start":"2025-10-21T09:00","end":"2025-10-21T10:00","starts":["2025-10-21T09:00","2025-10-21T09:30"]}, ...],"has_more":true,"next_cursor":"..."}
+Assistant: I found back-to-back cleanings on Tuesday: Bob at 9:00 AM and Cara at 9:30 AM. Shall I book those?
+User: Yes please. Our number is 604-555-0199.
+→ tool:
+{"tool": "book_family_appointments", "parameters": {
+     "type": "cleaning",
+     "family_name": "Singh",
+     "phone": "604-555-0199",
+     "members": [
+         {"name": "Bob Singh", "start": "2025-10-21T09:00", "relationship": "spouse"},
+         {"name": "Cara Singh", "start": "2025-10-21T09:30", "relationship": "child"}
+     ]
+ }}
+Assistant: You're all set! Bob is booked for 9:00 AM and Cara for 9:30 AM on Tuesday, October 21st.
 """
 
 EMERGENCY_FEWSHOT = """
@@ -286,6 +320,7 @@ PROMPT_MAP = {
     "list_appointments": BASE_PROMPT + LIST_APPOINTMENTS_FEWSHOT,
     "find_slots": BASE_PROMPT + FIND_SLOTS_FEWSHOT,
     "family_booking": BASE_PROMPT + FAMILY_BOOKING_FEWSHOT,
+    "book_family_appointments": BASE_PROMPT + FAMILY_BOOKING_FEWSHOT,
     "emergency": BASE_PROMPT + EMERGENCY_FEWSHOT,
     "general_info": BASE_PROMPT + GENERAL_INFO_FEWSHOT,
     "reschedule_appointment": BASE_PROMPT + RESCHEDULE_APPOINTMENT_FEWSHOT,
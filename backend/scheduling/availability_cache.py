@@ -0,0 +1,199 @@
+"""
+availability_cache.py
+---------------------
+Read-through cache of free Availability rows, one entry per appointment
+type and clinic-local day, in a Django cache alias: LocMemCache keeps it
+per process, Redis or Memcached share it between workers.
+
+    slots = availability_cache.slots("cleaning", start, end, hours=(None, 12))
+
+A range query fetches its days with get_many in batches of 1, 2, 4, ...
+days, so an "earliest slot" lookup that stops on the first day does not
+unpickle the whole window; the days of a batch that miss are loaded with a
+single Availability query over their span and stored with set_many (empty
+days too), so a repeated "next week" costs no DB query.
+Entries hold (id, start, end, local minute of day) rows in start order, so
+results match the Availability query exactly and the preferred-hours filter
+and per-day summaries need no timezone conversion per row.
+
+Invalidation is per (type, day) and runs after the writing transaction
+commits: chat.tools drops the day of each row a booking, reschedule or
+cancellation takes or releases, and generate_availability_window
+drops every day it filled. Each day key carries a version number that
+invalidation increments, so a reader that loaded the day before the commit
+writes its result under the old version, where nobody looks. TTL bounds
+anything else (admin edits, writes that bypass these hooks).
+
+Configured with settings.AVAILABILITY_CACHE; hit rates are in
+availability_cache_stats and on /api/metrics/.
+"""
+
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from appointments.models import Availability
+
+Row = Tuple[int, datetime, datetime, int]
+
+
+@dataclass
+class AvailabilityCacheStats:
+    hits: int = 0
+    misses: int = 0
+    db_loads: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+availability_cache_stats = AvailabilityCacheStats()
+
+
+def _local_midnight(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def _minutes(hours) -> Tuple[int, int]:
+    """Local [from, to) hours as a minute-of-day range."""
+    lo, hi = hours
+    return (0 if lo is None else lo * 60), (24 * 60 if hi is None else hi * 60)
+
+
+def _hhmm(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+class AvailabilityCache:
+    def __init__(self, alias: str = "default", ttl: int = 300, max_days: int = 62,
+                 enabled: bool = True, prefix: str = "availability"):
+        self.alias = alias
+        self.ttl = ttl
+        self.max_days = max_days
+        self.enabled = enabled
+        self.prefix = prefix
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _version_key(self, appt_type: str, day: date) -> str:
+        return f"{self.prefix}:v:{appt_type}:{day.isoformat()}"
+
+    def _data_key(self, appt_type: str, day: date, version) -> str:
+        return f"{self.prefix}:{appt_type}:{day.isoformat()}:{version}"
+
+    def covers(self, start: datetime, end: datetime) -> bool:
+        """Whether [start, end) is worth answering through the cache."""
+        return self.enabled and (timezone.localdate(end) - timezone.localdate(start)).days < self.max_days
+
+    def _days(self, appt_type: str, days: List[date]) -> Dict[date, List[Row]]:
+        cache = self._cache
+        version_keys = {day: self._version_key(appt_type, day) for day in days}
+        versions = cache.get_many(list(version_keys.values()))
+        data_keys = {day: self._data_key(appt_type, day, versions.get(key, 0)) for day, key in version_keys.items()}
+        cached = cache.get_many(list(data_keys.values()))
+
+        out = {day: cached[key] for day, key in data_keys.items() if key in cached}
+        missing = [day for day in days if day not in out]
+        availability_cache_stats.hits += len(out)
+        availability_cache_stats.misses += len(missing)
+        if not missing:
+            return out
+
+        availability_cache_stats.db_loads += 1
+        loaded: Dict[date, List[Row]] = {day: [] for day in missing}
+        rows = (
+            Availability.objects.filter(
+                appointment_type=appt_type,
+                start__gte=_local_midnight(missing[0]),
+                start__lt=_local_midnight(missing[-1] + timedelta(days=1)),
+            )
+            .order_by("start", "id")
+            .values_list("id", "start", "end")
+        )
+        for slot_id, start, end in rows:
+            local = timezone.localtime(start)
+            if local.date() in loaded:
+                loaded[local.date()].append((slot_id, start, end, local.hour * 60 + local.minute))
+        cache.set_many({data_keys[day]: value for day, value in loaded.items()}, self.ttl)
+        out.update(loaded)
+        return out
+
+    def _rows(self, appt_type: str, start: datetime, end: datetime, hours) -> Iterator[Tuple[date, Row]]:
+        first, last = timezone.localdate(start), timezone.localdate(end)
+        days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+        lo, hi = _minutes(hours)
+        done, batch = 0, 1
+        while done < len(days):
+            batch_days = days[done:done + batch]
+            by_day = self._days(appt_type, batch_days)
+            for day in batch_days:
+                edge = day in (first, last)
+                for row in by_day[day]:
+                    if lo <= row[3] < hi and (not edge or (row[1] >= start and row[2] <= end)):
+                        yield day, row
+            done, batch = done + batch, batch * 2
+
+    def slots(self, appt_type: str, start: datetime, end: datetime, hours=(None, None)) -> Iterator[Dict]:
+        """
+        Free rows with start >= `start`, end <= `end` and a start within the
+        local [from, to) hours, in start order -- the Availability query's
+        result. Call covers() first.
+        """
+        for _, (slot_id, slot_start, slot_end, _) in self._rows(appt_type, start, end, hours):
+            yield {"id": slot_id, "start": slot_start, "end": slot_end}
+
+    def day_summary(self, appt_type: str, start: datetime, end: datetime, hours=(None, None)) -> List[Dict]:
+        """
+        Per local day: distinct (start, end) slots -- parallel chairs count
+        once -- and the first/last free start, as find_slots' summary mode.
+        """
+        out: Dict[date, Dict] = {}
+        seen: Set[Tuple[datetime, datetime]] = set()
+        for day, row in self._rows(appt_type, start, end, hours):
+            entry = out.get(day)
+            if entry is None:
+                entry = out[day] = {"date": day.isoformat(), "count": 0, "first": _hhmm(row[3])}
+            if (row[1], row[2]) not in seen:
+                seen.add((row[1], row[2]))
+                entry["count"] += 1
+            entry["last"] = _hhmm(row[3])
+        return list(out.values())
+
+    def invalidate(self, appt_types: Iterable[str], days: Iterable[date]) -> None:
+        """Move each (type, day) to a new version; the old entries are never read again."""
+        if not self.enabled:
+            return
+        cache = self._cache
+        days = list(days)
+        for appt_type in appt_types:
+            for day in days:
+                key = self._version_key(appt_type, day)
+                try:
+                    cache.incr(key)
+                except ValueError:
+                    # unknown or evicted: any fresh value will do
+                    cache.set(key, time.time_ns(), None)
+                availability_cache_stats.invalidations += 1
+
+
+def build_availability_cache() -> AvailabilityCache:
+    conf = getattr(settings, "AVAILABILITY_CACHE", {}) or {}
+    return AvailabilityCache(
+        alias=conf.get("ALIAS", "default"),
+        ttl=int(conf.get("TTL", 300)),
+        max_days=int(conf.get("MAX_DAYS", 62)),
+        enabled=bool(conf.get("ENABLED", False)),
+    )
+
+
+availability_cache = build_availability_cache()
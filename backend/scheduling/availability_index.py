@@ -0,0 +1,351 @@
+"""
+availability_index.py
+---------------------
+In-memory index of free Availability rows for the materialized scheduling
+engine, so find_slots can answer without a range scan.
+
+Per (appointment type, clinic-local day) the index keeps the free 30-minute
+slots as Python int bitmasks, bit i = the slot starting i * 30 minutes after
+local midnight. Parallel chairs (several rows with the same start) are kept
+as stacked layers: layer k has bit i set when at least k + 1 rows are free,
+so layer 0 is "any chair free" and a slot's row count is the number of
+layers holding its bit.
+
+    if availability_index.covers(start, end):
+        free = availability_index.slots("cleaning", start, end, hours=(None, 12))
+
+Range and preferred-hours filters are masks ANDed into each day's layers,
+so the earliest free slot is the lowest set bit of the first non-empty day.
+The index covers today plus HORIZON_DAYS; anything outside that, or a day
+holding a row off the 30-minute grid, is answered from the DB instead.
+
+It is built from one aggregate query on first use and rebuilt after MAX_AGE
+seconds or when the local date changes; one thread rebuilds while the
+others keep reading the previous bitmaps. chat.tools applies bookings,
+cancellations and reschedules after their transaction commits;
+generate_availability_window marks it stale. An update that arrives while a
+rebuild is reading the DB may be missing from that snapshot, so the build
+runs again (up to BUILD_ATTEMPTS times) and, if updates keep arriving,
+replays them onto the new bitmaps. Other processes' writes show up at the
+next rebuild, and bookings are still validated against the DB.
+
+Configured with settings.AVAILABILITY_INDEX.
+"""
+
+import logging
+import sys
+import threading
+from datetime import date, datetime, time, timedelta
+from time import monotonic, perf_counter
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from appointments.models import Availability
+
+logger = logging.getLogger(__name__)
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+# reads of the DB per build before concurrent updates are replayed instead
+BUILD_ATTEMPTS = 3
+
+Key = Tuple[str, date]
+
+
+def _bit(local: datetime) -> Optional[int]:
+    """Grid position of a local start, or None when it is off the 30-minute grid."""
+    if local.minute % SLOT_MINUTES or local.second or local.microsecond:
+        return None
+    return (local.hour * 60 + local.minute) // SLOT_MINUTES
+
+
+def _slot_start(day: date, bit: int) -> datetime:
+    minutes = bit * SLOT_MINUTES
+    return timezone.make_aware(datetime.combine(day, time(minutes // 60, minutes % 60)))
+
+
+def _hours_mask(hours) -> int:
+    lo, hi = hours
+    lo_bit = 0 if lo is None else lo * 60 // SLOT_MINUTES
+    hi_bit = SLOTS_PER_DAY if hi is None else hi * 60 // SLOT_MINUTES
+    return ((1 << hi_bit) - 1) & ~((1 << lo_bit) - 1) if hi_bit > lo_bit else 0
+
+
+def _bits(mask: int) -> Iterator[int]:
+    """Set bit positions, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class AvailabilityIndex:
+    def __init__(self, horizon_days: int = 60, max_age: int = 300, enabled: bool = True):
+        self.horizon_days = horizon_days
+        self.max_age = max_age
+        self.enabled = enabled
+        self._days: Dict[Key, List[int]] = {}
+        # days with rows the grid cannot represent; queries touching them go to the DB
+        self._off_grid: Set[date] = set()
+        self._first: Optional[date] = None
+        self._built_at = 0.0
+        # take/release calls made while build() reads the DB; None when not building
+        self._updates: Optional[List[Tuple[str, Key, int]]] = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.build_seconds = 0.0
+
+    # -- building
+
+    def _window(self, today: date) -> Tuple[datetime, datetime]:
+        first = timezone.make_aware(datetime.combine(today, time.min))
+        return first, timezone.make_aware(datetime.combine(today + timedelta(days=self.horizon_days + 1), time.min))
+
+    def build(self) -> None:
+        """Load today .. today + HORIZON_DAYS from the DB, replacing the current contents."""
+        t0 = perf_counter()
+        for attempt in range(1, BUILD_ATTEMPTS + 1):
+            with self._lock:
+                self._updates = []
+            today, days, off_grid = self._load()
+            with self._lock:
+                updates, self._updates = self._updates, None
+                if updates and attempt < BUILD_ATTEMPTS:
+                    # the snapshot may predate them; read again
+                    continue
+                self._days, self._off_grid, self._first = days, off_grid, today
+                for op, key, bit in updates:
+                    self._apply(op, key, bit)
+                self._built_at = monotonic()
+                self.build_seconds = perf_counter() - t0
+                break
+        logger.info("availability index built: %d type-days, %d off-grid days, %.1fms, ~%d bytes",
+                    len(days), len(off_grid), self.build_seconds * 1000, self.memory_bytes())
+
+    def _load(self) -> Tuple[date, Dict[Key, List[int]], Set[date]]:
+        today = timezone.localdate()
+        lo, hi = self._window(today)
+        days: Dict[Key, List[int]] = {}
+        off_grid: Set[date] = set()
+        rows = (
+            Availability.objects.filter(start__gte=lo, start__lt=hi)
+            .values_list("appointment_type", "start", "end")
+            .annotate(n=Count("id"))
+            .order_by()
+        )
+        for appt_type, start, end, n in rows:
+            local = timezone.localtime(start)
+            bit = _bit(local)
+            if bit is None or end - start != timedelta(minutes=SLOT_MINUTES):
+                off_grid.add(local.date())
+                continue
+            layers = days.setdefault((appt_type, local.date()), [])
+            while len(layers) < n:
+                layers.append(0)
+            for k in range(n):
+                layers[k] |= 1 << bit
+        return today, days, off_grid
+
+    def invalidate(self) -> None:
+        """Rebuild on next use."""
+        with self._lock:
+            self._built_at = 0.0
+
+    def _fresh(self) -> bool:
+        return bool(self._built_at) and monotonic() - self._built_at < self.max_age \
+            and self._first == timezone.localdate()
+
+    def _ensure_fresh(self) -> None:
+        if self._fresh():
+            return
+        # readers keep using the old bitmaps while one thread rebuilds; only
+        # wait for the build when there is nothing to serve yet
+        if not self._build_lock.acquire(blocking=self._first is None):
+            return
+        try:
+            if not self._fresh():
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the bitmaps and their dict."""
+        with self._lock:
+            return sys.getsizeof(self._days) + sum(
+                sys.getsizeof(layers) + sum(sys.getsizeof(layer) for layer in layers)
+                for layers in self._days.values()
+            )
+
+    # -- queries
+
+    def covers(self, start: datetime, end: datetime) -> bool:
+        """Whether [start, end) can be answered from the index."""
+        if not self.enabled:
+            return False
+        self._ensure_fresh()
+        lo, hi = self._window(self._first)
+        if start < lo or end > hi:
+            return False
+        if self._off_grid:
+            first, last = timezone.localdate(start), timezone.localdate(end)
+            if any(first <= day <= last for day in self._off_grid):
+                return False
+        return True
+
+    def _day_masks(self, start: datetime, end: datetime) -> Iterator[Tuple[date, int]]:
+        """(local day, mask of grid slots lying inside [start, end)) for each day of the range."""
+        first, last = timezone.localdate(start), timezone.localdate(end)
+        day = first
+        while day <= last:
+            mask = FULL_DAY
+            if day == first:
+                local = timezone.localtime(start)
+                minutes = local.hour * 60 + local.minute + (1 if local.second or local.microsecond else 0)
+                # first slot starting at or after `start`
+                from_bit = -(-minutes // SLOT_MINUTES)
+                mask &= ~((1 << from_bit) - 1)
+            if day == last:
+                local = timezone.localtime(end)
+                # slots must end by `end`
+                upto = (local.hour * 60 + local.minute) // SLOT_MINUTES
+                mask &= (1 << upto) - 1 if upto > 0 else 0
+            if mask:
+                yield day, mask
+            day += timedelta(days=1)
+
+    def slots(self, appt_type: str, start: datetime, end: datetime, hours=(None, None)) -> Iterator[Dict]:
+        """
+        Free slots in [start, end) within the local [from, to) hours, in start
+        order, one entry per free row -- what the Availability query returns,
+        minus the ids. Call covers() first.
+        """
+        step = timedelta(minutes=SLOT_MINUTES)
+        hours_mask = _hours_mask(hours)
+        for day, mask in self._day_masks(start, end):
+            with self._lock:
+                layers = list(self._days.get((appt_type, day), ()))
+            if not layers:
+                continue
+            mask &= hours_mask
+            for bit in _bits(layers[0] & mask):
+                slot_start = _slot_start(day, bit)
+                free = {"start": slot_start, "end": slot_start + step}
+                yield free
+                for layer in layers[1:]:
+                    if not layer >> bit & 1:
+                        break
+                    yield dict(free)
+
+    def day_summary(self, appt_type: str, start: datetime, end: datetime, hours=(None, None)) -> List[Dict]:
+        """Per local day: free slots (popcount of layer 0) and the first/last free start."""
+        hours_mask = _hours_mask(hours)
+        out = []
+        for day, mask in self._day_masks(start, end):
+            with self._lock:
+                layers = list(self._days.get((appt_type, day), ()))
+            mask &= hours_mask
+            free = layers[0] & mask if layers else 0
+            if not free:
+                continue
+            out.append({
+                "date": day.isoformat(),
+                "count": free.bit_count(),
+                "first": _slot_start(day, (free & -free).bit_length() - 1).strftime("%H:%M"),
+                "last": _slot_start(day, free.bit_length() - 1).strftime("%H:%M"),
+            })
+        return out
+
+    # -- updates (call after the transaction that changed the rows commits)
+
+    def _locate(self, appt_type: str, start: datetime, end: datetime) -> Optional[Tuple[Key, int]]:
+        if not self.enabled:
+            return None
+        local = timezone.localtime(start)
+        bit = _bit(local)
+        if bit is None or end - start != timedelta(minutes=SLOT_MINUTES):
+            # a row the grid cannot hold: answer that day from the DB
+            with self._lock:
+                self._off_grid.add(local.date())
+            return None
+        # before the first build there is nothing to update, but a running build logs it
+        if self._first is not None and not 0 <= (local.date() - self._first).days <= self.horizon_days:
+            return None
+        return (appt_type, local.date()), bit
+
+    def _apply(self, op: str, key: Key, bit: int) -> None:
+        """Take or release one row at `bit` of `key` (caller holds the lock)."""
+        if op == "take":
+            layers = self._days.get(key)
+            if not layers:
+                return
+            for k in range(len(layers) - 1, -1, -1):
+                if layers[k] >> bit & 1:
+                    layers[k] &= ~(1 << bit)
+                    break
+            while layers and not layers[-1]:
+                layers.pop()
+        else:
+            layers = self._days.setdefault(key, [])
+            for k, layer in enumerate(layers):
+                if not layer >> bit & 1:
+                    layers[k] |= 1 << bit
+                    break
+            else:
+                layers.append(1 << bit)
+
+    def _update(self, op: str, appt_type: str, start: datetime, end: datetime) -> None:
+        found = self._locate(appt_type, start, end)
+        if found is None:
+            return
+        key, bit = found
+        with self._lock:
+            self._apply(op, key, bit)
+            if self._updates is not None:
+                self._updates.append((op, key, bit))
+
+    def take(self, appt_type: str, start: datetime, end: datetime) -> None:
+        """One Availability row at this slot was consumed."""
+        self._update("take", appt_type, start, end)
+
+    def release(self, appt_type: str, start: datetime, end: datetime) -> None:
+        """One Availability row was added at this slot."""
+        self._update("release", appt_type, start, end)
+
+    # -- verification
+
+    def verify(self) -> List[str]:
+        """Compare every indexed day with the DB; returns a description of each mismatch."""
+        self._ensure_fresh()
+        with self._lock:
+            snapshot = {key: list(layers) for key, layers in self._days.items()}
+            first = self._first
+        fresh = AvailabilityIndex(self.horizon_days, self.max_age, True)
+        fresh.build()
+        if fresh._first != first:
+            return ["local date changed during verification"]
+        problems = []
+        for key in sorted(set(snapshot) | set(fresh._days)):
+            ours = [layer for layer in snapshot.get(key, []) if layer]
+            theirs = [layer for layer in fresh._days.get(key, []) if layer]
+            if ours != theirs:
+                appt_type, day = key
+                diff = (ours[0] if ours else 0) ^ (theirs[0] if theirs else 0)
+                times = ", ".join(timezone.localtime(_slot_start(day, b)).strftime("%H:%M") for b in _bits(diff))
+                problems.append(f"{appt_type} {day}: {len(ours)} vs {len(theirs)} layers; differs at {times or 'depth'}")
+        return problems
+
+
+def build_availability_index() -> AvailabilityIndex:
+    conf = getattr(settings, "AVAILABILITY_INDEX", {}) or {}
+    return AvailabilityIndex(
+        horizon_days=int(conf.get("HORIZON_DAYS", 60)),
+        max_age=int(conf.get("MAX_AGE", 300)),
+        enabled=bool(conf.get("ENABLED", False)),
+    )
+
+
+availability_index = build_availability_index()
@@ -0,0 +1,169 @@
+"""
+engine.py
+---------
+Computed availability: free slots are derived on the fly from the weekly
+OpeningHours template, ScheduleException closures/openings and the booked
+Appointment rows, instead of being materialized as Availability rows.
+
+    free = (template intervals + OPEN exceptions - CLOSED exceptions) - booked appointments
+
+Every step is a sweep over sorted interval lists, so a query costs
+O(days in range + exceptions + appointments in range).
+
+Usage:
+    from scheduling.engine import free_slots
+    slots = free_slots("cleaning", start, end)   # [(start, end), ...]
+
+Selected with settings.SCHEDULING_ENGINE = "computed"; see chat.tools.
+"""
+
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from appointments.models import Appointment, OpeningHours, ScheduleException
+
+SLOT_MINUTES = 30
+
+Interval = Tuple[datetime, datetime]
+# (start, end, slot_minutes, anchor): an open interval, the slot length used to
+# cut it into bookable slots and the opening time the slot grid is aligned to
+Opening = Tuple[datetime, datetime, int, datetime]
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "SCHEDULING_ENGINE", "materialized") == "computed"
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Merge intervals into a sorted list of disjoint blocks."""
+    merged: List[Interval] = []
+    for a0, a1 in sorted(intervals):
+        if merged and a0 <= merged[-1][1]:
+            if a1 > merged[-1][1]:
+                merged[-1] = (merged[-1][0], a1)
+        else:
+            merged.append((a0, a1))
+    return merged
+
+
+def subtract_intervals(base: List[Interval], busy: List[Interval]) -> List[Interval]:
+    """
+    base minus busy. Both lists must be sorted; busy must be disjoint
+    (see merge_intervals). One forward sweep over both lists.
+    """
+    out: List[Interval] = []
+    j = 0
+    for b0, b1 in base:
+        while j < len(busy) and busy[j][1] <= b0:
+            j += 1
+        cur = b0
+        k = j
+        while k < len(busy) and busy[k][0] < b1:
+            if busy[k][0] > cur:
+                out.append((cur, busy[k][0]))
+            cur = max(cur, busy[k][1])
+            k += 1
+        if cur < b1:
+            out.append((cur, b1))
+    return out
+
+
+def _type_filter(appt_type: str) -> Q:
+    return Q(appointment_type=appt_type) | Q(appointment_type__isnull=True) | Q(appointment_type="")
+
+
+def opening_intervals(appt_type: str, start: datetime, end: datetime) -> List[Opening]:
+    """Template + exception opening intervals for a type, clipped to [start, end)."""
+    tz = timezone.get_current_timezone()
+    templates = {}
+    for row in OpeningHours.objects.filter(_type_filter(appt_type)):
+        templates.setdefault(row.weekday, []).append(row)
+
+    openings: List[Opening] = []
+    day = timezone.localtime(start, tz).date()
+    last_day = timezone.localtime(end, tz).date()
+    while day <= last_day:
+        for row in templates.get(day.weekday(), ()):
+            o0 = datetime.combine(day, row.open_time, tzinfo=tz)
+            o1 = datetime.combine(day, row.close_time, tzinfo=tz)
+            openings.append((o0, o1, row.slot_minutes, o0))
+        day += timedelta(days=1)
+
+    exceptions = ScheduleException.objects.filter(_type_filter(appt_type), start__lt=end, end__gt=start)
+    closed = merge_intervals((e.start, e.end) for e in exceptions if e.kind == ScheduleException.Kind.CLOSED)
+    openings += [(e.start, e.end, SLOT_MINUTES, e.start) for e in exceptions if e.kind == ScheduleException.Kind.OPEN]
+    openings.sort()
+
+    result: List[Opening] = []
+    for o0, o1, minutes, anchor in openings:
+        o0, o1 = max(o0, start), min(o1, end)
+        if o0 >= o1:
+            continue
+        result.extend((f0, f1, minutes, anchor) for f0, f1 in subtract_intervals([(o0, o1)], closed))
+    return result
+
+
+def busy_intervals(
+    appt_type: str, start: datetime, end: datetime, exclude_appointment_id: Optional[int] = None
+) -> List[Interval]:
+    """Booked appointments of a type overlapping [start, end), merged."""
+    qs = Appointment.objects.filter(
+        type=appt_type, status=Appointment.Status.BOOKED, start__lt=end, end__gt=start
+    )
+    if exclude_appointment_id is not None:
+        qs = qs.exclude(id=exclude_appointment_id)
+    return merge_intervals(qs.values_list("start", "end"))
+
+
+def _cut_slots(anchor: datetime, f0: datetime, f1: datetime, minutes: int) -> List[Interval]:
+    """Cut free fragment [f0, f1) into slots aligned to the opening time `anchor`."""
+    step = timedelta(minutes=minutes)
+    offset = (f0 - anchor) % step
+    t = f0 if not offset else f0 + (step - offset)
+    slots = []
+    while t + step <= f1:
+        slots.append((t, t + step))
+        t += step
+    return slots
+
+
+def free_slots(
+    appt_type: str,
+    start: datetime,
+    end: datetime,
+    exclude_appointment_id: Optional[int] = None,
+) -> List[Interval]:
+    """All free (start, end) slots of a type fully inside [start, end), in order."""
+    openings = opening_intervals(appt_type, start, end)
+    if not openings:
+        return []
+    busy = busy_intervals(appt_type, start, end, exclude_appointment_id)
+    slots: List[Interval] = []
+    for o0, o1, minutes, anchor in openings:
+        for f0, f1 in subtract_intervals([(o0, o1)], busy):
+            slots.extend(_cut_slots(anchor, f0, f1, minutes))
+    # overlapping templates (per-type and all-types) can yield the same slot twice
+    return sorted(set(slots))
+
+
+def find_free_slot(
+    appt_type: str,
+    start: datetime,
+    tolerance: timedelta = timedelta(minutes=30),
+    exclude_appointment_id: Optional[int] = None,
+) -> Optional[Interval]:
+    """The free slot starting exactly at `start`, else the earliest one starting within +/- tolerance."""
+    # leave room past the last candidate start for the slot's own length
+    window_end = start + tolerance + timedelta(days=1)
+    candidates = [
+        s for s in free_slots(appt_type, start - tolerance, window_end, exclude_appointment_id)
+        if abs(s[0] - start) <= tolerance
+    ]
+    for s in candidates:
+        if s[0] == start:
+            return s
+    return candidates[0] if candidates else None
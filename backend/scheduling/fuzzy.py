@@ -5,31 +5,57 @@ Lightweight fuzzy date/time parsing helpers for scheduling.
 Converts phrases like "later next week", "tomorrow morning", "next Friday afternoon"
 into concrete timezone-aware [start, end) ranges you can query against Availability.
 
+Common phrases (relative days, weekdays, parts of day, "next N days/weeks",
+explicit dates and ISO timestamps) are resolved locally by a small rule-based
+parser; only phrases it cannot resolve are sent to the LLM. LLM answers are
+memoized in a bounded cache keyed by the normalized phrase, the current local
+hour and the business hours, so repeated phrases skip the round trip.
+
+Business hours and open weekdays default to settings.CLINIC_HOURS, the same
+source create_timeslots and the seeded OpeningHours template use.
+
 Usage:
     from scheduling.fuzzy import parse_fuzzy_date_range
     start, end = parse_fuzzy_date_range("later next week")
 """
 
+import hashlib
 import json
 import re
-from dataclasses import dataclass
-from datetime import datetime, timedelta, time, timezone
-from typing import Optional, Tuple
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from time import monotonic, time_ns
+from datetime import date, datetime, timedelta, time, timezone
+from typing import FrozenSet, Optional, Tuple, Union
 
+from django.conf import settings
 from django.utils import timezone as dj_tz  # assume Django timezone is present
 
-from google import genai 
 from google.genai import types
+from chat.deadline import current_deadline
+from chat.llm import get_llm_client
+from chat.tracing import span
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env")
 
-client = genai.Client()
+client = get_llm_client()
+
+SLOT_MINUTES = 30
+
+def _clinic_hours() -> dict:
+    return getattr(settings, "CLINIC_HOURS", {}) or {}
+
 
 @dataclass
 class FuzzyContext:
     """Minimal context used by the LLM: business hours and a clock source."""
-    open_time: time = time(hour=9, minute=0)
-    close_time: time = time(hour=17, minute=0)
+    open_time: time = field(default_factory=lambda: time(hour=int(_clinic_hours().get("OPEN_HOUR", 8))))
+    close_time: time = field(default_factory=lambda: time(hour=int(_clinic_hours().get("CLOSE_HOUR", 18))))
+    # 0 = Monday
+    open_weekdays: FrozenSet[int] = field(
+        default_factory=lambda: frozenset(_clinic_hours().get("WEEKDAYS", range(6)))
+    )
 
     def get_now(self) -> datetime:
         return dj_tz.now()
@@ -55,12 +81,19 @@ def _llm_parse_range(text: str, now: datetime, ctx: FuzzyContext) -> Tuple[datet
         "Q: 'next week' → A: {\"start\": \"2022-11-20T09:00:00+00:00\", \"end\": \"2022-11-24T17:00:00+00:00\"}\n"
     )
 
+    # inside a chat turn, don't outlive the turn's latency budget
+    deadline = current_deadline.get()
+    config = None
+    if deadline is not None:
+        config = types.GenerateContentConfig(http_options=types.HttpOptions(timeout=deadline.timeout_ms()))
+
     completion = client.models.generate_content(
         model="gemini-2.5-flash",
         contents=json.dumps([
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt},
                 ]),
+        config=config,
     )
     
     cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", completion.text.strip())
@@ -68,14 +101,468 @@ def _llm_parse_range(text: str, now: datetime, ctx: FuzzyContext) -> Tuple[datet
 
     return datetime.fromisoformat(parsed["start"]), datetime.fromisoformat(parsed["end"])
 
+# --------------------------------------------------------------------------- #
+# RULE-BASED FAST PATH
+# --------------------------------------------------------------------------- #
+
+WEEKDAYS = {
+    "monday": 0, "mon": 0,
+    "tuesday": 1, "tue": 1, "tues": 1,
+    "wednesday": 2, "wed": 2,
+    "thursday": 3, "thu": 3, "thur": 3, "thurs": 3,
+    "friday": 4, "fri": 4,
+    "saturday": 5, "sat": 5,
+    "sunday": 6, "sun": 6,
+}
+
+MONTHS = {
+    "january": 1, "jan": 1,
+    "february": 2, "feb": 2,
+    "march": 3, "mar": 3,
+    "april": 4, "apr": 4,
+    "may": 5,
+    "june": 6, "jun": 6,
+    "july": 7, "jul": 7,
+    "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9,
+    "october": 10, "oct": 10,
+    "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "couple of": 2,
+}
+
+# (start, end) bounds for each part of the day; None means "use business hours".
+PARTS_OF_DAY = {
+    "morning": (None, time(12, 0)),
+    "midday": (time(11, 0), time(13, 0)),
+    "noon": (time(11, 0), time(13, 0)),
+    "lunchtime": (time(11, 0), time(13, 0)),
+    "afternoon": (time(12, 0), None),
+    "evening": (time(16, 0), None),
+}
+
+_WEEKDAY_RE = "|".join(sorted(WEEKDAYS, key=len, reverse=True))
+_MONTH_RE = "|".join(sorted(MONTHS, key=len, reverse=True))
+_NUMBER_RE = r"\d+|" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True))
+
+PART_OF_DAY_RE = re.compile(
+    r"\b(?:in the |during the |early |late |this )?(" + "|".join(PARTS_OF_DAY) + r")s?\b"
+)
+CLOCK_TIME_RE = re.compile(r"\b(?:at |around |@ ?)?(\d{1,2})(?::(\d{2}))? ?(am|pm)\b|\b(?:at |around )?(\d{1,2}):(\d{2})\b")
+NEXT_N_RE = re.compile(r"^(?:within |in |over )?(?:the )?(?:next|coming) (" + _NUMBER_RE + r") (day|week)s?$")
+IN_N_DAYS_RE = re.compile(r"^in (" + _NUMBER_RE + r") (day|week)s?$")
+WEEKDAY_RE = re.compile(r"^(?:(this|next|coming|on) )?(" + _WEEKDAY_RE + r")$")
+WEEK_RE = re.compile(r"^(early |later |late |end of |the end of )?(this|next|the coming) week$")
+MONTH_DAY_RE = re.compile(r"^(" + _MONTH_RE + r") (\d{1,2})(?:st|nd|rd|th)?(?: (\d{4}))?$")
+DAY_MONTH_RE = re.compile(r"^(?:the )?(\d{1,2})(?:st|nd|rd|th)? (?:of )?(" + _MONTH_RE + r")(?: (\d{4}))?$")
+NUMERIC_DATE_RE = re.compile(r"^(\d{1,2})/(\d{1,2})(?:/(\d{2}|\d{4}))?$")
+
+_FILLER_RE = re.compile(r"\b(?:sometime|some time|anytime|any time|please|on)\b")
+
+DayOrSpan = Union[date, Tuple[date, date]]
+
+
+def _normalize_phrase(text: str) -> str:
+    s = (text or "").strip().lower()
+    s = re.sub(r"[,.!?]", " ", s)
+    s = re.sub(r"(?<=\d)(st|nd|rd|th)\b", "", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def _to_number(token: str) -> int:
+    return int(token) if token.isdigit() else NUMBER_WORDS[token]
+
+
+def _at(day: date, t: time, tz) -> datetime:
+    return datetime.combine(day, t, tzinfo=tz)
+
+
+def _parse_iso(text: str, tz) -> Optional[Union[date, datetime]]:
+    """Accept ISO-8601 dates and datetimes; naive datetimes take the local timezone."""
+    s = text.strip()
+    if not re.match(r"^\d{4}-\d{2}-\d{2}", s):
+        return None
+    try:
+        if len(s) == 10:
+            return date.fromisoformat(s)
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=tz)
+
+
+def _resolve_date(month: int, day: int, year: Optional[int], today: date) -> Optional[date]:
+    """Build a date; without an explicit year, roll past dates into next year."""
+    try:
+        if year is not None:
+            return date(year if year >= 100 else 2000 + year, month, day)
+        d = date(today.year, month, day)
+        return d if d >= today else date(today.year + 1, month, day)
+    except ValueError:
+        return None
+
+
+def _parse_day_expr(s: str, today: date) -> Optional[DayOrSpan]:
+    """Resolve the date part of a phrase to a single day or an inclusive (first, last) span."""
+    if s in ("today", "this day"):
+        return today
+    if s in ("tomorrow", "tmr", "tmrw"):
+        return today + timedelta(days=1)
+    if s in ("day after tomorrow", "the day after tomorrow"):
+        return today + timedelta(days=2)
+
+    m = IN_N_DAYS_RE.match(s)
+    if m:
+        n = _to_number(m.group(1)) * (7 if m.group(2) == "week" else 1)
+        return today + timedelta(days=n) if n else None
+
+    m = NEXT_N_RE.match(s)
+    if m:
+        n = _to_number(m.group(1)) * (7 if m.group(2) == "week" else 1)
+        return (today, today + timedelta(days=n)) if n else None
+
+    m = WEEKDAY_RE.match(s)
+    if m:
+        qualifier, target = m.group(1), WEEKDAYS[m.group(2)]
+        ahead = (target - today.weekday()) % 7
+        if qualifier in ("next", "coming") and ahead == 0:
+            ahead = 7
+        return today + timedelta(days=ahead)
+
+    m = WEEK_RE.match(s)
+    if m:
+        modifier = (m.group(1) or "").strip()
+        monday = today - timedelta(days=today.weekday())
+        if m.group(2) != "this":
+            monday += timedelta(days=7)
+        first, last = monday, monday + timedelta(days=6)
+        if modifier == "early":
+            last = monday + timedelta(days=2)
+        elif modifier in ("later", "late"):
+            first = monday + timedelta(days=3)
+        elif modifier in ("end of", "the end of"):
+            first = monday + timedelta(days=4)
+        # never start a span in the past
+        first = max(first, today)
+        return (first, last) if first <= last else None
+
+    if s in ("this month", "next month"):
+        first = today.replace(day=1)
+        if s == "next month":
+            first = (first + timedelta(days=32)).replace(day=1)
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return (max(first, today), last)
+
+    m = MONTH_DAY_RE.match(s)
+    if m:
+        year = int(m.group(3)) if m.group(3) else None
+        return _resolve_date(MONTHS[m.group(1)], int(m.group(2)), year, today)
+
+    m = DAY_MONTH_RE.match(s)
+    if m:
+        year = int(m.group(3)) if m.group(3) else None
+        return _resolve_date(MONTHS[m.group(2)], int(m.group(1)), year, today)
+
+    m = NUMERIC_DATE_RE.match(s)
+    if m:
+        year = int(m.group(3)) if m.group(3) else None
+        return _resolve_date(int(m.group(1)), int(m.group(2)), year, today)
+
+    iso = _parse_iso(s, None)
+    if isinstance(iso, date) and not isinstance(iso, datetime):
+        return iso
+    return None
+
+
+def _next_open_day(day: date, ctx: FuzzyContext) -> date:
+    """The first day after `day` the clinic opens (the next day if no weekday is open)."""
+    for ahead in range(1, 8):
+        candidate = day + timedelta(days=ahead)
+        if candidate.weekday() in ctx.open_weekdays:
+            return candidate
+    return day + timedelta(days=1)
+
+
+def _rule_parse_range(text: str, now: datetime, ctx: FuzzyContext) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Deterministically resolve common phrases into a [start, end) range within
+    business hours. Returns None for anything outside the supported grammar,
+    for clock times outside business hours and for a named day whose hours are
+    already over, so the caller can fall back to the LLM.
+    """
+    local_now = dj_tz.localtime(now) if dj_tz.is_aware(now) else now
+    tz = local_now.tzinfo
+    today = local_now.date()
+
+    iso = _parse_iso(text, tz)
+    if isinstance(iso, datetime):
+        return iso, iso + timedelta(minutes=SLOT_MINUTES)
+
+    s = _normalize_phrase(text)
+
+    # pull out an explicit clock time ("at 3pm", "10:30") and a part of the day ("morning")
+    clock: Optional[time] = None
+    m = CLOCK_TIME_RE.search(s)
+    if m:
+        if m.group(1):
+            hour, minute, meridiem = int(m.group(1)), int(m.group(2) or 0), m.group(3)
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if meridiem == "pm" else 0)
+        else:
+            hour, minute = int(m.group(4)), int(m.group(5))
+        if hour > 23 or minute > 59:
+            return None
+        clock = time(hour, minute)
+        s = (s[:m.start()] + " " + s[m.end():]).strip()
+
+    part: Optional[str] = None
+    m = PART_OF_DAY_RE.search(s)
+    if m:
+        part = m.group(1)
+        s = (s[:m.start()] + " " + s[m.end():]).strip()
+
+    s = re.sub(r"\s+", " ", _FILLER_RE.sub(" ", s)).strip()
+    # a bare time of day ("at 3pm", "this morning") means its next occurrence
+    implicit_day = not s
+    if implicit_day:
+        if clock is None and part is None:
+            return None
+        s = "today"
+
+    day_or_span = _parse_day_expr(s, today)
+    if day_or_span is None:
+        return None
+
+    if isinstance(day_or_span, tuple):
+        if clock is not None or part is not None:
+            return None
+        first, last = day_or_span
+        if first == today and local_now >= _at(today, ctx.close_time, tz):
+            # today's hours are over: the span starts with the next day
+            first += timedelta(days=1)
+        # spans start and end on days the clinic is open
+        while first <= last and first.weekday() not in ctx.open_weekdays:
+            first += timedelta(days=1)
+        while last >= first and last.weekday() not in ctx.open_weekdays:
+            last -= timedelta(days=1)
+        if first > last:
+            return None
+        start = _at(first, ctx.open_time, tz)
+        if first == today:
+            start = max(start, local_now)
+        return start, _at(last, ctx.close_time, tz)
+
+    day = day_or_span
+    if implicit_day and day.weekday() not in ctx.open_weekdays:
+        day = _next_open_day(day, ctx)
+    if clock is not None:
+        start = _at(day, clock, tz)
+        end = start + timedelta(minutes=SLOT_MINUTES)
+        if start < _at(day, ctx.open_time, tz) or end > _at(day, ctx.close_time, tz):
+            return None
+        if start < local_now:
+            if not implicit_day:
+                return None
+            shift = _next_open_day(today, ctx) - today
+            start, end = start + shift, end + shift
+        return start, end
+
+    lo, hi = PARTS_OF_DAY[part] if part else (None, None)
+    start_t = max(lo or ctx.open_time, ctx.open_time)
+    end_t = min(hi or ctx.close_time, ctx.close_time)
+    if start_t >= end_t:
+        return None
+    start, end = _at(day, start_t, tz), _at(day, end_t, tz)
+    if day == today:
+        if end <= local_now:
+            if not implicit_day:
+                # "today" or "friday" after closing time
+                return None
+            shift = _next_open_day(today, ctx) - today
+            start, end = start + shift, end + shift
+        else:
+            start = max(start, local_now)
+    return start, end
+
+
+# --------------------------------------------------------------------------- #
+# LLM RESULT CACHE
+# --------------------------------------------------------------------------- #
+
+Range = Tuple[datetime, datetime]
+
+
+class LocalRangeCache:
+    """In-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: int = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Range]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Range]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Range) -> None:
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoRangeCache:
+    """
+    Shares resolved ranges between workers through a Django cache alias.
+    Keys carry a generation number so clear() only drops this cache's
+    entries, not everything else stored in the alias.
+    """
+
+    def __init__(self, alias: str = "default", ttl: int = 3600, prefix: str = "fuzzy-range"):
+        self.alias = alias
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @property
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    @property
+    def _generation_key(self) -> str:
+        return f"{self.prefix}:generation"
+
+    def _key(self, key: str) -> str:
+        generation = self._cache.get(self._generation_key, 0)
+        # cache keys must be short and free of spaces for memcached-style backends
+        return f"{self.prefix}:{generation}:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def get(self, key: str) -> Optional[Range]:
+        return self._cache.get(self._key(key))
+
+    def set(self, key: str, value: Range) -> None:
+        self._cache.set(self._key(key), value, self.ttl)
+
+    def clear(self) -> None:
+        # move to a new generation; the old entries are never read again and expire
+        try:
+            self._cache.incr(self._generation_key)
+        except ValueError:
+            self._cache.set(self._generation_key, time_ns(), None)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, hit: bool) -> None:
+        # lookups happen on request and tool-pool threads
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def _build_range_cache():
+    """Create the cache backend described by settings.FUZZY_RANGE_CACHE."""
+    conf = getattr(settings, "FUZZY_RANGE_CACHE", {}) or {}
+    backend = conf.get("BACKEND", "local")
+    ttl = int(conf.get("TTL", 3600))
+    if backend == "django":
+        return DjangoRangeCache(alias=conf.get("ALIAS", "default"), ttl=ttl)
+    if backend == "local":
+        return LocalRangeCache(maxsize=int(conf.get("MAXSIZE", 1024)), ttl=ttl)
+    raise ValueError(f"unknown FUZZY_RANGE_CACHE backend: {backend}")
+
+
+_range_cache = None
+_range_cache_lock = threading.Lock()
+cache_stats = CacheStats()
+
+
+def get_range_cache():
+    global _range_cache
+    if _range_cache is None:
+        with _range_cache_lock:
+            if _range_cache is None:
+                _range_cache = _build_range_cache()
+    return _range_cache
+
+
+def set_range_cache(cache) -> None:
+    """Swap the cache backend (any object with get/set/clear), e.g. from tests or AppConfig.ready()."""
+    global _range_cache
+    _range_cache = cache
+
+
+def range_cache_key(text: str, now: datetime, ctx: FuzzyContext) -> str:
+    """
+    Key a phrase by its normalized text, the local hour it was asked in and the
+    business hours, so cached answers roll over as the clock moves.
+    """
+    local_now = dj_tz.localtime(now) if dj_tz.is_aware(now) else now
+    bucket = local_now.strftime("%Y-%m-%dT%H")
+    hours = f"{ctx.open_time.isoformat()}-{ctx.close_time.isoformat()}/{''.join(map(str, sorted(ctx.open_weekdays)))}"
+    return f"{bucket}|{hours}|{_normalize_phrase(text)}"
+
+
+def _cached_llm_parse_range(text: str, now: datetime, ctx: FuzzyContext) -> Range:
+    cache = get_range_cache()
+    key = range_cache_key(text, now, ctx)
+    rng = cache.get(key)
+    cache_stats.record(rng is not None)
+    if rng is not None:
+        return rng
+    with span("llm_call", purpose="fuzzy_parse"):
+        rng = _llm_parse_range(text, now, ctx)
+    cache.set(key, rng)
+    return rng
+
+
 def parse_fuzzy_date_range(text: str, ctx: Optional[FuzzyContext] = None) -> Tuple[datetime, datetime]:
     """
-    Parse a human time phrase into a concrete [start, end) datetime range using the LLM.
-    If the LLM call raises, the exception will propagate to the caller.
+    Parse a human time phrase into a concrete [start, end) datetime range.
+    Common phrases are resolved locally; anything else is sent to the LLM
+    (through the range cache). If the LLM call raises, the exception will
+    propagate to the caller and nothing is cached.
     """
     ctx = ctx or FuzzyContext()
     now = ctx.get_now()
-    return _llm_parse_range(text, now, ctx)
+    with span("fuzzy_parse") as sp:
+        rng = _rule_parse_range(text, now, ctx)
+        if rng is not None:
+            sp.labels["source"] = "rule"
+            return rng
+        # range cache hits and LLM calls
+        sp.labels["source"] = "model"
+        return _cached_llm_parse_range(text, now, ctx)
 
 
 def human_range(start: datetime, end: datetime) -> str:
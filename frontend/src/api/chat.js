@@ -1,11 +1,27 @@
 const BASE = import.meta.env.VITE_API_BASE ?? ""; // e.g. "http://localhost:8000"
 
-export async function postChat(flow, messages) {
+// Session mode: the server keeps the history and the routed flow
+// (backend chat/sessions.py); each request carries only the new message.
+async function post(body) {
   const res = await fetch(`${BASE}/api/chat/`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ flow, messages }),
+    body: JSON.stringify(body),
   });
-  if (!res.ok) throw new Error(`Chat error ${res.status}`);
-  return await res.json(); // { reply: string } in your current backend
+  if (!res.ok) {
+    const err = new Error(`Chat error ${res.status}`);
+    err.status = res.status;
+    throw err;
+  }
+  return await res.json(); // { reply, assistant_chain?, conversation_id }
+}
+
+// Opens a conversation; the reply is the menu.
+export function startChat() {
+  return post({ message: "" });
+}
+
+// 404 means the conversation expired on the server (CHAT_SESSION_STORE TTL).
+export function sendMessage(conversationId, message) {
+  return post({ conversation_id: conversationId, message });
 }